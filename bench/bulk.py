@@ -0,0 +1,39 @@
+""" Compare the bulk insert methods on the same synthetic data. Each
+method loads the rows into an empty dataset; ``copy`` is only tried on
+PostgreSQL.
+
+    python -m bench.bulk --rows 200000 --db postgresql://localhost/bench
+"""
+import argparse
+import time
+
+from spendb.core import app, db
+from bench.synthetic import MODEL, rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--db', default='sqlite:////tmp/spendb_bench_bulk.db')
+    args = parser.parse_args()
+    app.config['SQLALCHEMY_DATABASE_URI'] = args.db
+
+    from spendb.model import Dataset
+    from spendb.model.bulk import METHODS
+    db.create_all()
+    dataset = Dataset(MODEL)
+    dataset.generate()
+    for method in METHODS:
+        if method == 'copy' and dataset.bind.dialect.name != 'postgresql':
+            continue
+        app.config['BULK_INSERT_METHOD'] = method
+        dataset.flush()
+        begin = time.time()
+        dataset.load_all(rows(args.rows), chunk_size=args.chunk_size)
+        duration = time.time() - begin
+        print "%-12s %8d rows in %6.2fs (%9.1f rows/sec)" % (method,
+                args.rows, duration, args.rows / duration)
+    app.config['BULK_INSERT_METHOD'] = None
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+""" Compare the SQL and the in-memory cube aggregation engines.
+
+    python -m bench.cube --rows 2000000 --db /tmp/bench.db
+"""
+import argparse
+import os
+import time
+
+from spendb.core import app, db
+from bench.synthetic import MODEL, rows
+
+QUERIES = [
+    {},
+    {'drilldowns': ['function']},
+    {'drilldowns': ['to.name'], 'pagesize': 100},
+    {'drilldowns': ['time', 'field'], 'cuts': [('function.name', u'f1')]},
+    {'drilldowns': ['function.name'], 'cuts': [('time', u'2005'),
+                                               ('time', u'2006')]},
+    ]
+
+def timed(func, *a, **kw):
+    begin = time.time()
+    result = func(*a, **kw)
+    return result, time.time() - begin
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--db', default='/tmp/spendb_bench_cube.db')
+    args = parser.parse_args()
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + args.db
+
+    from spendb.model import Dataset
+    from spendb.model.cube import Cube
+    db.create_all()
+    dataset = Dataset(MODEL)
+    dataset.generate()
+    q = db.select([db.func.count(dataset.table.c.id)])
+    count = db.engine.execute(q).scalar()
+    if count != args.rows:
+        dataset.flush()
+        _, duration = timed(dataset.load_all, rows(args.rows),
+                            chunk_size=10000)
+        print "load: %d rows in %.1fs" % (args.rows, duration)
+
+    cube = Cube(dataset)
+    _, duration = timed(cube.refresh)
+    print "cube refresh: %.2fs" % duration
+    print "%-70s %10s %10s" % ('query', 'sql', 'cube')
+    for query in QUERIES:
+        kwargs = dict(metric='amount', drilldowns=None, cuts=None, page=1,
+                      pagesize=10000, order=None)
+        kwargs.update(query)
+        sql, sql_time = timed(dataset._aggregate, **kwargs)
+        res, cube_time = timed(cube.aggregate, **kwargs)
+        assert sql['summary']['num_entries'] == res['summary']['num_entries']
+        print "%-70s %9.3fs %9.3fs" % (repr(query)[:70], sql_time, cube_time)
+
+if __name__ == '__main__':
+    main()
+
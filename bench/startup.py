@@ -0,0 +1,58 @@
+""" Measure the time it takes to import the command line interface, and
+check that it does not load the subsystems which only some commands need.
+
+    python -m bench.startup --runs 20 --max 1.0
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+MODULE = 'spendb.manage'
+LAZY = ['migrate', 'celery', 'flaskext.celery', 'numpy', 'sqlite3']
+
+SCRIPT = """
+import json, sys, time
+begin = time.time()
+import %s
+print json.dumps({'duration': time.time() - begin,
+                  'modules': sorted(sys.modules.keys())})
+"""
+
+def measure(module=MODULE):
+    """ Import ``module`` in a fresh interpreter, returning the import time
+    and the names of the modules which were loaded. """
+    out = subprocess.check_output([sys.executable, '-c', SCRIPT % module])
+    data = json.loads(out.strip().split('\n')[-1])
+    return data['duration'], data['modules']
+
+def loaded_lazy(modules):
+    """ List the modules in ``LAZY`` which were imported eagerly. """
+    return [m for m in LAZY if m in modules]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--max', type=float, default=None,
+                        help='fail if the median import time (s) exceeds this')
+    parser.add_argument('--module', default=MODULE)
+    args = parser.parse_args()
+
+    durations = []
+    for i in range(args.runs):
+        duration, modules = measure(args.module)
+        durations.append(duration)
+    durations.sort()
+    median = durations[len(durations) / 2]
+    print "import %s: median %.3fs, min %.3fs, max %.3fs (%d modules)" % \
+        (args.module, median, durations[0], durations[-1], len(modules))
+    eager = loaded_lazy(modules)
+    if len(eager):
+        print "loaded eagerly: %s" % ', '.join(eager)
+        sys.exit(1)
+    if args.max is not None and median > args.max:
+        print "slower than %.3fs" % args.max
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
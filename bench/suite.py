@@ -0,0 +1,215 @@
+""" Measure loading, aggregation and materialization on a synthetic
+dataset, and store the results as JSON to compare runs over time.
+
+    python -m bench.suite --shape bund --rows 1000000 \\
+        --cardinality titel=20000,to=30 --out bund-1m.json --compare old.json
+"""
+from itertools import islice
+import argparse
+import json
+import platform
+import resource
+import sys
+import threading
+import time
+
+import sqlalchemy
+
+from spendb.core import app, db
+from spendb.model import Dataset
+from spendb.model.cache import get_cache
+from bench.synthetic import SHAPES, cardinalities, generate
+
+REPEATS = 5
+
+def peak_memory():
+    """ The peak resident set size of this process, in kB. """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def current_memory():
+    """ The resident set size of this process in kB, or ``None`` where
+    ``/proc`` is not available. """
+    try:
+        fh = open('/proc/self/statm', 'rb')
+        try:
+            pages = int(fh.read().split()[1])
+        finally:
+            fh.close()
+    except (IOError, ValueError, IndexError):
+        return None
+    return pages * resource.getpagesize() / 1024
+
+class MemoryWatch(object):
+    """ Sample the resident set size while a phase runs, and record its
+    peak increase over the size at the start in ``increase`` (kB). Unlike
+    ``ru_maxrss``, this is not masked by the peak of an earlier phase. """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.increase = None
+
+    def __enter__(self):
+        self.start = self.peak = current_memory()
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        if self.start is not None:
+            self.thread.start()
+        return self
+
+    def _sample(self):
+        self.peak = max(self.peak, current_memory())
+
+    def _run(self):
+        while not self.done.wait(self.interval):
+            self._sample()
+
+    def __exit__(self, *exc):
+        if self.start is None:
+            return
+        self.done.set()
+        self.thread.join()
+        self._sample()
+        self.increase = self.peak - self.start
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) / 2]
+
+def queries(dataset):
+    """ A typical mix of aggregations for ``dataset``: the total, one and
+    two level drilldowns, and cuts on a member and on the time. """
+    def key(name):
+        return name + '.name' if hasattr(dataset[name], 'table') else name
+    def named(dim):
+        attributes = getattr(dim, 'attributes', None)
+        return attributes is None or 'name' in [a.name for a in attributes]
+    # member dimensions first, as they need joins:
+    dims = sorted([d.name for d in dataset.dimensions if named(d) and \
+                   d.name != 'time'], key=lambda n: (key(n) == n, n))
+    first, second = (dims * 2)[:2]
+    member = dataset[second].members(dataset.bind).next()
+    if isinstance(member, dict):
+        member = member['name']
+    year = dataset['time'].members(dataset.bind).next()
+    return [
+        {},
+        {'drilldowns': ['time']},
+        {'drilldowns': [key(first)], 'pagesize': 100},
+        {'drilldowns': [key(first), 'time'],
+         'cuts': [('time', unicode(year.year))]},
+        {'drilldowns': [key(first)], 'cuts': [(key(second), member)],
+         'order': [('amount', True)], 'pagesize': 20},
+        ]
+
+def run(shape='simple', rows=10000, cardinality=None, chunk_size=5000,
+        materialize_limit=None, repeats=REPEATS):
+    """ Run the benchmark against the configured database and return the
+    results. The dataset of the shape is emptied first. """
+    model = SHAPES[shape]
+    dataset = Dataset(model)
+    dataset.generate()
+    dataset.flush()
+    results = {
+        'shape': shape, 'rows': rows, 'chunk_size': chunk_size,
+        'cardinality': cardinalities(model, cardinality),
+        'database': dataset.bind.dialect.name,
+        'python': platform.python_version(),
+        'sqlalchemy': sqlalchemy.__version__,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+
+    begin = time.time()
+    with MemoryWatch() as memory:
+        dataset.load_all(generate(model, rows, cardinality),
+                         chunk_size=chunk_size)
+    duration = time.time() - begin
+    results['load'] = {'seconds': duration, 'rows_per_sec': rows / duration,
+                       'memory_increase_kb': memory.increase}
+
+    aggregates = []
+    cache = get_cache()
+    with MemoryWatch() as memory:
+        for query in queries(dataset):
+            cold, warm = [], []
+            for i in range(repeats):
+                cache.invalidate(dataset.name)
+                begin = time.time()
+                dataset.aggregate(**query)
+                cold.append(time.time() - begin)
+                begin = time.time()
+                dataset.aggregate(**query)
+                warm.append(time.time() - begin)
+            aggregates.append({'query': repr(query),
+                               'cold_seconds': _median(cold),
+                               'cached_seconds': _median(warm)})
+    results['aggregate'] = aggregates
+    results['aggregate_memory_increase_kb'] = memory.increase
+
+    begin = time.time()
+    count = 0
+    with MemoryWatch() as memory:
+        for record in islice(dataset.materialize(), materialize_limit):
+            count += 1
+    duration = time.time() - begin
+    results['materialize'] = {'rows': count, 'seconds': duration,
+                              'rows_per_sec': count / max(duration, 1e-6),
+                              'memory_increase_kb': memory.increase}
+    results['peak_memory_kb'] = peak_memory()
+    return results
+
+def compare(results, old):
+    """ Print the ratio of each measurement to that of an earlier run. """
+    def ratio(new, before):
+        if not before or new is None:
+            return '-'
+        return "%.2fx" % (float(new) / before)
+    print "load rows/sec: %s" % ratio(results['load']['rows_per_sec'],
+                                      old['load']['rows_per_sec'])
+    before = dict([(a['query'], a) for a in old['aggregate']])
+    for agg in results['aggregate']:
+        if agg['query'] in before:
+            print "aggregate time %s: %s" % (agg['query'][:60],
+                ratio(agg['cold_seconds'], before[agg['query']]['cold_seconds']))
+    print "materialize rows/sec: %s" % ratio(
+        results['materialize']['rows_per_sec'],
+        old['materialize']['rows_per_sec'])
+    print "materialize memory: %s" % ratio(
+        results['materialize']['memory_increase_kb'],
+        old['materialize'].get('memory_increase_kb'))
+
+def _cardinality(value):
+    pairs = [p.split('=', 1) for p in value.split(',') if p]
+    return dict([(k, int(v)) for k, v in pairs])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shape', choices=sorted(SHAPES), default='simple')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--cardinality', type=_cardinality, default={},
+                        help='e.g. to=5000,time=10')
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--materialize-limit', type=int, default=None)
+    parser.add_argument('--db', default='sqlite:////tmp/spendb_bench.db')
+    parser.add_argument('--out', help='write the results to this file')
+    parser.add_argument('--compare', help='results of an earlier run')
+    args = parser.parse_args()
+    app.config['SQLALCHEMY_DATABASE_URI'] = args.db
+    db.create_all()
+
+    results = run(args.shape, args.rows, args.cardinality, args.chunk_size,
+                  args.materialize_limit)
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    print
+    if args.out:
+        fh = open(args.out, 'wb')
+        json.dump(results, fh, indent=2, sort_keys=True)
+        fh.close()
+    if args.compare:
+        fh = open(args.compare, 'rb')
+        compare(results, json.load(fh))
+        fh.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+""" Synthetic spending data for benchmarks. ``MODEL`` and ``rows`` have a
+fixed, simple shape. ``generate`` makes rows for any model, such as
+``BUND_MODEL`` (the shape of ``contrib/bund.js``), with configurable
+dimension cardinalities. """
+from copy import deepcopy
+import json
+import os
+import random
+
+MODEL = {
+    'dataset': {
+        'name': 'bench',
+        'label': 'Synthetic benchmark dataset',
+        },
+    'mapping': {
+        'amount': {'type': 'value', 'column': 'amount', 'datatype': 'float'},
+        'time': {'type': 'value', 'column': 'year', 'datatype': 'date'},
+        'field': {'type': 'value', 'column': 'field', 'datatype': 'string'},
+        'to': {
+            'type': 'entity',
+            'fields': [
+                {'column': 'to_name', 'name': 'name', 'datatype': 'string'},
+                {'column': 'to_label', 'name': 'label', 'datatype': 'string'}
+            ]},
+        'function': {
+            'type': 'classifier',
+            'taxonomy': 'function',
+            'fields': [
+                {'column': 'func_name', 'name': 'name', 'datatype': 'string'},
+                {'column': 'func_label', 'name': 'label', 'datatype': 'string'}
+            ]},
+        }
+    }
+
+def rows(count, recipients=5000, functions=50, fields=20, years=10, seed=42):
+    """ Generate ``count`` CSV-style rows (all values are strings). """
+    rnd = random.Random(seed)
+    for i in xrange(count):
+        to = rnd.randint(1, recipients)
+        func = rnd.randint(1, functions)
+        yield {
+            'year': str(2000 + rnd.randint(0, years - 1)),
+            'amount': '%.2f' % rnd.uniform(1, 100000),
+            'field': 'field%d' % rnd.randint(1, fields),
+            'to_name': 'r%d' % to,
+            'to_label': 'Recipient %d' % to,
+            'func_name': 'f%d' % func,
+            'func_label': 'Function %d' % func,
+            }
+
+
+def _bund_model():
+    path = os.path.join(os.path.dirname(__file__), '..', 'contrib', 'bund.js')
+    fh = open(path, 'rb')
+    model = json.load(fh)
+    fh.close()
+    model['dataset']['name'] = 'bench_bund'
+    # random rows would collide on the unique keys and turn into updates:
+    model['dataset'].pop('unique_keys', None)
+    return model
+
+BUND_MODEL = _bund_model()
+
+SHAPES = {'simple': MODEL, 'bund': BUND_MODEL}
+
+DEFAULT_CARDINALITY = 100
+YEARS = 10
+
+def cardinalities(model, overrides=None, default=DEFAULT_CARDINALITY):
+    """ The number of distinct values of each dimension of ``model``,
+    with the given ``overrides``. """
+    cards = {}
+    for name, data in model['mapping'].items():
+        if data.get('datatype') == 'float':
+            continue
+        cards[name] = YEARS if data.get('datatype') == 'date' else default
+    cards.update(overrides or {})
+    return cards
+
+def generate(model, count, cardinality=None, seed=42):
+    """ Generate ``count`` CSV-style rows for ``model``. Each dimension
+    has as many distinct values (or members) as ``cardinality`` gives,
+    see ``cardinalities``. """
+    cards = cardinalities(model, cardinality)
+    rnd = random.Random(seed)
+    # (kind, cardinality, [(column, format)]) for each dimension:
+    plan = []
+    for name, data in sorted(model['mapping'].items()):
+        name = str(name)
+        if data.get('datatype') == 'float':
+            plan.append(('float', None, [(data['column'], None)]))
+        elif data.get('datatype') == 'date':
+            plan.append(('date', cards[name], [(data['column'], None)]))
+        elif 'column' in data:
+            plan.append(('value', cards[name],
+                         [(data['column'], name + '%d')]))
+        else:
+            columns = [(f['column'], '%s %s %%d' % (name, f['name'])) \
+                       for f in data.get('fields', []) if 'column' in f]
+            plan.append(('value', cards[name], columns))
+    for i in xrange(count):
+        row = {}
+        for kind, card, columns in plan:
+            if kind == 'float':
+                row[columns[0][0]] = '%.2f' % rnd.uniform(1, 100000)
+            elif kind == 'date':
+                row[columns[0][0]] = str(2000 + rnd.randint(0, card - 1))
+            else:
+                value = rnd.randint(1, card)
+                for column, format in columns:
+                    row[column] = format % value
+        yield row
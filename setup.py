@@ -18,7 +18,7 @@ setup(name='spendb',
       author_email='frierich.lindenberg@okfn.org',
       url='http://pudo.org',
       license='GPLv3',
-      packages=find_packages(exclude=['ez_setup', 'examples', 'tests']),
+      packages=find_packages(exclude=['ez_setup', 'examples', 'tests', 'bench']),
       include_package_data=True,
       zip_safe=False,
       install_requires=[
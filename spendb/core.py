@@ -3,17 +3,9 @@ import warnings; warnings.filterwarnings('ignore', 'Unicode type received non-un
 
 from flask import Flask
 from flaskext.sqlalchemy import SQLAlchemy
-from migrate.versioning.util import construct_engine
 
 from spendb import default_settings
 
-import flaskext.sqlalchemy as fsqla 
-
-def mig_create_engine(*a, **kw):
-    engine = fsqla.create_engine(*a, **kw)
-    return construct_engine(engine)
-fsqla.create_engine = mig_create_engine
-
 app = Flask(__name__)
 app.config.from_object(default_settings)
 app.config.from_envvar('SPENDB_SETTINGS', silent=True)
@@ -8,6 +8,25 @@ CELERY_BACKEND = "database"
 SOLR_URL = 'http://127.0.0.1:8983/solr/spendb'
 STAGING_DATA_PATH = '/tmp'
 
+# set a path to share cached aggregates between processes:
+AGGREGATE_CACHE_PATH = None
+AGGREGATE_CACHE_SIZE = 1000
+AGGREGATE_CACHE_TTL = 3600
+
+# 'sql', or 'cube' to aggregate in memory (requires NumPy):
+AGGREGATE_ENGINE = 'sql'
+CUBE_MAX_AGE = None
+
+# None picks the fastest supported of 'copy', 'values' and 'executemany':
+BULK_INSERT_METHOD = None
+
+# operation timings; hot paths are only timed for a sample of calls:
+STATS_ENABLED = True
+STATS_SAMPLE_RATE = 0.1
+# save the timings to the operation_stats table every interval (seconds):
+STATS_PERSIST = False
+STATS_FLUSH_INTERVAL = 60
+
 SQLALCHEMY_DATABASE_URI = 'sqlite:///spendb.db'
 BROKER_HOST = SQLALCHEMY_DATABASE_URI
 CELERY_RESULT_DBURI = SQLALCHEMY_DATABASE_URI
@@ -0,0 +1,183 @@
+""" Stream the denormalized entries of a dataset into files. All writers
+read the entries in batches and keep at most one batch in memory. """
+from array import array
+from datetime import date
+from decimal import Decimal
+import csv
+import json
+import os
+import sys
+
+from spendb.core import db
+from spendb.model.common import FETCH_SIZE
+
+FORMATS = ('csv', 'json', 'columns')
+
+def default_keys(dataset):
+    """ All value dimensions, metrics and complex dimension attributes. """
+    keys = []
+    for field in dataset.fields:
+        if hasattr(field, 'attributes'):
+            keys.extend([field.name + '.' + a.name for a in field.attributes])
+        else:
+            keys.append(field.name)
+    return keys
+
+def _get(record, key):
+    if '.' in key:
+        name, attr = key.split('.', 1)
+        return record.get(name, {}).get(attr)
+    value = record.get(key)
+    if isinstance(value, dict):
+        return value.get('id')
+    return value
+
+def _records(dataset, keys, cuts, batch_size):
+    for record in dataset.materialize(keys=keys, cuts=cuts,
+                                      batch_size=batch_size):
+        yield [_get(record, k) for k in keys]
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, float):
+        # str() rounds to 12 digits:
+        return repr(value)
+    return str(value)
+
+def json_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(repr(value))
+
+def export_csv(dataset, fh, keys=None, cuts=None, batch_size=FETCH_SIZE):
+    """ Write the entries to ``fh`` as CSV with a header row. Returns the
+    number of entries written. """
+    keys = keys or default_keys(dataset)
+    writer = csv.writer(fh)
+    writer.writerow(keys)
+    count = 0
+    for values in _records(dataset, keys, cuts, batch_size):
+        writer.writerow(map(_text, values))
+        count += 1
+    return count
+
+def export_json(dataset, fh, keys=None, cuts=None, batch_size=FETCH_SIZE):
+    """ Write the entries to ``fh`` as one JSON object per line. """
+    keys = keys or default_keys(dataset)
+    count = 0
+    for values in _records(dataset, keys, cuts, batch_size):
+        fh.write(json.dumps(dict(zip(keys, values)),
+                 default=json_default))
+        fh.write('\n')
+        count += 1
+    return count
+
+class _ColumnWriter(object):
+    """ Write the values of one column to a typed array file, a validity
+    file with one byte per value and, for text, a file of UTF-8 data of
+    which the array holds the end offsets. """
+
+    def __init__(self, directory, key, type_):
+        self.key = key
+        if isinstance(type_, db.Float) or isinstance(type_, db.Numeric):
+            self.type, self.code = 'float64', 'd'
+        elif isinstance(type_, db.Integer):
+            self.type, self.code = 'int64', 'l'
+        elif isinstance(type_, db.Date):
+            self.type, self.code = 'date32', 'i'
+        else:
+            self.type, self.code = 'utf8', 'l'
+        self.files = {'values': key + '.values', 'valid': key + '.valid'}
+        if self.type == 'utf8':
+            self.files['data'] = key + '.data'
+        self.fhs = dict([(k, open(os.path.join(directory, f), 'wb')) \
+                         for k, f in self.files.items()])
+        self.offset = 0
+        self.reset()
+
+    def reset(self):
+        self.values = array(self.code)
+        self.valid = array('b')
+        self.data = []
+
+    def append(self, value):
+        self.valid.append(0 if value is None else 1)
+        if self.type == 'utf8':
+            value = _text(value)
+            self.data.append(value)
+            self.offset += len(value)
+            self.values.append(self.offset)
+        elif value is None:
+            self.values.append(0)
+        elif self.type == 'date32':
+            self.values.append(value.toordinal() - date(1970, 1, 1).toordinal())
+        elif self.type == 'float64':
+            self.values.append(float(value))
+        else:
+            self.values.append(int(value))
+
+    def flush(self):
+        self.values.tofile(self.fhs['values'])
+        self.valid.tofile(self.fhs['valid'])
+        if self.type == 'utf8':
+            self.fhs['data'].write(''.join(self.data))
+        self.reset()
+
+    def close(self):
+        self.flush()
+        for fh in self.fhs.values():
+            fh.close()
+
+    def describe(self):
+        return {'key': self.key, 'type': self.type, 'files': self.files,
+                'itemsize': self.values.itemsize}
+
+def export_columns(dataset, directory, keys=None, cuts=None,
+                   batch_size=FETCH_SIZE):
+    """ Write each column to its own set of binary files in ``directory``
+    and describe them in ``columns.json``. """
+    keys = keys or default_keys(dataset)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    writers = [_ColumnWriter(directory, k, dataset.key(k).type) \
+               for k in keys]
+    count = 0
+    try:
+        for values in _records(dataset, keys, cuts, batch_size):
+            for writer, value in zip(writers, values):
+                writer.append(value)
+            count += 1
+            if count % batch_size == 0:
+                for writer in writers:
+                    writer.flush()
+    finally:
+        for writer in writers:
+            writer.close()
+    fh = open(os.path.join(directory, 'columns.json'), 'wb')
+    json.dump({'rows': count, 'byteorder': sys.byteorder,
+               'columns': [w.describe() for w in writers]}, fh, indent=2)
+    fh.close()
+    return count
+
+def export(dataset, path, format='csv', keys=None, cuts=None,
+           batch_size=FETCH_SIZE):
+    """ Export ``dataset`` to the file (or, for ``columns``, directory)
+    at ``path`` in one of ``FORMATS``. """
+    if not format in FORMATS:
+        raise ValueError("Unknown export format: %s" % format)
+    if format == 'columns':
+        return export_columns(dataset, path, keys, cuts, batch_size)
+    writer = export_csv if format == 'csv' else export_json
+    fh = open(path, 'wb')
+    try:
+        return writer(dataset, fh, keys, cuts, batch_size)
+    finally:
+        fh.close()
+
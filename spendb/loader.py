@@ -0,0 +1,240 @@
+""" Parallel loading of CSV files into a dataset, using a pool of worker
+processes which each handle a byte range of a source file. """
+import csv
+import fcntl
+import os
+import time
+from multiprocessing import Pool, Lock
+
+from sqlalchemy.exc import IntegrityError
+
+from spendb.core import db
+from spendb.model import Dataset
+from spendb.model.common import chunked
+from spendb.staging import compression_for, open_staged
+
+MIN_PARTITION_SIZE = 1024 * 1024
+RETRIES = 5
+
+_write_lock = None
+
+def partition_file(path, parts, min_size=MIN_PARTITION_SIZE):
+    """ Split the CSV file at ``path`` into at most ``parts`` byte ranges
+    of at least ``min_size`` bytes. Ranges start at the beginning of a
+    line and exclude the header. Records with quoted line breaks must
+    not span a range boundary. Compressed files cannot be split and
+    are returned as one range without an end. """
+    if compression_for(path) is not None:
+        return [(0, None)]
+    size = os.path.getsize(path)
+    fh = open(path, 'rb')
+    try:
+        fh.readline()
+        start = fh.tell()
+        step = max((size - start) / max(parts, 1), min_size)
+        ranges = []
+        while start < size:
+            fh.seek(start + step)
+            fh.readline()
+            end = min(fh.tell(), size)
+            ranges.append((start, end))
+            start = end
+        return ranges
+    finally:
+        fh.close()
+
+def read_partition(path, start, end):
+    """ Stream the rows of the CSV file at ``path`` which begin within
+    the byte range from ``start`` to ``end``. Without an ``end``, all
+    rows of the (possibly compressed) file are read. """
+    if end is None:
+        fh = open_staged(path)
+        try:
+            for row in csv.DictReader(fh):
+                yield row
+        finally:
+            fh.close()
+        return
+    fh = open(path, 'rb')
+    try:
+        header = csv.reader([fh.readline()]).next()
+        fh.seek(start)
+        def lines():
+            while fh.tell() < end:
+                line = fh.readline()
+                if not line:
+                    break
+                yield line
+        for row in csv.DictReader(lines(), fieldnames=header):
+            yield row
+    finally:
+        fh.close()
+
+class FileLock(object):
+    """ A lock on the file at ``path``, which is shared by all processes
+    on the host, with the interface of ``multiprocessing.Lock``. """
+
+    def __init__(self, path):
+        self.path = path
+        self.fh = None
+
+    def acquire(self):
+        fh = open(self.path, 'a')
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        self.fh = fh
+
+    def release(self):
+        fh, self.fh = self.fh, None
+        fcntl.flock(fh, fcntl.LOCK_UN)
+        fh.close()
+
+def sqlite_lock(bind):
+    """ Get a lock which serialises the writes of all jobs to the SQLite
+    file of ``bind``, as SQLite allows only one writer at a time. Other
+    databases need no lock and get ``None``. """
+    if bind.dialect.name != 'sqlite' or \
+            bind.url.database in (None, '', ':memory:'):
+        return None
+    return FileLock(bind.url.database + '.lock')
+
+def _locked(lock, func, *args):
+    if lock is None:
+        return func(*args)
+    lock.acquire()
+    try:
+        return func(*args)
+    finally:
+        lock.release()
+
+def _init_worker(lock):
+    global _write_lock
+    _write_lock = lock
+    # don't share the parent's connections across processes:
+    db.engine.dispose()
+
+def _load_chunk(dataset, chunk, callback=None, source_id=None):
+    for attempt in range(RETRIES):
+        try:
+            return dataset.load_chunk(chunk, callback=callback,
+                                      source_id=source_id)
+        except IntegrityError:
+            # another worker created the same dimension member, the
+            # rolled back chunk will find it when retried.
+            if attempt == RETRIES - 1:
+                raise
+
+def load_range(dataset, path, start, end, chunk_size=1000, callback=None,
+               source_id=None, lock=None):
+    """ Load the rows in a byte range of the CSV file at ``path``, each
+    chunk in its own transaction. ``callback`` is called with the
+    connection and the size of each chunk before it is committed.
+    Entries are tagged with ``source_id``. Chunks are written while
+    holding ``lock``, or the lock of the worker pool. Returns the number
+    of rows. """
+    lock = lock or _write_lock
+    count = 0
+    for chunk in chunked(read_partition(path, start, end), chunk_size):
+        chunk_callback = None
+        if callback is not None:
+            chunk_callback = lambda conn, size=len(chunk): callback(conn, size)
+        _locked(lock, _load_chunk, dataset, chunk, chunk_callback, source_id)
+        count += len(chunk)
+    return count
+
+def queue_source(source, parts=4, min_size=MIN_PARTITION_SIZE):
+    """ Split the staged file of ``source`` into up to ``parts`` byte
+    ranges to be loaded by separate jobs, and reset its progress. """
+    ranges = partition_file(source.staging_path, parts, min_size=min_size)
+    source.queue_load(len(ranges))
+    return ranges
+
+def load_source_range(source, start, end, chunk_size=1000, bind=None,
+                      fingerprint=None):
+    """ Load one of the ranges of ``source`` returned by
+    ``queue_source``, counting the rows of each chunk within its
+    transaction. The job which completes the load stores the
+    ``fingerprint`` of the file, taken when the load was queued. On
+    SQLite, the writes of concurrent jobs are serialised with a
+    ``sqlite_lock``. Returns the number of rows. """
+    bind = bind or db.engine
+    lock = sqlite_lock(bind)
+    try:
+        count = load_range(source.dataset, source.staging_path, start, end,
+                           chunk_size=chunk_size, callback=source.mark_rows,
+                           source_id=source.id, lock=lock)
+    except Exception, e:
+        _locked(lock, source.mark_failed, bind, e)
+        raise
+    _locked(lock, source.mark_chunk_done, bind)
+    if fingerprint is not None:
+        _locked(lock, source.mark_fingerprint, bind, fingerprint)
+    return count
+
+def _load_partition(task):
+    data, path, source_id, start, end, chunk_size = task
+    begin = time.time()
+    dataset = Dataset(data)
+    dataset.generate()
+    count = load_range(dataset, path, start, end, chunk_size,
+                       source_id=source_id)
+    return path, start, count, time.time() - begin
+
+def parallel_load(dataset, paths, processes=4, chunk_size=1000,
+                  progress=None, source_ids=None):
+    """ Load the CSV files in ``paths`` into ``dataset`` using a pool
+    of ``processes`` workers. Each file is split into byte ranges so
+    that a single large file is also spread across workers. On SQLite,
+    workers parse in parallel but take turns writing. ``progress`` is
+    called with the path, start offset, row count and duration of each
+    completed range. If given, ``source_ids`` holds the ID of the source
+    of each path, to tag its entries with. Returns the total row count
+    and duration. """
+    bind = dataset.bind
+    if bind.dialect.name == 'sqlite':
+        if bind.url.database in (None, '', ':memory:'):
+            raise ValueError("Cannot load an in-memory database from "
+                             "several processes.")
+        lock = Lock()
+    else:
+        lock = None
+    # a plain dict, the change tracking of Dataset.data can't be pickled:
+    data = dict(dataset.data)
+    tasks = []
+    source_ids = source_ids or [None] * len(paths)
+    for path, source_id in zip(paths, source_ids):
+        for start, end in partition_file(path, processes):
+            tasks.append((data, path, source_id, start, end,
+                          chunk_size))
+    begin = time.time()
+    total = 0
+    pool = Pool(processes, _init_worker, (lock,))
+    try:
+        for result in pool.imap_unordered(_load_partition, tasks):
+            total += result[2]
+            if progress is not None:
+                progress(*result)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    for field in dataset.fields:
+        field.clear_cache()
+    dataset.invalidate()
+    return total, time.time() - begin
+
+def load_sources(dataset, sources, processes=4, chunk_size=1000,
+                 progress=None):
+    """ Load the staged files of ``sources`` into ``dataset`` with
+    ``parallel_load``, and store the fingerprint of each file so that
+    unchanged sources are not reloaded on refresh. Returns the total
+    row count and duration. """
+    fingerprints = [source.fingerprint() for source in sources]
+    result = parallel_load(dataset, [s.staging_path for s in sources],
+                           processes=processes, chunk_size=chunk_size,
+                           progress=progress,
+                           source_ids=[s.id for s in sources])
+    for source, fingerprint in zip(sources, fingerprints):
+        source.file_hash, source.file_size, source.file_mtime = fingerprint
+    return result
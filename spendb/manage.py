@@ -1,14 +1,14 @@
 import json
 import os
+import sys
 
 from flaskext.script import Manager
-from flaskext.celery import install_commands as install_celery_commands
 
 from spendb.core import app, db
-from spendb.model import Dataset, DatasetLogger, Source
+from spendb.model import Dataset, DatasetLogger, Source, get_advisor
+from spendb.model import OperationStats, stored_stats
 
 manager = Manager(app)
-install_celery_commands(manager)
 
 @manager.command
 def createdb():
@@ -33,10 +33,9 @@ def dsinit(filename):
         raise ValueError("A dataset named %s already exists!" % old.name)
     db.session.add(dataset)
     dataset.generate()
-    db.session.flush()
-    log = DatasetLogger(dataset)
-    log.info("Dataset created: %s", dataset.label)
     db.session.commit()
+    with DatasetLogger(dataset) as log:
+        log.info("Dataset created: %s", dataset.label)
 
 @manager.command
 def dsdrop(dataset):
@@ -55,6 +54,38 @@ def dsflush(dataset):
     ds.flush()
     db.session.commit()
 
+@manager.command
+def dsrollup(dataset):
+    """ Re-compute the rollups of a dataset. """
+    ds = _get_ds(dataset)
+    ds.generate()
+    ds.refresh_rollups()
+
+@manager.command
+def dsindex(dataset, create=False, min_uses=1):
+    """ Suggest (and create) indexes for frequently queried columns. """
+    ds = _get_ds(dataset)
+    ds.generate()
+    advisor = get_advisor(ds)
+    for column, count in advisor.recommend():
+        print "%s.%s: used %d times" % (column.table.name, column.name, count)
+    if create:
+        for column in advisor.create(min_uses=int(min_uses)):
+            print "Created index on %s.%s" % (column.table.name, column.name)
+
+@manager.command
+def dsexport(dataset, path, format='csv', keys=None, cuts=None):
+    """ Export a dataset as csv, json (one object per line) or columns (a
+    directory of binary column files). Select keys with -k to.name,amount
+    and filter with -c time:2010,field:foo. """
+    from spendb.export import export
+    ds = _get_ds(dataset)
+    ds.generate()
+    keys = keys.split(',') if keys else None
+    cuts = [c.split(':', 1) for c in cuts.split(',')] if cuts else None
+    count = export(ds, path, format=format, keys=keys, cuts=cuts)
+    print "Exported %d entries to %s" % (count, path)
+
 @manager.command
 def dslist():
     """ List all datasets in the databse. """
@@ -66,17 +97,19 @@ def dslist():
         print m.encode('utf-8')
 
 @manager.command
-def srcadd(dataset, filename):
-    """ Add a source file to a dataset. """
+def srcadd(dataset, filename, compression=None):
+    """ Add a source file to a dataset, optionally compressed with gzip,
+    bz2 or xz. Uncompressed files are linked rather than copied where
+    the file system allows it. """
     ds = _get_ds(dataset)
-    src = Source(ds, 'file', filename)
+    src = Source(ds, 'file', filename, compression=compression)
     for other in ds.sources:
         if other.name == src.name:
             raise ValueError("Source already exists: %s" % other.name)
     db.session.add(src)
-    import shutil
-    print "Copying to %s..." % src.staging_path
-    shutil.copyfile(filename, src.staging_path)
+    print "Staging to %s..." % src.staging_path
+    method = src.stage(filename)
+    print "Staged (%s)" % method
     db.session.commit()
 
 @manager.command
@@ -90,6 +123,97 @@ def srclist(dataset):
         m = fmt % (source.id, source.name, source.type)
         print m.encode('utf-8')
 
+@manager.command
+def srcload(dataset, source, chunk_size=1000, resume=False):
+    """ Load a staged source file into its dataset. """
+    ds = _get_ds(dataset)
+    src = ds.sources.filter_by(name=source).first()
+    if src is None:
+        raise ValueError("Source does not exist: %s" % source)
+    ds.generate()
+    def progress(count, loaded, duration):
+        print "%s: %d rows (%.1f rows/sec)" % (src.name, count,
+                                               loaded / max(duration, 0.001))
+    src.load(chunk_size=int(chunk_size), resume=resume, progress=progress)
+    db.session.commit()
+
+@manager.command
+def dsrefresh(dataset, chunk_size=1000):
+    """ Reload the sources of a dataset whose files have changed. """
+    ds = _get_ds(dataset)
+    ds.generate()
+    for src in ds.sources:
+        count = src.reload(chunk_size=int(chunk_size))
+        if count is None:
+            print "%s: unchanged" % src.name
+        else:
+            print "%s: reloaded %d rows" % (src.name, count)
+        db.session.commit()
+
+@manager.command
+def dsload(dataset, processes=4, chunk_size=1000):
+    """ Load all sources of a dataset using several processes. """
+    from spendb.loader import load_sources
+    ds = _get_ds(dataset)
+    ds.generate()
+    def progress(path, start, count, duration):
+        print "%s@%d: %d rows (%.1f rows/sec)" % (os.path.basename(path),
+                start, count, count / max(duration, 0.001))
+    count, duration = load_sources(ds, list(ds.sources),
+                                   processes=int(processes),
+                                   chunk_size=int(chunk_size),
+                                   progress=progress)
+    db.session.commit()
+    print "Total: %d rows in %.1fs (%.1f rows/sec)" % (count, duration,
+                                    count / max(duration, 0.001))
+
+@manager.command
+def srcqueue(dataset, source, parts=4, chunk_size=1000):
+    """ Queue a background load of a source, split into several jobs. """
+    from spendb.tasks import load_source
+    ds = _get_ds(dataset)
+    src = ds.sources.filter_by(name=source).first()
+    if src is None:
+        raise ValueError("Source does not exist: %s" % source)
+    load_source.delay(src.id, parts=int(parts), chunk_size=int(chunk_size))
+    print "Queued load of %s" % src.name
+
+@manager.command
+def srcstatus(dataset):
+    """ Show the progress of the background loads of a dataset. """
+    ds = _get_ds(dataset)
+    fmt = " %-35s | %-8s | %-9s | %-10s | %-8s"
+    print fmt % ('name', 'status', 'jobs', 'rows', 'rows/sec')
+    print '-' * 84
+    for source in ds.sources:
+        p = source.progress
+        m = fmt % (source.name, p['status'] or '-',
+                   "%s/%s" % (p['chunks_done'] or 0, p['chunks'] or 0),
+                   p['loaded_rows'], "%.1f" % (p['rows_per_sec'] or 0))
+        print m.encode('utf-8')
+        if p['error']:
+            print ("   %s" % p['error']).encode('utf-8')
+
+@manager.command
+def dsstats(dataset, reset=False):
+    """ Show the saved timings of the operations on a dataset (see
+    ``STATS_PERSIST``), or clear them. """
+    ds = _get_ds(dataset)
+    if reset:
+        table = OperationStats.__table__
+        db.engine.execute(table.delete(table.c.dataset==ds.name))
+        print "Cleared stats of %s" % ds.name
+        return
+    fmt = " %-14s | %9s | %9s | %10s | %10s | %10s | %10s"
+    print fmt % ('operation', 'calls', 'timed', 'avg ms', 'statements',
+                 'sql secs', 'rows')
+    print '-' * 92
+    for s in stored_stats(ds.name):
+        print fmt % (s['operation'], s['calls'], s['timed_calls'],
+                     "%.2f" % s['avg_ms'] if s['avg_ms'] is not None else '-',
+                     s['statements'], "%.3f" % s['statement_seconds'],
+                     s['rows'])
+
 @manager.command
 def srcrm(dataset, source):
     """ Remove a source from a dataset. """
@@ -102,6 +226,11 @@ def srcrm(dataset, source):
             db.session.commit()
 
 def spendb():
+    # celery is only loaded for its own commands and the command listing:
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if not command in manager._commands:
+        from flaskext.celery import install_commands
+        install_commands(manager)
     manager.run()
 
 if __name__ == '__main__':
@@ -2,6 +2,10 @@
 from spendb.core import db
 from spendb.model.attribute import Attribute
 from spendb.model.dimension import ValueDimension, ComplexDimension, Metric
+from spendb.model.rollup import Rollup
 from spendb.model.dataset import Dataset
 from spendb.model.source import Source
 from spendb.model.log import DatasetLogRecord, DatasetLogger
+from spendb.model.advisor import KeyUsage, IndexAdvisor, get_advisor
+from spendb.model.catalog import SchemaCatalog
+from spendb.model.stats import OperationStats, get_stats, stored_stats
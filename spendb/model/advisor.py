@@ -0,0 +1,120 @@
+import atexit
+from collections import defaultdict
+
+from spendb.core import db
+from spendb.model.catalog import SchemaCatalog
+
+FLUSH_INTERVAL = 100
+
+class KeyUsage(db.Model):
+    """ How often a key was used to cut, drill down or order an
+    aggregation of a dataset. """
+    __tablename__ = 'key_usage'
+
+    id = db.Column(db.Integer, primary_key=True)
+    dataset_id = db.Column(db.Integer, db.ForeignKey('dataset.id'))
+    key = db.Column(db.Unicode())
+    count = db.Column(db.Integer, default=0)
+
+class IndexAdvisor(object):
+    """ Track the keys used in the aggregations of a dataset and suggest
+    indexes for those columns which lack one. Counts are written to the
+    ``key_usage`` table every ``FLUSH_INTERVAL`` aggregations and when
+    the process exits. """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.counts = defaultdict(int)
+        self.pending = 0
+
+    def record(self, keys):
+        for key in set(keys):
+            self.counts[key] += 1
+        self.pending += 1
+        if self.pending >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """ Add the counts recorded so far to the ``key_usage`` table. """
+        if self.dataset.id is None:
+            return
+        table = KeyUsage.__table__
+        for key, count in self.counts.items():
+            match = db.and_(table.c.dataset_id==self.dataset.id,
+                            table.c.key==key)
+            q = table.update(match, {'count': table.c.count + count})
+            if self.dataset.bind.execute(q).rowcount == 0:
+                q = table.insert({'dataset_id': self.dataset.id,
+                                  'key': key, 'count': count})
+                self.dataset.bind.execute(q)
+        self.counts.clear()
+        self.pending = 0
+
+    def usage(self):
+        """ Get the number of uses of each key, stored and pending. """
+        usage = defaultdict(int, self.counts)
+        if self.dataset.id is not None:
+            table = KeyUsage.__table__
+            q = db.select([table.c.key, db.func.sum(table.c.count)],
+                          table.c.dataset_id==self.dataset.id,
+                          group_by=[table.c.key])
+            for key, count in self.dataset.bind.execute(q):
+                usage[key] += count
+        return usage
+
+    def _column(self, key):
+        column = self.dataset.key(key)
+        return column.table.original.c[column.name]
+
+    def _indexed(self, column):
+        if column.primary_key or column.index:
+            return True
+        for index in column.table.indexes:
+            if list(index.columns)[0].name == column.name:
+                return True
+        return False
+
+    def recommend(self):
+        """ List the columns which were used but are not indexed, with
+        the number of uses, most used first. """
+        columns = defaultdict(int)
+        for key, count in self.usage().items():
+            try:
+                column = self._column(key)
+            except KeyError:
+                continue
+            if not self._indexed(column):
+                columns[column] += count
+        return sorted(columns.items(), key=lambda c: -c[1])
+
+    def create(self, min_uses=1):
+        """ Index all recommended columns with at least ``min_uses``. """
+        created = []
+        for column, count in self.recommend():
+            if count >= min_uses:
+                name = column.table.name + '_' + column.name + '_index'
+                db.Index(name, column).create(self.dataset.bind)
+                created.append(column)
+        if len(created):
+            SchemaCatalog.forget(self.dataset.bind, self.dataset.name)
+        return created
+
+_advisors = {}
+
+def get_advisor(dataset):
+    """ Get the advisor for ``dataset``, which is shared by all instances
+    of the same dataset within the process. """
+    advisor = _advisors.get(dataset.name)
+    if advisor is None:
+        advisor = _advisors[dataset.name] = IndexAdvisor(dataset)
+    advisor.dataset = dataset
+    return advisor
+
+@atexit.register
+def _flush_advisors():
+    for advisor in _advisors.values():
+        if advisor.counts:
+            try:
+                advisor.flush()
+            except Exception:
+                pass
@@ -1,4 +1,81 @@
+from datetime import datetime
+from decimal import Decimal
+
 from spendb.core import db
+from spendb.model.common import create_column
+
+DATE_FORMATS = ('%Y-%m-%d', '%Y-%m', '%Y')
+
+def parse_date(value):
+    """ Parse a full date, a month (``2010-05``) or a year. """
+    for format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), format).date()
+        except ValueError:
+            pass
+    raise ValueError("Invalid date: %r" % value)
+
+def date_parser():
+    """ Get a parser like ``parse_date`` which tries the format that
+    matched last first, so that a column of dates in the same format
+    takes one ``strptime`` per value. """
+    formats = list(DATE_FORMATS)
+    def parse(value):
+        value = value.strip()
+        for i, format in enumerate(formats):
+            try:
+                date = datetime.strptime(value, format).date()
+            except ValueError:
+                continue
+            if i:
+                formats.insert(0, formats.pop(i))
+            return date
+        raise ValueError("Invalid date: %r" % value)
+    return parse
+
+def _text(value):
+    return value.decode('utf-8') if isinstance(value, str) else value
+
+def coercer(type_, dates=parse_date):
+    """ Get a function which converts source values for a column of
+    ``type_``. Empty values become ``None``, values which are not strings
+    are assumed to be converted already. Dates are parsed with
+    ``dates``. """
+    if isinstance(type_, db.Float):
+        convert = float
+    elif isinstance(type_, db.Integer):
+        convert = int
+    elif isinstance(type_, db.Numeric):
+        convert = Decimal
+    elif isinstance(type_, db.Date):
+        convert = dates
+    else:
+        convert = _text
+    def coerce(value):
+        if value is None or value == '':
+            return None
+        if isinstance(value, basestring):
+            return convert(value)
+        return value
+    return coerce
+
+def batch_coercer(type_):
+    """ Get a function which converts a list of source values for a
+    column of ``type_``. Each distinct value of a list is converted once,
+    and dates are parsed with the format which matched last. """
+    coerce = coercer(type_, dates=date_parser())
+    def coerce_batch(values):
+        converted = {}
+        result = []
+        for value in values:
+            try:
+                result.append(converted[value])
+            except KeyError:
+                result.append(converted.setdefault(value, coerce(value)))
+            except TypeError:
+                result.append(coerce(value))
+        return result
+    return coerce_batch
 
 class Attribute(object):
 
@@ -22,21 +99,36 @@ class Attribute(object):
     def generate(self, meta, table):
         if self.name in table.c:
             self.column = table.c[self.name]
-            return
-        types = {
-            'string': db.UnicodeText,
-            'constant': db.UnicodeText,
-            'date': db.UnicodeText,
-            'float': db.Float,
-                }
-        type_ = types.get(self.datatype, db.UnicodeText)
-        self.column = db.Column(self.name, type_)
-        self.column.create(table)
+        else:
+            types = {
+                'string': db.UnicodeText,
+                'constant': db.UnicodeText,
+                'date': db.Date,
+                'float': db.Float,
+                'integer': db.Integer,
+                'decimal': db.Numeric,
+                    }
+            type_ = types.get(self.datatype, db.UnicodeText)
+            self.column = db.Column(self.name, type_)
+            create_column(self.column, table)
+        # follow the actual column, which may predate a type change:
+        self.coerce = coercer(self.column.type)
+        self.coerce_batch = batch_coercer(self.column.type)
 
     def load(self, bind, row):
         value = row.get(self.source_column, self.default) if \
                 self.source_column else self.default
-        return {self.column.name: value.decode('utf-8') if value else None}
+        return {self.column.name: self.coerce(value)}
+
+    def load_batch(self, bind, rows):
+        """ Load the values of this attribute for all ``rows`` at once,
+        as a list keyed by the column name. """
+        if self.source_column:
+            column, default = self.source_column, self.default
+            values = [row.get(column, default) for row in rows]
+        else:
+            values = [self.default] * len(rows)
+        return {self.column.name: self.coerce_batch(values)}
 
     def __repr__(self):
         return "<Attribute(%s)>" % self.name
@@ -0,0 +1,134 @@
+""" Ways to insert many rows at once. Each database gets the fastest one
+it supports, unless ``BULK_INSERT_METHOD`` selects another:
+
+* ``copy`` streams the rows as CSV through PostgreSQL's ``COPY FROM
+  STDIN`` (psycopg2 only).
+* ``values`` sends a multi-row ``INSERT ... VALUES`` per batch.
+* ``executemany`` runs one prepared ``INSERT`` for all rows, which is
+  the fastest path on SQLite as long as it runs in one transaction.
+"""
+from collections import OrderedDict
+from StringIO import StringIO
+
+from spendb.core import app, db
+
+METHODS = ('copy', 'values', 'executemany')
+
+# stay below SQLite's default limit of 999 bound parameters:
+VALUES_MAX_PARAMS = 900
+
+def bulk_method(bind):
+    """ Get the insert method to use with ``bind``. """
+    method = app.config.get('BULK_INSERT_METHOD')
+    if method is not None:
+        return method
+    dialect = bind.dialect
+    if dialect.name == 'postgresql' and dialect.driver == 'psycopg2':
+        return 'copy'
+    if dialect.name == 'sqlite':
+        return 'executemany'
+    return 'values'
+
+def _groups(table, rows):
+    """ Split ``rows`` by the columns they set, so that the columns
+    a row leaves out get their server default rather than NULL, as with
+    ``executemany``. Scalar defaults of the table are filled in. """
+    defaults = dict([(c.name, c.default.arg) for c in table.c \
+                     if c.default is not None and c.default.is_scalar])
+    groups = OrderedDict()
+    for row in rows:
+        missing = [c for c in defaults if not c in row]
+        if len(missing):
+            row = dict(row)
+            row.update([(c, defaults[c]) for c in missing])
+        groups.setdefault(tuple(sorted(row.keys())), []).append(row)
+    return groups.items()
+
+def _processed(bind, table, columns, rows):
+    """ Convert the values of ``rows`` as the column types would when
+    binding them, so that they can be sent without a compiled insert. """
+    processors = [table.c[c].type.bind_processor(bind.dialect) \
+                  for c in columns]
+    for row in rows:
+        values = []
+        for column, processor in zip(columns, processors):
+            value = row.get(column)
+            values.append(value if processor is None else processor(value))
+        yield values
+
+def csv_value(value):
+    """ Format a value for ``COPY ... WITH CSV``, in which an unquoted
+    empty field is NULL. """
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    elif isinstance(value, bool):
+        return 't' if value else 'f'
+    elif isinstance(value, float):
+        return repr(value)
+    elif not isinstance(value, str):
+        return str(value)
+    return '"%s"' % value.replace('"', '""')
+
+def insert_copy(bind, table, rows):
+    """ Insert ``rows`` using ``COPY FROM STDIN`` on the DB-API connection
+    behind ``bind``, which must be a ``Connection``. """
+    prep = bind.dialect.identifier_preparer
+    cursor = bind.connection.cursor()
+    try:
+        for columns, group in _groups(table, rows):
+            buf = StringIO()
+            for values in _processed(bind, table, columns, group):
+                buf.write(','.join(map(csv_value, values)))
+                buf.write('\n')
+            buf.seek(0)
+            sql = "COPY %s (%s) FROM STDIN WITH CSV" % (
+                prep.format_table(table),
+                ', '.join([prep.quote_identifier(c) for c in columns]))
+            cursor.copy_expert(sql, buf)
+    finally:
+        cursor.close()
+
+def insert_values(bind, table, rows):
+    """ Insert ``rows`` with one ``INSERT`` statement for each batch of
+    up to ``VALUES_MAX_PARAMS`` values. """
+    for columns, group in _groups(table, rows):
+        _insert_values(bind, table, columns, group)
+
+def _insert_values(bind, table, columns, rows):
+    prep = bind.dialect.identifier_preparer
+    head = "INSERT INTO %s (%s) VALUES " % (prep.format_table(table),
+           ', '.join([prep.quote_identifier(c) for c in columns]))
+    step = max(1, VALUES_MAX_PARAMS / len(columns))
+    processed = list(_processed(bind, table, columns, rows))
+    for offset in range(0, len(processed), step):
+        params, groups = {}, []
+        for i, values in enumerate(processed[offset:offset+step]):
+            names = []
+            for j, value in enumerate(values):
+                name = 'v%d_%d' % (i, j)
+                params[name] = value
+                names.append(':' + name)
+            groups.append('(%s)' % ', '.join(names))
+        bind.execute(db.text(head + ', '.join(groups)), params)
+
+def insert_executemany(bind, table, rows):
+    # the statement is compiled for the columns of the first row:
+    for columns, group in _groups(table, rows):
+        bind.execute(table.insert(), group)
+
+def bulk_insert(bind, table, rows):
+    """ Insert ``rows`` into ``table`` with the best method for ``bind``.
+    ``copy`` needs a connection rather than an engine, and falls back to
+    ``values`` otherwise. """
+    if not len(rows):
+        return
+    method = bulk_method(bind)
+    if method == 'copy':
+        if hasattr(bind, 'connection'):
+            return insert_copy(bind, table, rows)
+        method = 'values'
+    if method == 'values':
+        return insert_values(bind, table, rows)
+    return insert_executemany(bind, table, rows)
@@ -0,0 +1,79 @@
+""" A cache for aggregation results, which are invalidated whenever the
+data of a dataset changes. """
+import json
+import time
+
+from spendb.core import app
+from spendb.model.common import LRUCache
+
+class MemoryStore(object):
+    """ Keep up to ``size`` cached values in this process. """
+
+    def __init__(self, size):
+        self._cache = LRUCache(size)
+
+    def get(self, dataset, key):
+        return self._cache.get((dataset, key))
+
+    def set(self, dataset, key, value):
+        self._cache.set((dataset, key), value)
+
+    def clear(self, dataset):
+        for key in self._cache.keys():
+            if key[0] == dataset:
+                self._cache.delete(key)
+
+class AggregateCache(object):
+    """ Cache aggregation results by dataset and query arguments in a
+    ``store``. Results older than ``ttl`` seconds are ignored. """
+
+    def __init__(self, store, ttl=None):
+        self.store = store
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, **kwargs):
+        """ Make a cache key from a set of query arguments. """
+        return json.dumps(kwargs, sort_keys=True, default=unicode)
+
+    def get(self, dataset, key):
+        value = self.store.get(dataset, key)
+        if value is not None:
+            from cPickle import loads
+            created, result = loads(value)
+            if self.ttl is None or created + self.ttl > time.time():
+                self.hits += 1
+                return result
+        self.misses += 1
+        return None
+
+    def set(self, dataset, key, result):
+        from cPickle import dumps, HIGHEST_PROTOCOL
+        value = dumps((time.time(), result), HIGHEST_PROTOCOL)
+        self.store.set(dataset, key, value)
+
+    def invalidate(self, dataset):
+        """ Drop all cached results for ``dataset``. """
+        self.store.clear(dataset)
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+_cache = None
+
+def get_cache():
+    """ Get the aggregate cache configured for the application. """
+    global _cache
+    if _cache is None:
+        path = app.config.get('AGGREGATE_CACHE_PATH')
+        size = app.config.get('AGGREGATE_CACHE_SIZE', 1000)
+        if path:
+            from spendb.model.sqlitestore import SQLiteStore
+            store = SQLiteStore(path, size)
+        else:
+            store = MemoryStore(size)
+        _cache = AggregateCache(store, ttl=app.config.get('AGGREGATE_CACHE_TTL'))
+    return _cache
+
@@ -0,0 +1,50 @@
+from hashlib import sha1
+from json import dumps
+
+from spendb.core import db
+from spendb.model.common import JSONType, describe_table
+
+# increase when generate() adds tables or columns independent of the model:
+SCHEMA_VERSION = 2
+
+def model_rev(data):
+    """ Identify a revision of a dataset model by its content. """
+    return sha1(dumps([SCHEMA_VERSION, data], sort_keys=True)).hexdigest()
+
+class SchemaCatalog(db.Model):
+    """ The tables generated for a revision of a dataset model. While the
+    model is unchanged, its tables are defined from the catalog instead
+    of being reflected from the database. """
+    __tablename__ = 'schema_catalog'
+
+    id = db.Column(db.Integer, primary_key=True)
+    dataset = db.Column(db.Unicode(255), unique=True)
+    model_rev = db.Column(db.Unicode(40))
+    tables = db.Column(JSONType, default=dict)
+
+    @classmethod
+    def lookup(cls, bind, dataset, rev):
+        """ Get the table descriptions of ``dataset`` if they were
+        recorded for the model revision ``rev``. """
+        table = cls.__table__
+        q = db.select([table.c.tables], db.and_(table.c.dataset==dataset,
+                      table.c.model_rev==rev))
+        return bind.execute(q).scalar()
+
+    @classmethod
+    def record(cls, bind, dataset, rev, tables):
+        """ Store the descriptions of ``tables`` for ``dataset``. """
+        data = {'model_rev': rev, 'dataset': dataset,
+                'tables': dict([(t.name, describe_table(t)) for t in tables])}
+        table = cls.__table__
+        q = table.update(table.c.dataset==dataset, data)
+        if bind.execute(q).rowcount == 0:
+            bind.execute(table.insert(data))
+
+    @classmethod
+    def forget(cls, bind, dataset):
+        """ Remove the entry of a dataset whose tables were changed
+        outside of ``generate``. """
+        table = cls.__table__
+        bind.execute(table.delete(table.c.dataset==dataset))
+
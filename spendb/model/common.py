@@ -1,13 +1,17 @@
+from collections import OrderedDict
 from json import dumps, loads
-from sqlalchemy.types import Text, MutableType, TypeDecorator
+from sqlalchemy.ext.mutable import Mutable
+from sqlalchemy.types import Text, TypeDecorator
 
 from spendb.core import db 
+from spendb.model.bulk import bulk_insert
+from spendb.model.stats import instrumented
 
-class JSONType(MutableType, TypeDecorator):
-    impl = Text
+UPSERT_LOOKUP_PARAMS = 500
+FETCH_SIZE = 1000
 
-    def __init__(self):
-        super(JSONType, self).__init__()
+class JSONType(TypeDecorator):
+    impl = Text
 
     def process_bind_param(self, value, dialect):
         return dumps(value)
@@ -15,13 +19,295 @@ class JSONType(MutableType, TypeDecorator):
     def process_result_value(self, value, dialiect):
         return loads(value)
 
-    def copy_value(self, value):
-        return loads(dumps(value))
+def _track(value, root):
+    """ Wrap nested dicts and lists of ``value`` so that their changes
+    flag ``root`` as changed. """
+    if isinstance(value, dict) and not isinstance(value, MutableDict):
+        return _TrackedDict(root, value)
+    if isinstance(value, list):
+        return _TrackedList(root, value)
+    return value
+
+class _TrackedDict(dict):
+    """ A dict within a :class:`MutableDict`. """
+
+    def __init__(self, root, value):
+        dict.__init__(self, [(k, _track(v, root)) for k, v in value.items()])
+        self.root = root
+
+    def __reduce_ex__(self, protocol):
+        return (dict, (dict(self),))
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, _track(value, self.root))
+        self.root.changed()
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.root.changed()
+
+    def clear(self):
+        dict.clear(self)
+        self.root.changed()
+
+    def update(self, *a, **kw):
+        for key, value in dict(*a, **kw).items():
+            dict.__setitem__(self, key, _track(value, self.root))
+        self.root.changed()
+
+    def setdefault(self, key, default=None):
+        if not key in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, *a):
+        value = dict.pop(self, *a)
+        self.root.changed()
+        return value
+
+    def popitem(self):
+        item = dict.popitem(self)
+        self.root.changed()
+        return item
+
+class _TrackedList(list):
+    """ A list within a :class:`MutableDict`. """
+
+    def __init__(self, root, value):
+        list.__init__(self, [_track(v, root) for v in value])
+        self.root = root
+
+    def __reduce_ex__(self, protocol):
+        return (list, (list(self),))
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = [_track(v, self.root) for v in value]
+        else:
+            value = _track(value, self.root)
+        list.__setitem__(self, index, value)
+        self.root.changed()
+
+    def __setslice__(self, i, j, values):
+        self[max(0, i):max(0, j):] = values
+
+    def __delitem__(self, index):
+        list.__delitem__(self, index)
+        self.root.changed()
+
+    def __delslice__(self, i, j):
+        del self[max(0, i):max(0, j):]
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def append(self, value):
+        list.append(self, _track(value, self.root))
+        self.root.changed()
+
+    def extend(self, values):
+        list.extend(self, [_track(v, self.root) for v in values])
+        self.root.changed()
+
+    def insert(self, index, value):
+        list.insert(self, index, _track(value, self.root))
+        self.root.changed()
+
+    def pop(self, *a):
+        value = list.pop(self, *a)
+        self.root.changed()
+        return value
+
+    def remove(self, value):
+        list.remove(self, value)
+        self.root.changed()
+
+    def reverse(self):
+        list.reverse(self)
+        self.root.changed()
+
+    def sort(self, *a, **kw):
+        list.sort(self, *a, **kw)
+        self.root.changed()
+
+class MutableDict(Mutable, dict):
+    """ A dict which flags its parent as changed when it is modified, so
+    that the session does not need to copy and compare the value on each
+    flush. Nested dicts and lists are wrapped so that their changes are
+    tracked as well. """
+
+    def __init__(self, *a, **kw):
+        dict.__init__(self)
+        dict.update(self, [(k, _track(v, self)) for k, v in \
+                           dict(*a, **kw).items()])
+
+    @classmethod
+    def coerce(cls, key, value):
+        if not isinstance(value, MutableDict):
+            if isinstance(value, dict):
+                return MutableDict(value)
+            return Mutable.coerce(key, value)
+        return value
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, _track(value, self))
+        self.changed()
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.changed()
+
+    def clear(self):
+        dict.clear(self)
+        self.changed()
+
+    def update(self, *a, **kw):
+        for key, value in dict(*a, **kw).items():
+            dict.__setitem__(self, key, _track(value, self))
+        self.changed()
+
+    def setdefault(self, key, default=None):
+        if not key in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, *a):
+        value = dict.pop(self, *a)
+        self.changed()
+        return value
+
+    def popitem(self):
+        item = dict.popitem(self)
+        self.changed()
+        return item
+
+def chunked(iterable, size):
+    """ Split ``iterable`` into lists of at most ``size`` items. """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if len(chunk):
+        yield chunk
+
+class ResultDecoder(object):
+    """ Turn the flat rows of a query into nested records. Columns of
+    ``base`` and unbound expressions become keys of the record, those of
+    other tables are grouped into a dict under the table's name. The
+    mapping is computed once from the ``query`` columns. """
+
+    def __init__(self, query, base):
+        self.fields = []
+        self.groups = OrderedDict()
+        for i, column in enumerate(query.inner_columns):
+            table = getattr(column, 'table', None)
+            if table is None or table is base:
+                self.fields.append((column.name, i))
+            else:
+                self.groups.setdefault(table.name, []).append((column.name, i))
+        self.groups = self.groups.items()
+
+    def decode(self, row):
+        record = dict([(name, row[i]) for name, i in self.fields])
+        for group, columns in self.groups:
+            record[group] = dict([(name, row[i]) for name, i in columns])
+        return record
+
+    def iterate(self, rp, batch_size=FETCH_SIZE):
+        """ Decode all rows of the result ``rp``, fetching them in
+        batches of ``batch_size``. """
+        while True:
+            rows = rp.fetchmany(batch_size)
+            if not len(rows):
+                break
+            for row in rows:
+                yield self.decode(row)
+
+class LRUCache(object):
+    """ A mapping of bounded ``size`` which evicts the least recently
+    used keys first. """
+
+    def __init__(self, size):
+        self.size = size
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        if not key in self._data:
+            return default
+        value = self._data.pop(key)
+        self._data[key] = value
+        return value
+
+    def set(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        while len(self._data) > self.size:
+            self._data.popitem(last=False)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def keys(self):
+        return self._data.keys()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+DATATYPES = [(db.Float, 'float'), (db.Numeric, 'decimal'),
+             (db.Integer, 'integer'), (db.Date, 'date')]
+
+def describe_table(table):
+    """ Describe the columns and indexes of ``table`` as plain lists, so
+    that it can be defined again without reflection. """
+    columns = []
+    for column in table.columns:
+        datatype = 'string'
+        for type_, name in DATATYPES:
+            if isinstance(column.type, type_):
+                datatype = name
+                break
+        columns.append([column.name, datatype, column.primary_key])
+    indexes = [[i.name, [c.name for c in i.columns], i.unique] \
+               for i in table.indexes]
+    return {'columns': columns, 'indexes': indexes}
+
+def define_table(meta, name, spec):
+    """ Define a table in ``meta`` from a description made by
+    ``describe_table``, replacing any previous definition. """
+    types = dict([(n, t) for t, n in DATATYPES])
+    if name in meta.tables:
+        meta.remove(meta.tables[name])
+    table = db.Table(name, meta)
+    for column, datatype, primary_key in spec['columns']:
+        type_ = types.get(datatype, db.UnicodeText)
+        table.append_column(db.Column(column, type_,
+                                      primary_key=primary_key))
+    for index, columns, unique in spec['indexes']:
+        db.Index(index, *[table.c[c] for c in columns], unique=unique)
+    return table
+
+def create_column(column, table, **kwargs):
+    """ Add ``column`` to an existing ``table``. This uses the schema
+    changes of sqlalchemy-migrate, which is slow to import and only
+    loaded when a table actually needs to be altered. """
+    import migrate.changeset
+    column.create(table, **kwargs)
 
 class TableHandler(object):
 
-    def _ensure_table(self, meta, name):
-        if not meta.bind.has_table(name):
+    def _ensure_table(self, meta, name, schema=None):
+        if schema is not None and name in schema:
+            self.table = define_table(meta, name, schema[name])
+        elif not meta.bind.has_table(name):
             self.table = db.Table(name, meta)
             col = db.Column('id', db.Integer, primary_key=True)
             self.table.append_column(col)
@@ -29,6 +315,7 @@ class TableHandler(object):
         else:
             self.table = db.Table(name, meta, autoload=True)
 
+    @instrumented('upsert', hot=True)
     def _upsert(self, bind, data, unique_columns):
         key = db.and_(*[self.table.c[c]==data.get(c) for c in unique_columns])
         q = self.table.update(key, data)
@@ -41,6 +328,54 @@ class TableHandler(object):
             row = bind.execute(q).fetchone()
             return row['id']
 
+    def _find(self, bind, keys, unique_columns, fetch=()):
+        """ Look up the rows matching any of ``keys``, which are tuples
+        of values for the ``unique_columns``. Returns a dict of each key
+        found to its row, including ``id`` and the ``fetch`` columns. """
+        columns = [self.table.c[c] for c in unique_columns]
+        selected = [self.table.c.id] + columns + \
+                [self.table.c[c] for c in fetch if not c in unique_columns]
+        found = {}
+        # keep the number of parameters per query within database limits:
+        step = max(1, UPSERT_LOOKUP_PARAMS / len(columns))
+        for i in range(0, len(keys), step):
+            conditions = [db.and_(*[c==v for c, v in zip(columns, key)]) \
+                          for key in keys[i:i+step]]
+            q = db.select(selected, db.or_(*conditions))
+            for row in bind.execute(q):
+                found[tuple([row[c] for c in columns])] = row
+        return found
+
+    @instrumented('upsert_many', rows=lambda bind, rows, *a, **kw: len(rows))
+    def _upsert_many(self, bind, rows, unique_columns, fetch=()):
+        """ Update each of ``rows`` which matches an existing row on all
+        of the ``unique_columns``, insert the others. Of several rows with
+        the same key, the last one is used. Returns the rows written and
+        the previous versions of those that were updated, with the
+        ``fetch`` columns. """
+        by_key = OrderedDict()
+        for row in rows:
+            by_key[tuple([row.get(c) for c in unique_columns])] = row
+        existing = self._find(bind, by_key.keys(), unique_columns, fetch)
+        updates, inserts, replaced = [], [], []
+        for key, row in by_key.items():
+            if key in existing:
+                replaced.append(dict(existing[key]))
+                row = dict(row)
+                row['_id'] = existing[key]['id']
+                updates.append(row)
+            else:
+                inserts.append(row)
+        if len(updates):
+            q = self.table.update(self.table.c.id==db.bindparam('_id'))
+            bind.execute(q, updates)
+        self._insert_many(bind, inserts)
+        return by_key.values(), replaced
+
+    @instrumented('insert', rows=lambda bind, rows: len(rows))
+    def _insert_many(self, bind, rows):
+        bulk_insert(bind, self.table, rows)
+
     def _flush(self, bind):
         q = self.table.delete()
         bind.execute(q)
@@ -0,0 +1,184 @@
+""" An optional in-memory aggregation engine, which keeps the entries of
+a dataset as dictionary-encoded NumPy column arrays. """
+from collections import defaultdict
+import time
+
+# NumPy is only imported once a cube is created:
+np = None
+
+from spendb.core import db
+from spendb.model.attribute import coercer
+from spendb.model.common import FETCH_SIZE
+from spendb.model.dimension import ComplexDimension
+
+def encode(values):
+    """ Dictionary-encode ``values`` into an array of integer codes and
+    the list of distinct values, indexed by code. """
+    index = {}
+    codes = np.fromiter((index.setdefault(v, len(index)) for v in values),
+                        np.int64, len(values))
+    labels = [None] * len(index)
+    for value, code in index.items():
+        labels[code] = value
+    return codes, labels
+
+def _sort_key(values):
+    # NULLs first, as in SQLite, and without comparing None to values:
+    return tuple([(v is not None, v) for v in values])
+
+class Cube(object):
+    """ Answer aggregations of a dataset from column arrays. The arrays
+    are (re-)loaded from the entry table on first use after each change
+    to the dataset (including a new ``version`` stored by another
+    process), or once they are older than ``max_age`` seconds. """
+
+    def __init__(self, dataset, max_age=None):
+        global np
+        if np is None:
+            try:
+                import numpy as np
+            except ImportError:
+                raise ImportError("The cube engine requires NumPy.")
+        self.dataset = dataset
+        self.max_age = max_age
+        self.loaded_at = None
+        self.version = None
+
+    @property
+    def stale(self):
+        if self.loaded_at is None or self.version != self.dataset.version:
+            return True
+        return self.max_age is not None and \
+            self.loaded_at + self.max_age < time.time()
+
+    def invalidate(self):
+        self.loaded_at = None
+
+    def refresh(self):
+        """ Load the entry table and the dimension members. """
+        ds = self.dataset
+        self.version = ds.version
+        columns = [d.column.name for d in ds.dimensions] + ['amount']
+        q = db.select([ds.table.c[c] for c in columns])
+        rp = ds.bind.execute(q)
+        data = [[] for c in columns]
+        while True:
+            rows = rp.fetchmany(FETCH_SIZE)
+            if not len(rows):
+                break
+            for i, values in enumerate(data):
+                values.extend([row[i] for row in rows])
+        self.amount = np.array(data.pop(), dtype=np.float64)
+        self.size = len(self.amount)
+        self.codes, self.labels, self.members = {}, {}, {}
+        for dimension, values in zip(ds.dimensions, data):
+            codes, labels = encode(values)
+            self.codes[dimension.name] = codes
+            self.labels[dimension.name] = labels
+            if isinstance(dimension, ComplexDimension):
+                rp = ds.bind.execute(dimension.table.select())
+                self.members[dimension.name] = \
+                        dict([(row['id'], dict(row)) for row in rp])
+        self._keys = {}
+        self.loaded_at = time.time()
+
+    def _key(self, key):
+        """ Get the per-entry codes and the labels for ``key``, which may
+        refer to an attribute of a complex dimension. """
+        if not key in self._keys:
+            name, attr = key.split('.', 1) if '.' in key else (key, None)
+            self.dataset[name]
+            codes, labels = self.codes[name], self.labels[name]
+            if attr is not None:
+                members = self.members[name]
+                attr_codes, labels = encode([members[l][attr] \
+                        if l is not None else None for l in labels])
+                codes = attr_codes[codes] if len(attr_codes) else codes
+            self._keys[key] = (codes, labels)
+        return self._keys[key]
+
+    def aggregate(self, metric='amount', drilldowns=None, cuts=None,
+                  page=1, pagesize=10000, order=None):
+        """ Aggregate like :meth:`Dataset.aggregate`. """
+        if self.stale:
+            self.refresh()
+        drilldowns = list(drilldowns or [])
+        mask = np.ones(self.size, dtype=bool)
+        filters = defaultdict(set)
+        for key, value in cuts or []:
+            filters[key].add(coercer(self.dataset.key(key).type)(value))
+        for key, values in filters.items():
+            codes, labels = self._key(key)
+            matches = [i for i, l in enumerate(labels) if l in values]
+            mask &= np.in1d(codes, matches)
+        amount = np.nan_to_num(self.amount[mask])
+        summary = {metric: float(amount.sum()),
+                   'num_entries': int(mask.sum())}
+        if not len(drilldowns):
+            total = summary[metric] if summary['num_entries'] else None
+            drilldown = [{metric: total,
+                          'num_entries': summary['num_entries']}]
+            return {'drilldown': drilldown, 'summary': summary}
+
+        keys = [self._key(k) for k in drilldowns]
+        combined = np.zeros(int(mask.sum()), dtype=np.int64)
+        for codes, labels in keys:
+            combined = combined * len(labels) + codes[mask]
+        groups, inverse = np.unique(combined, return_inverse=True)
+        sums = np.bincount(inverse, weights=amount)
+        counts = np.bincount(inverse)
+        group_codes = []
+        for codes, labels in reversed(keys):
+            group_codes.insert(0, groups % len(labels))
+            groups = groups // len(labels)
+
+        results = []
+        for g in xrange(len(sums)):
+            values = [labels[c[g]] for c, (codes, labels) in \
+                      zip(group_codes, keys)]
+            results.append((float(sums[g]), int(counts[g]), values))
+        results.sort(key=lambda r: _sort_key(r[2]))
+        positions = dict([(k, i) for i, k in enumerate(drilldowns)])
+        for key, direction in reversed(order or [(metric, True)]):
+            if key == metric:
+                results.sort(key=lambda r: r[0], reverse=bool(direction))
+                continue
+            if not key in positions:
+                raise ValueError("Cannot order by %s, which is not a "
+                                 "drilldown." % key)
+            i = positions[key]
+            results.sort(key=lambda r: _sort_key([r[2][i]]),
+                         reverse=bool(direction))
+
+        drilldown = []
+        offset = (page-1)*pagesize
+        for total, count, values in results[offset:offset+pagesize]:
+            record = {metric: total, 'num_entries': count}
+            for key, value in zip(drilldowns, values):
+                if '.' in key:
+                    name, attr = key.split('.', 1)
+                    record.setdefault(name, {})[attr] = value
+                elif key in self.members:
+                    record[key] = dict(self.members[key].get(value, {}))
+                else:
+                    record[key] = value
+            drilldown.append(record)
+        return {'drilldown': drilldown, 'summary': summary}
+
+_cubes = {}
+
+def get_cube(dataset, max_age=None):
+    """ Get the cube for ``dataset``, which is shared by all instances
+    of the same dataset within the process. """
+    cube = _cubes.get(dataset.name)
+    if cube is None:
+        cube = _cubes[dataset.name] = Cube(dataset, max_age=max_age)
+    elif cube.dataset is not dataset:
+        cube.dataset = dataset
+    return cube
+
+def invalidate_cube(name):
+    """ Mark the cube of the dataset called ``name`` as outdated. """
+    if name in _cubes:
+        _cubes[name].invalidate()
+
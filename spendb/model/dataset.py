@@ -1,10 +1,25 @@
 from collections import defaultdict
 
-from spendb.core import db
+from spendb.core import app, db
 
-from spendb.model.common import TableHandler, JSONType
+from spendb.model.advisor import get_advisor
+from spendb.model.attribute import coercer
+from spendb.model.cache import get_cache
+from spendb.model.catalog import SchemaCatalog, model_rev
+from spendb.model.common import TableHandler, JSONType, MutableDict
+from spendb.model.common import LRUCache, create_column
+from spendb.model.common import ResultDecoder, chunked, FETCH_SIZE
+from spendb.model.cube import get_cube, invalidate_cube
 from spendb.model.dimension import ComplexDimension, ValueDimension
 from spendb.model.dimension import Metric
+from spendb.model.rollup import Rollup
+from spendb.model.stats import get_stats, instrumented
+
+QUERY_PLAN_CACHE_SIZE = 500
+
+# placeholders for LIMIT and OFFSET, whose parameters are found in the
+# compiled plan and bound to the actual page when it runs:
+PLAN_LIMIT, PLAN_OFFSET = 987654321, 987654322
 
 class Dataset(TableHandler, db.Model):
     
@@ -13,7 +28,8 @@ class Dataset(TableHandler, db.Model):
     label = db.Column(db.Unicode(2000))
     description = db.Column(db.Unicode())
     currency = db.Column(db.Unicode())
-    data = db.Column(JSONType, default=dict)
+    data = db.Column(MutableDict.as_mutable(JSONType), default=dict)
+    version = db.Column(db.Integer, default=0)
 
     def __init__(self, data):
         self.data = data
@@ -26,6 +42,9 @@ class Dataset(TableHandler, db.Model):
 
     @db.reconstructor
     def _load_model(self):
+        self.unique_keys = self.data.get('dataset', {}).get('unique_keys', [])
+        self.rollups = [Rollup(self, dims) for dims in \
+                        self.data.get('dataset', {}).get('rollups', [])]
         self.dimensions = []
         self.metrics = []
         for dim, data in self.data.get('mapping', {}).items():
@@ -37,57 +56,226 @@ class Dataset(TableHandler, db.Model):
             else:
                 dimension = ComplexDimension(self, dim, data)
             self.dimensions.append(dimension)
+        self._fields = self.dimensions + self.metrics
+        self._field_index = dict([(f.name, f) for f in self._fields])
     
     def __getitem__(self, name):
         """ Access a field (dimension or metric) by name. """
-        for field in self.fields:
-            if field.name == name:
-                return field
-        raise KeyError()
+        return self._field_index[name]
 
     @property
     def fields(self):
         """ Both the dimensions and metrics in this dataset. """
-        return self.dimensions + self.metrics
+        return self._fields
+
+    @property
+    def unique_columns(self):
+        """ The entry table columns which identify an entry, as given by
+        ``unique_keys``. Keys on a complex dimension are resolved to its
+        foreign key column. """
+        columns = []
+        for key in self.unique_keys:
+            column = self.key(key)
+            if column.table != self.alias:
+                column = self[key.split('.')[0]].column
+            columns.append(self.table.c[column.name])
+        return columns
 
     def generate(self):
-        """ Create the main entity table for this dataset. """
+        """ Create the main entity table for this dataset. If the tables
+        for the current model are in the schema catalog, they are defined
+        from there, otherwise they are reflected and recorded. """
         self.bind = db.engine
         self.meta = db.metadata
         self.meta.bind = self.bind
 
-        self._ensure_table(self.meta, self.name + '_entry')
+        rev = model_rev(self.data)
+        self._schema = SchemaCatalog.lookup(self.bind, self.name, rev)
+        self._ensure_table(self.meta, self.name + '_entry', self._schema)
+        if not 'source_id' in self.table.c:
+            create_column(db.Column('source_id', db.Integer, index=True),
+                self.table, index_name=self.table.name + '_source_id_index')
         for field in self.fields:
             field.generate(self.meta, self.table)
         self.alias = self.table.alias('entry')
+        # query parts refer to the aliases, so they must be rebuilt:
+        self._keys = {}
+        self._join_trees = {}
+        self._plans = LRUCache(QUERY_PLAN_CACHE_SIZE)
+        index = self.name + '_unique_key'
+        if self.unique_keys and \
+            not index in [i.name for i in self.table.indexes]:
+            db.Index(index, *self.unique_columns, unique=True).create(self.bind)
+        for rollup in self.rollups:
+            rollup.generate(self.meta, self.table)
+        if self._schema is None:
+            tables = [self.table] + [r.table for r in self.rollups] + \
+                [d.table for d in self.dimensions if hasattr(d, 'table')]
+            SchemaCatalog.record(self.bind, self.name, rev, tables)
 
     def load(self, row):
-        entry = dict()
-        for field in self.fields:
-            entry.update(field.load(self.bind, row))
-        self._upsert(self.bind, entry, ['id'])
+        self.load_chunk([row])
+
+    def _write(self, bind, entries):
+        """ Write a batch of resolved entries, updating those which
+        already exist if the dataset has ``unique_keys``, and apply the
+        changes to all rollups. """
+        replaced = []
+        if self.unique_keys:
+            unique = [c.name for c in self.unique_columns]
+            fetch = set()
+            for rollup in self.rollups:
+                fetch.update(rollup.columns + ['amount'])
+            entries, replaced = self._upsert_many(bind, entries, unique,
+                                                  fetch=list(fetch))
+        else:
+            self._insert_many(bind, entries)
+        for rollup in self.rollups:
+            rollup.update(bind, entries, replaced)
+
+    def load_all(self, rows, chunk_size=1000, source_id=None):
+        """ Load all ``rows``. Rows are buffered in chunks of
+        ``chunk_size``, each of which is written with batched statements
+        inside its own transaction. With a ``chunk_size`` of
+        ``None``, each row is loaded individually. """
+        if chunk_size is None:
+            for row in rows:
+                self.load_chunk([row], source_id=source_id)
+            return
+        for chunk in chunked(rows, chunk_size):
+            self.load_chunk(chunk, source_id=source_id)
+
+    @instrumented('load', rows=lambda rows, *a, **kw: len(rows))
+    def load_chunk(self, rows, callback=None, source_id=None):
+        """ Resolve and write a list of ``rows`` in one transaction. If
+        given, ``callback`` is called with the connection just before the
+        transaction is committed. Entries are tagged with ``source_id``
+        so that they can be replaced when their source changes. """
+        conn = self.bind.connect()
+        tx = conn.begin()
+        try:
+            # resolve and convert the chunk column by column:
+            columns = {}
+            for field in self.fields:
+                columns.update(field.load_batch(conn, rows))
+            names = columns.keys()
+            entries = [dict(zip(names, values)) for values in \
+                       zip(*[columns[n] for n in names])]
+            if source_id is not None:
+                for entry in entries:
+                    entry['source_id'] = source_id
+            self._write(conn, entries)
+            if callback is not None:
+                callback(conn)
+            self.invalidate(conn)
+            tx.commit()
+        except:
+            tx.rollback()
+            for field in self.fields:
+                field.clear_cache()
+            raise
+        finally:
+            conn.close()
 
-    def load_all(self, rows):
-        for row in rows:
-            self.load(row)
-        #bind.commit()
+    def delete_source(self, source_id):
+        """ Delete the entries loaded from a source, and remove them from
+        the rollups, in one transaction. """
+        condition = self.table.c.source_id==source_id
+        conn = self.bind.connect()
+        tx = conn.begin()
+        try:
+            for rollup in self.rollups:
+                rollup.remove(conn, condition)
+            conn.execute(self.table.delete(condition))
+            self.invalidate(conn)
+            tx.commit()
+        except:
+            tx.rollback()
+            raise
+        finally:
+            conn.close()
 
     def flush(self):
         for field in self.fields:
             field.flush(self.bind)
+        for rollup in self.rollups:
+            rollup._flush(self.bind)
         self._flush(self.bind)
+        self.invalidate()
 
     def drop(self):
         for field in self.fields:
             field.drop(self.bind)
+        for rollup in self.rollups:
+            rollup._drop(self.bind)
         self._drop(self.bind)
+        SchemaCatalog.forget(self.bind, self.name)
+        self.invalidate()
 
-    def key(self, key):
+    def invalidate(self, bind=None):
+        """ Discard cached aggregates and cubes after the data changed and
+        count up the stored ``version`` of the data. Pass the connection
+        of the transaction which changes the data as ``bind``, so that the
+        new version is committed together with the data. """
+        get_cache().invalidate(self.name)
+        invalidate_cube(self.name)
+        table = self.__table__
+        q = table.update(table.c.name==self.name,
+                {'version': db.func.coalesce(table.c.version, 0) + 1})
+        (bind or self.bind).execute(q)
+        session = db.object_session(self)
+        if session is not None and self.id is not None:
+            session.expire(self, ['version'])
+
+    def stats(self):
+        """ Timings and statement counts of the operations on this
+        dataset in this process. """
+        return get_stats().report(self.name)
+
+    @property
+    def etag(self):
+        """ Identify the current state of the model and the data, e.g.
+        for HTTP caching. """
+        return "%s-%s" % (self.version or 0, model_rev(self.data)[:12])
+
+    def refresh_rollups(self):
+        """ Re-compute all rollups from the entry table. """
+        conn = self.bind.connect()
+        tx = conn.begin()
+        try:
+            for rollup in self.rollups:
+                rollup.refresh(conn)
+            self.invalidate(conn)
+            tx.commit()
+        except:
+            tx.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def rollup_for(self, names):
+        """ Find the smallest rollup which covers all of the dimensions
+        in ``names``, or ``None``. """
+        rollups = [r for r in self.rollups if r.covers(names)]
+        if not len(rollups):
+            return None
+        return min(rollups, key=lambda r: len(r.dimensions))
+
+    def key(self, key, base=None):
         """ For a given ``key``, find a column to indentify it in a query.
         A ``key`` is either the name of a simple attribute (e.g. ``time``)
         or of an attribute of a complex dimension (e.g. ``to.label``). The
         returned key is using an alias, so it can be used in a query 
-        directly. """
+        directly. Keys of value dimensions are taken from ``base`` if
+        given, rather than from the entry table. """
+        base = self.alias if base is None else base
+        column = self._keys.get((key, base))
+        if column is None:
+            column = self._key(key, base)
+            self._keys[(key, base)] = column
+        return column
+
+    def _key(self, key, base):
         attr = None
         if '.' in key:
             key, attr = key.split('.', 1)
@@ -95,100 +283,167 @@ class Dataset(TableHandler, db.Model):
         if hasattr(dimension, 'alias'):
             attr_name = dimension[attr].column.name if attr else 'id'
             return dimension.alias.c[attr_name]
-        return self.alias.c[dimension.column.name]
+        return base.c[dimension.column.name]
 
-    def materialize(self, conditions="1=1", order_by=None):
+    def _joins(self, keys, base):
+        """ Join ``base`` to the tables of all dimensions used in
+        ``keys``. """
+        names = frozenset([k.split('.')[0] for k in keys])
+        joins = self._join_trees.get((names, base))
+        if joins is None:
+            joins = base
+            for name in sorted(names):
+                joins = self[name].join(joins, base)
+            self._join_trees[(names, base)] = joins
+        return joins
+
+    def cut_conditions(self, cuts):
+        """ Turn a list of ``(key, value)`` cuts into a filter. Values for
+        the same key are alternatives, different keys must all match. """
+        filters = defaultdict(set)
+        for key, value in cuts:
+            filters[key].add(value)
+        conditions = db.and_()
+        for key, values in filters.items():
+            column = self.key(key)
+            coerce = coercer(column.type)
+            conditions.append(db.or_(*[column==coerce(v) for v in values]))
+        return conditions
+
+    @instrumented('materialize')
+    def materialize(self, conditions="1=1", order_by=None,
+                    batch_size=FETCH_SIZE, keys=None, cuts=None):
         """ Generate a fully denormalized view of the entries on this 
-        table. """
-        joins = self.alias
-        for f in self.fields:
-            joins = f.join(joins)
-        query = db.select([f.selectable for f in self.fields], 
-                       conditions, joins, order_by=order_by,
+        table, fetching ``batch_size`` rows at a time. The view can be
+        limited to a list of ``keys`` and filtered by ``cuts``. """
+        cuts = cuts or []
+        if keys is None:
+            selected = [f.selectable for f in self.fields]
+            joins = self._joins([f.name for f in self.fields], self.alias)
+        else:
+            selected = [self.key(k) for k in keys]
+            joins = self._joins(keys + [k for k,v in cuts], self.alias)
+        if len(cuts):
+            conditions = db.and_(conditions, self.cut_conditions(cuts))
+        query = db.select(selected, conditions, joins, order_by=order_by,
                        use_labels=True)
+        # use a server-side cursor where the driver would buffer all rows:
+        query = query.execution_options(stream_results=True)
+        decoder = ResultDecoder(query, self.alias)
         rp = self.bind.execute(query)
-        while True:
-            row = rp.fetchone()
-            if row is None:
-                break
-            result = {}
-            for k, v in row.items():
-                field, attr = k.split('_', 1)
-                if field == 'entry':
-                    result[attr] = v
-                else:
-                    if not field in result:
-                        result[field] = dict()
-                    result[field][attr] = v
-            yield result
+        for record in decoder.iterate(rp, batch_size):
+            yield record
 
+    @instrumented('aggregate')
     def aggregate(self, metric='amount', drilldowns=None, cuts=None, 
             page=1, pagesize=10000, order=None):
+        """ Aggregate the ``metric`` grouped by ``drilldowns`` and
+        filtered by ``cuts``. Results are cached by the ``version`` of
+        the data, so loads in other processes are seen as well. If
+        ``AGGREGATE_ENGINE`` is set to ``cube``, the aggregation runs on
+        an in-memory copy of the entries. """
+        cuts = sorted(cuts or [])
+        get_advisor(self).record(list(drilldowns or []) + \
+                                 [k for k,v in cuts] + \
+                                 [k for k,d in order or []])
+        cache = get_cache()
+        key = cache.key(metric=metric, drilldowns=drilldowns, cuts=cuts,
+                        page=page, pagesize=pagesize, order=order,
+                        version=self.version)
+        result = cache.get(self.name, key)
+        if result is None:
+            if app.config.get('AGGREGATE_ENGINE') == 'cube':
+                cube = get_cube(self, max_age=app.config.get('CUBE_MAX_AGE'))
+                result = cube.aggregate(metric, drilldowns, cuts, page,
+                                        pagesize, order)
+            else:
+                result = self._aggregate(metric, drilldowns, cuts, page,
+                                         pagesize, order)
+            cache.set(self.name, key, result)
+        return result
 
-        cuts = cuts or []
-        drilldowns = drilldowns or []
-        joins = self.alias
-        for dimension in set(drilldowns + [k for k,v in cuts]):
-            joins = self[dimension.split('.')[0]].join(joins)
+    def _plan_aggregate(self, metric, drilldowns, cut_shape, order):
+        """ Compile the drilldown and summary queries for an aggregation.
+        ``cut_shape`` gives the number of values for each cut key, which
+        are bound as ``cut_<i>_<j>`` parameters. The page is bound as
+        well, using the parameter names returned with the plan. """
+        keys = drilldowns + [k for k,n in cut_shape] + [k for k,d in order]
+        rollup = self.rollup_for([k.split('.')[0] for k in keys])
+        if rollup is None:
+            base = self.alias
+            count = db.func.count(base.c.id)
+        else:
+            base = rollup.alias
+            count = db.func.sum(base.c.entries)
+        joins = self._joins(drilldowns + [k for k,n in cut_shape], base)
 
         group_by = []
-        fields = [db.func.sum(self.alias.c.amount).label(metric), 
-                  db.func.count(self.alias.c.id).label("entries")]
+        total = db.func.sum(base.c.amount).label(metric)
+        fields = [total, count.label("num_entries")]
         for key in drilldowns:
-            column = self.key(key)
-            if '.' in key or column.table == self.alias:
+            column = self.key(key, base)
+            if '.' in key or column.table == base:
                 fields.append(column)
             else:
                 fields.append(column.table)
             group_by.append(column)
      
         conditions = db.and_()
-        filters = defaultdict(set)
-        for key, value in cuts:
-            column = self.key(key)
-            filters[column].add(value)
-        for attr, values in filters.items():
-            conditions.append(db.or_(*[attr==v for v in values]))
+        for i, (key, num) in enumerate(cut_shape):
+            column = self.key(key, base)
+            conditions.append(db.or_(*[column==db.bindparam('cut_%d_%d' % \
+                                      (i, j)) for j in range(num)]))
 
         order_by = []
-        for key, direction in order or []:
+        for key, direction in order:
             # TODO: handle case in which order criterion is not joined.
-            column = self.key(key)
-            order_by.append(column.desc() if direction else column.asc())
-
-        query = db.select(fields, conditions, joins,
-                       order_by=order_by or [metric + ' desc'],
-                       group_by=group_by, use_labels=True)
-        #print query
-        summary = {metric: 0.0, 'num_entries': 0}
-        drilldown = []
-        rp = self.bind.execute(query)
-        while True:
-            row = rp.fetchone()
-            if row is None:
-                break
-            result = {}
-            for key, value in row.items():
-                if key == metric:
-                    summary[metric] += value
-                if key == 'entries':
-                    summary['num_entries'] += value
-                if '_' in key:
-                    dimension, attribute = key.split('_', 1)
-                    if dimension == 'entry':
-                        result[attribute] = value
-                    else:
-                        if not dimension in result:
-                            result[dimension] = {}
-                        result[dimension][attribute] = value
-                else:
-                    if key == 'entries':
-                        key = 'num_entries'
-                    result[key] = value
-            drilldown.append(result)
-        offset = ((page-1)*pagesize)
-        return {'drilldown': drilldown[offset:offset+pagesize],
-                'summary': summary}
+            column = total if key == metric else self.key(key, base)
+            order_by.append(db.desc(column) if direction else db.asc(column))
+
+        # group columns break ties so that pages don't overlap:
+        order_by = (order_by or [db.desc(total)]) + group_by
+        query = db.select(fields, conditions, joins, order_by=order_by,
+                       group_by=group_by, use_labels=True,
+                       limit=PLAN_LIMIT, offset=PLAN_OFFSET)
+        compiled = query.compile(bind=self.bind)
+        paging = dict([(p.value, name) for p, name in \
+                       compiled.bind_names.items() \
+                       if p.value in (PLAN_LIMIT, PLAN_OFFSET)])
+        summary = db.select([db.func.sum(base.c.amount), count],
+                            conditions, joins)
+        return compiled, summary.compile(bind=self.bind), \
+               ResultDecoder(query, base), \
+               (paging[PLAN_LIMIT], paging[PLAN_OFFSET])
+
+    def _aggregate(self, metric, drilldowns, cuts, page, pagesize, order):
+        drilldowns = list(drilldowns or [])
+        order = [tuple(o) for o in order or []]
+        filters = defaultdict(set)
+        for key, value in cuts or []:
+            filters[key].add(value)
+        cut_shape = tuple(sorted([(k, len(v)) for k, v in filters.items()]))
+        params = {}
+        for i, (key, num) in enumerate(cut_shape):
+            coerce = coercer(self.key(key).type)
+            values = sorted([coerce(v) for v in filters[key]])
+            for j, value in enumerate(values):
+                params['cut_%d_%d' % (i, j)] = value
+        shape = (metric, tuple(drilldowns), cut_shape, tuple(order))
+        plan = self._plans.get(shape)
+        if plan is None:
+            plan = self._plan_aggregate(metric, drilldowns, cut_shape, order)
+            self._plans.set(shape, plan)
+        query, summary, decoder, (limit, offset) = plan
+
+        page_params = dict(params)
+        page_params[limit] = pagesize
+        page_params[offset] = (page - 1) * pagesize
+        rp = self.bind.execute(query, page_params)
+        drilldown = list(decoder.iterate(rp))
+
+        total, num_entries = self.bind.execute(summary, params).fetchone()
+        summary = {metric: total or 0.0, 'num_entries': num_entries or 0}
+        return {'drilldown': drilldown, 'summary': summary}
 
     def __repr__(self):
         return "<Dataset(%s:%s:%s)>" % (self.name, self.dimensions,
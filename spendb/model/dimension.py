@@ -1,7 +1,11 @@
 
 from spendb.core import db
 from spendb.model.attribute import Attribute
-from spendb.model.common import TableHandler
+from spendb.model.common import TableHandler, LRUCache, create_column
+from spendb.model.common import FETCH_SIZE
+from spendb.model.stats import instrumented
+
+MEMBER_CACHE_SIZE = 10000
 
 class Dimension(object):
 
@@ -12,7 +16,7 @@ class Dimension(object):
         self.label = data.get('label', name)
         self.facet = data.get('facet')
 
-    def join(self, from_clause):
+    def join(self, from_clause, base=None):
         return from_clause
 
     def flush(self, bind):
@@ -21,6 +25,9 @@ class Dimension(object):
     def drop(self, bind):
         del self.column
 
+    def clear_cache(self):
+        pass
+
     def __getitem__(self, name):
         raise KeyError()
 
@@ -32,6 +39,20 @@ class ValueDimension(Dimension, Attribute):
     def __init__(self, dataset, name, data):
         Attribute.__init__(self, dataset, data)
         Dimension.__init__(self, dataset, name, data)
+
+    def members(self, bind, batch_size=FETCH_SIZE):
+        """ Generate the distinct values of the dimension. """
+        q = db.select([self.column], distinct=True, order_by=[self.column])
+        rp = bind.execute(q)
+        for rows in iter(lambda: rp.fetchmany(batch_size), []):
+            for row in rows:
+                yield row[0]
+
+    def generate(self, meta, table):
+        Attribute.generate(self, meta, table)
+        index = table.name + '_' + self.name + '_index'
+        if self.facet and not index in [i.name for i in table.indexes]:
+            db.Index(index, self.column).create(meta.bind)
     
     def __repr__(self):
         return "<ValueDimension(%s)>" % self.name
@@ -43,7 +64,7 @@ class Metric(Attribute):
         self.name = name
         self.label = data.get('label', name)
 
-    def join(self, from_clause):
+    def join(self, from_clause, base=None):
         return from_clause
 
     def flush(self, bind):
@@ -52,6 +73,9 @@ class Metric(Attribute):
     def drop(self, bind):
         pass
 
+    def clear_cache(self):
+        pass
+
     def __getitem__(self, name):
         raise KeyError()
 
@@ -63,20 +87,67 @@ class ComplexDimension(Dimension, TableHandler):
     def __init__(self, dataset, name, data):
         Dimension.__init__(self, dataset, name, data)
         self.scheme = data.get('scheme', data.get('taxonomy', 'entity'))
+        self.cache_size = data.get('cache_size', MEMBER_CACHE_SIZE)
+        self.cache = None
         self.attributes = []
         for attr in data.get('attributes', data.get('fields', [])):
             self.attributes.append(Attribute(self, attr))
 
-    def join(self, from_clause):
-        return from_clause.join(self.alias, self.alias.c.id==self.column_alias)
+    def join(self, from_clause, base=None):
+        """ Join the dimension table to ``from_clause``, using the foreign
+        key on ``base`` (by default, the entry table). """
+        if base is None:
+            return from_clause.join(self.alias,
+                                    self.alias.c.id==self.column_alias)
+        return from_clause.join(self.alias,
+                                self.alias.c.id==base.c[self.column.name])
     
     def flush(self, bind):
         self._flush(bind)
+        self.clear_cache()
     
     def drop(self, bind):
         self._drop(bind)
+        self.clear_cache()
         del self.column
 
+    def members(self, bind, batch_size=FETCH_SIZE):
+        """ Generate the members used by entries of the dataset, as dicts
+        of their attributes. """
+        used = db.select([self.column], distinct=True)
+        q = db.select([self.table], self.table.c.id.in_(used),
+                      order_by=[self.table.c[c] for c in self.key_columns])
+        rp = bind.execute(q)
+        for rows in iter(lambda: rp.fetchmany(batch_size), []):
+            for row in rows:
+                yield dict(row.items())
+
+    def clear_cache(self):
+        """ Forget all cached member IDs, e.g. after a rollback. """
+        self.cache = None
+
+    @property
+    def key_columns(self):
+        """ The columns which identify a member: its name or, if the
+        dimension has no name attribute, all of its attributes. """
+        names = [a.name for a in self.attributes]
+        return ['name'] if 'name' in names else names
+
+    def _member_key(self, values):
+        return values[0] if len(values) == 1 else tuple(values)
+
+    def _member_cache(self, bind):
+        """ Get the cache of member keys to IDs, warming it from the
+        dimension table on first use. """
+        if self.cache is None:
+            self.cache = LRUCache(self.cache_size)
+            q = db.select([self.table.c[c] for c in self.key_columns] + \
+                          [self.table.c.id], limit=self.cache_size)
+            for row in bind.execute(q):
+                row = tuple(row)
+                self.cache.set(self._member_key(row[:-1]), row[-1])
+        return self.cache
+
     @property
     def column_alias(self):
         return self.dataset.alias.c[self.column.name]
@@ -92,23 +163,51 @@ class ComplexDimension(Dimension, TableHandler):
         raise KeyError()
 
     def generate(self, meta, entry_table):
-        self._ensure_table(meta, self.dataset.name + '_' + self.scheme)
+        self._ensure_table(meta, self.dataset.name + '_' + self.scheme,
+                           self.dataset._schema)
         for attr in self.attributes:
             attr.generate(meta, self.table)
+        # concurrent loaders rely on this to avoid duplicate members:
+        key = self.key_columns
+        index = self.table.name + ('_name_index' if key == ['name'] \
+                                   else '_key_index')
+        if not index in [i.name for i in self.table.indexes]:
+            db.Index(index, *[self.table.c[c] for c in key],
+                     unique=True).create(meta.bind)
         fk = self.name + '_id'
         if not fk in entry_table.c:
             self.column = db.Column(self.name + '_id', db.Integer, index=True)
-            self.column.create(entry_table, index_name=self.name + '_id_index')
+            create_column(self.column, entry_table,
+                index_name=entry_table.name + '_' + self.name + '_id_index')
         else:
             self.column = entry_table.c[fk]
         self.alias = self.table.alias(self.name)
 
     def load(self, bind, row):
-        dim = dict()
+        ids = self.load_batch(bind, [row])[self.column.name]
+        return {self.column.name: ids[0]}
+
+    @instrumented('dimension_load', hot=True,
+                  rows=lambda bind, rows: len(rows))
+    def load_batch(self, bind, rows):
+        """ Find or create the members for all ``rows``, returning a list
+        of their IDs keyed by the foreign key column name. """
+        columns = {}
         for attr in self.attributes:
-            dim.update(attr.load(bind, row))
-        pk = self._upsert(bind, dim, ['name'])
-        return {self.column.name: pk}
+            columns.update(attr.load_batch(bind, rows))
+        cache = self._member_cache(bind)
+        key_columns = self.key_columns
+        keys = [self._member_key(k) for k in \
+                zip(*[columns[c] for c in key_columns])]
+        ids = []
+        for i, key in enumerate(keys):
+            pk = cache.get(key)
+            if pk is None:
+                dim = dict([(k, v[i]) for k, v in columns.items()])
+                pk = self._upsert(bind, dim, key_columns)
+                cache.set(key, pk)
+            ids.append(pk)
+        return {self.column.name: ids}
 
     def __repr__(self):
         return "<ComplexDimension(%s/%s:%s)>" % (self.scheme, self.name, 
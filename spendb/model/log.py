@@ -1,8 +1,18 @@
 from datetime import datetime
+from weakref import WeakSet
+import atexit
 import logging
+import sys
+import threading
+import time
+import traceback
 
 from spendb.core import db
 from spendb.model.dataset import Dataset
+from spendb.model.stats import instrumented
+
+BUFFER_SIZE = 100
+FLUSH_INTERVAL = 5.0
 
 class DatasetLogRecord(db.Model):
     __tablename__ = 'log_record'
@@ -29,27 +39,115 @@ class DatasetLogRecord(db.Model):
                                               self.message)
 
 class DatasetLogger(logging.Logger):
+    """ Log to the ``log_record`` table of a dataset. Records are buffered
+    and written in bulk on a connection of their own once there are
+    ``buffer_size`` of them or ``flush_interval`` seconds have passed.
+    With ``background`` set, a thread does the writing so that logging
+    never waits for the database. Use the logger as a context manager,
+    or call ``close()``, to make sure all records are written. Logging
+    never raises: failures go to ``handleError`` and records which could
+    not be written are kept for the next flush. """
 
-    def __init__(self, dataset, level=logging.DEBUG):
+    def __init__(self, dataset, level=logging.DEBUG, buffer_size=BUFFER_SIZE,
+                 flush_interval=FLUSH_INTERVAL, background=False):
         self.dataset = dataset
         self.name = dataset.name
         self.level = level
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.last_flush = time.time()
+        self.lock = threading.Lock()
+        self.thread = None
+        _loggers.add(self)
+        if background:
+            self.wakeup = threading.Event()
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
 
     def handle(self, record):
-        dlr = DatasetLogRecord()
-        dlr.dataset_id = self.dataset.id
-        dlr.name = record.name
-        dlr.message = record.getMessage()
-        dlr.level = record.levelname
-        dlr.file_name = record.filename
-        dlr.module = record.module
-        dlr.line_number = record.lineno
-        dlr.func = record.funcName
-        
-        #session = db.create_scoped_session()
-        #session.begin()
-        #session = db.Session(bind=db.engine)
-        db.session.add(dlr)
-        db.session.flush()
-        #session.commit()
+        try:
+            data = {
+                'dataset_id': self.dataset.id,
+                'logger': record.name,
+                'created_at': datetime.utcfromtimestamp(record.created),
+                'message': record.getMessage(),
+                'level': record.levelname,
+                'file_name': record.filename,
+                'module': record.module,
+                'line_number': unicode(record.lineno),
+                'func': record.funcName
+                }
+        except Exception:
+            self.handleError(record)
+            return
+        with self.lock:
+            self.buffer.append(data)
+            full = len(self.buffer) >= self.buffer_size or \
+                time.time() - self.last_flush >= self.flush_interval
+        if full:
+            if self.thread is not None:
+                self.wakeup.set()
+            else:
+                self.flush()
+
+    @instrumented('log_flush')
+    def flush(self):
+        """ Write all buffered records. """
+        with self.lock:
+            records, self.buffer = self.buffer, []
+            self.last_flush = time.time()
+        if len(records):
+            try:
+                self._write(records)
+            except Exception:
+                # keep the records for the next attempt:
+                with self.lock:
+                    self.buffer = records + self.buffer
+                self.handleError(records)
+
+    def handleError(self, records):
+        """ Report a record which could not be formatted, or records
+        which could not be written, like :meth:`logging.Handler.handleError`
+        does: on ``stderr``, unless ``logging.raiseExceptions`` is off. """
+        if logging.raiseExceptions:
+            try:
+                traceback.print_exc(None, sys.stderr)
+            except IOError:
+                pass
+
+    def _write(self, records):
+        db.engine.execute(DatasetLogRecord.__table__.insert(), records)
+
+    def _run(self):
+        while self.thread is not None:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def close(self):
+        """ Stop the background thread, if any, and write all records. """
+        thread, self.thread = self.thread, None
+        if thread is not None:
+            self.wakeup.set()
+            thread.join()
+        self.flush()
+        _loggers.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+_loggers = WeakSet()
+
+@atexit.register
+def _close_loggers():
+    for logger in list(_loggers):
+        try:
+            logger.close()
+        except Exception:
+            pass
 
@@ -0,0 +1,105 @@
+from collections import OrderedDict
+
+from spendb.core import db
+from spendb.model.common import TableHandler, create_column
+
+class Rollup(TableHandler):
+    """ A pre-computed sum and count of the entries in a dataset, grouped
+    by a set of its dimensions. Rollups are kept up to date with each
+    load and can answer any aggregation which only uses their
+    dimensions. """
+
+    def __init__(self, dataset, dimensions):
+        self.dataset = dataset
+        self.dimensions = sorted(dimensions)
+
+    @property
+    def columns(self):
+        """ The entry table columns of the rolled up dimensions. """
+        return [self.dataset[d].column.name for d in self.dimensions]
+
+    def covers(self, names):
+        """ Check if all of the dimensions in ``names`` are rolled up. """
+        return set(names).issubset(self.dimensions)
+
+    def generate(self, meta, entry_table):
+        name = self.dataset.name + '_rollup_' + '_'.join(self.dimensions)
+        self._ensure_table(meta, name, self.dataset._schema)
+        for column in self.columns + ['amount']:
+            if not column in self.table.c:
+                col = db.Column(column, entry_table.c[column].type)
+                create_column(col, self.table)
+        if not 'entries' in self.table.c:
+            create_column(db.Column('entries', db.Integer), self.table)
+        index = name + '_key'
+        if not index in [i.name for i in self.table.indexes]:
+            columns = [self.table.c[c] for c in self.columns]
+            db.Index(index, *columns, unique=True).create(meta.bind)
+        self.alias = self.table.alias('entry')
+
+    def refresh(self, bind):
+        """ Re-compute the rollup from all entries. """
+        entry = self.dataset.table
+        columns = [entry.c[c] for c in self.columns]
+        q = db.select(columns + [db.func.sum(entry.c.amount),
+                                 db.func.count(entry.c.id)],
+                      group_by=columns)
+        prep = bind.dialect.identifier_preparer
+        targets = [prep.format_column(self.table.c[c]) for c in \
+                   self.columns + ['amount', 'entries']]
+        self._flush(bind)
+        bind.execute("INSERT INTO %s (%s) %s" % (prep.format_table(self.table),
+                     ', '.join(targets), q.compile(bind=bind)))
+
+    def update(self, bind, added, removed=()):
+        """ Apply the change of replacing the ``removed`` entries with
+        the ``added`` ones. """
+        deltas = OrderedDict()
+        for sign, entries in ((1, added), (-1, removed)):
+            for entry in entries:
+                key = tuple([entry.get(c) for c in self.columns])
+                delta = deltas.setdefault(key, [0.0, 0])
+                delta[0] += sign * float(entry.get('amount') or 0)
+                delta[1] += sign
+        self._apply(bind, deltas, len(removed) > 0)
+
+    def remove(self, bind, condition):
+        """ Apply the change of deleting the entries which match
+        ``condition``, summed up by the database. """
+        entry = self.dataset.table
+        columns = [entry.c[c] for c in self.columns]
+        q = db.select(columns + [db.func.sum(entry.c.amount),
+                                 db.func.count(entry.c.id)],
+                      condition, group_by=columns)
+        deltas = OrderedDict()
+        for row in bind.execute(q):
+            row = tuple(row)
+            deltas[row[:-2]] = [-float(row[-2] or 0), -row[-1]]
+        self._apply(bind, deltas, True)
+
+    def _apply(self, bind, deltas, shrunk):
+        """ Add the ``(amount, entries)`` deltas to the groups keyed by
+        the rolled up values, removing any that became empty. """
+        existing = self._find(bind, deltas.keys(), self.columns)
+        updates, inserts = [], []
+        for key, (amount, entries) in deltas.items():
+            if key in existing:
+                updates.append({'_id': existing[key]['id'],
+                                '_amount': amount, '_entries': entries})
+            else:
+                row = dict(zip(self.columns, key))
+                row.update({'amount': amount, 'entries': entries})
+                inserts.append(row)
+        if len(updates):
+            t = self.table
+            q = t.update(t.c.id==db.bindparam('_id'),
+                         {'amount': t.c.amount + db.bindparam('_amount'),
+                          'entries': t.c.entries + db.bindparam('_entries')})
+            bind.execute(q, updates)
+        self._insert_many(bind, inserts)
+        if shrunk:
+            bind.execute(self.table.delete(self.table.c.entries <= 0))
+
+    def __repr__(self):
+        return "<Rollup(%s:%s)>" % (self.dataset.name, self.dimensions)
+
@@ -1,26 +1,49 @@
+from datetime import datetime
+from hashlib import sha1
+import csv
 import os
+import time
+from itertools import islice
 
 from werkzeug import secure_filename
 
 from spendb.core import db
+from spendb.staging import COMPRESSION, stage, open_staged
+from spendb.model.common import chunked
 from spendb.model.dataset import Dataset
 
+HASH_BLOCK_SIZE = 1024 * 1024
+
 class Source(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     type = db.Column(db.Unicode())
     name = db.Column(db.Unicode())
     description = db.Column(db.Unicode())
+    compression = db.Column(db.Unicode())
+    loaded_rows = db.Column(db.Integer, default=0)
+    status = db.Column(db.Unicode())
+    chunks = db.Column(db.Integer, default=0)
+    chunks_done = db.Column(db.Integer, default=0)
+    background_rows = db.Column(db.Integer, default=0)
+    load_started = db.Column(db.DateTime)
+    load_updated = db.Column(db.DateTime)
+    error = db.Column(db.Unicode())
+    file_hash = db.Column(db.Unicode(40))
+    file_size = db.Column(db.Integer)
+    file_mtime = db.Column(db.Float)
 
     dataset_id = db.Column(db.Integer, db.ForeignKey('dataset.id'))
     dataset = db.relationship(Dataset,
                     backref=db.backref('sources', lazy='dynamic'))
 
-    def __init__(self, dataset, type, name, description=None):
+    def __init__(self, dataset, type, name, description=None,
+                 compression=None):
         self.dataset = dataset
         self.type = type
         self.name = secure_filename(os.path.basename(name))
         self.description = description
+        self.compression = compression
 
     @property
     def staging_path(self):
@@ -29,10 +52,151 @@ class Source(db.Model):
                             self.dataset.name)
         if not os.path.isdir(directory):
             os.makedirs(directory)
-        return os.path.join(directory, self.name)
+        return os.path.join(directory, self.name + \
+                            COMPRESSION.get(self.compression, ''))
 
-    def __repr__(self):
-        return "<Source(%s,%s)>" % (self.dataset.name, self.name)
+    def stage(self, filename):
+        """ Stage the file at ``filename`` as the data of this source,
+        compressing it if ``compression`` is set. Returns the method
+        used, see ``spendb.staging.stage``. """
+        return stage(filename, self.staging_path, self.compression)
+
+    def rows(self, offset=0):
+        """ Stream the rows of the staged file, skipping the first
+        ``offset`` rows. """
+        fh = open_staged(self.staging_path)
+        try:
+            for row in islice(csv.DictReader(fh), offset, None):
+                yield row
+        finally:
+            fh.close()
+
+    def load(self, chunk_size=1000, resume=False, progress=None,
+             fingerprint=None):
+        """ Load the staged file into the dataset, committing every
+        ``chunk_size`` rows. The number of committed rows is stored with
+        each chunk, so that an interrupted load can be continued with
+        ``resume``. ``progress`` is called after each chunk with the
+        total row count, the rows loaded in this run and the elapsed
+        time. The ``fingerprint`` of the file is stored once all rows
+        are loaded. Returns the total number of rows. """
+        fingerprint = fingerprint or self.fingerprint()
+        table = self.__table__
+        offset = (self.loaded_rows or 0) if resume else 0
+        count = offset
+        begin = time.time()
+        for chunk in chunked(self.rows(offset), chunk_size):
+            count += len(chunk)
+            def mark(conn, count=count):
+                q = table.update(table.c.id==self.id, {'loaded_rows': count})
+                conn.execute(q)
+            self.dataset.load_chunk(chunk, callback=mark, source_id=self.id)
+            if progress is not None:
+                progress(count, count - offset, time.time() - begin)
+        db.session.expire(self, ['loaded_rows'])
+        self.file_hash, self.file_size, self.file_mtime = fingerprint
+        return count
+
+    def fingerprint(self):
+        """ Get the hash, size and modification time of the staged
+        file. The hash is only computed if the size or time differ from
+        the stored ones, otherwise the stored hash is returned. """
+        stat = os.stat(self.staging_path)
+        if stat.st_size == self.file_size and stat.st_mtime == self.file_mtime:
+            return self.file_hash, stat.st_size, stat.st_mtime
+        digest = sha1()
+        fh = open(self.staging_path, 'rb')
+        try:
+            for block in iter(lambda: fh.read(HASH_BLOCK_SIZE), ''):
+                digest.update(block)
+        finally:
+            fh.close()
+        return unicode(digest.hexdigest()), stat.st_size, stat.st_mtime
+
+    def changed(self):
+        """ Check if the staged file differs from the one last loaded. """
+        return self.file_hash is None or self.fingerprint()[0] != self.file_hash
+
+    def reload(self, chunk_size=1000, progress=None):
+        """ Replace the entries of this source if the staged file has
+        changed since it was last loaded. Returns the number of rows
+        loaded, or ``None`` if the source was unchanged. """
+        fingerprint = self.fingerprint()
+        if fingerprint[0] == self.file_hash:
+            # a touched but unchanged file should not be hashed again:
+            self.file_size, self.file_mtime = fingerprint[1:]
+            return None
+        self.dataset.delete_source(self.id)
+        return self.load(chunk_size=chunk_size, progress=progress,
+                         fingerprint=fingerprint)
+
+    def queue_load(self, chunks):
+        """ Reset the progress for a background load which is split into
+        ``chunks`` jobs. Its jobs load rows out of order, so there is no
+        offset to ``resume`` from until all of them are done. """
+        self.status = u'queued'
+        self.chunks = chunks
+        self.chunks_done = 0
+        self.background_rows = 0
+        self.loaded_rows = 0
+        self.load_started = datetime.utcnow()
+        self.load_updated = self.load_started
+        self.error = None
 
+    def _mark(self, bind, values):
+        table = self.__table__
+        values['load_updated'] = datetime.utcnow()
+        bind.execute(table.update(table.c.id==self.id, values))
 
+    def mark_rows(self, bind, count):
+        """ Count ``count`` more loaded rows. The counter is updated in
+        the database, so that concurrent jobs do not overwrite each
+        other's progress. """
+        table = self.__table__
+        self._mark(bind, {'background_rows': table.c.background_rows + count,
+                          'status': u'loading'})
+
+    def mark_chunk_done(self, bind):
+        """ Count a finished job and mark the source as loaded once all
+        of them are done, when all rows can be skipped on ``resume``. """
+        table = self.__table__
+        done = table.c.chunks_done + 1
+        complete = done >= table.c.chunks
+        self._mark(bind, {'chunks_done': done,
+                          'status': db.case([(complete, u'loaded')],
+                                            else_=table.c.status),
+                          'loaded_rows': db.case([(complete,
+                                                   table.c.background_rows)],
+                                                 else_=table.c.loaded_rows)})
+
+    def mark_fingerprint(self, bind, fingerprint):
+        """ Store the ``fingerprint`` of the file of a background load
+        if all of its jobs are done. """
+        table = self.__table__
+        file_hash, file_size, file_mtime = fingerprint
+        bind.execute(table.update(db.and_(table.c.id==self.id,
+                                          table.c.status==u'loaded'),
+            {'file_hash': file_hash, 'file_size': file_size,
+             'file_mtime': file_mtime}))
+
+    def mark_failed(self, bind, error):
+        self._mark(bind, {'status': u'failed', 'error': unicode(error)})
+
+    @property
+    def progress(self):
+        """ The status of the last background load, with its throughput
+        in rows per second. """
+        duration = 0
+        if self.load_started is not None:
+            delta = self.load_updated - self.load_started
+            duration = delta.days * 86400 + delta.seconds + \
+                delta.microseconds / 1e6
+        rows = self.background_rows or 0
+        return {'status': self.status, 'loaded_rows': rows,
+                'chunks': self.chunks, 'chunks_done': self.chunks_done,
+                'error': self.error, 'duration': duration,
+                'rows_per_sec': rows / duration if duration else None}
+
+    def __repr__(self):
+        return "<Source(%s,%s)>" % (self.dataset.name, self.name)
 
@@ -0,0 +1,58 @@
+""" A cache store in an SQLite file, which is kept apart from
+:mod:`spendb.model.cache` so that only configurations which use it load
+``sqlite3``. """
+import sqlite3
+import time
+
+class SQLiteStore(object):
+    """ Keep up to ``size`` cached values in an SQLite file, which can be
+    shared by several processes. """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        conn = self._connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS aggregate_cache ("
+                     "dataset TEXT, key TEXT, value BLOB, used REAL, "
+                     "PRIMARY KEY (dataset, key))")
+        conn.commit()
+        conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, dataset, key):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT value FROM aggregate_cache WHERE "
+                               "dataset=? AND key=?", (dataset, key)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE aggregate_cache SET used=? WHERE "
+                         "dataset=? AND key=?", (time.time(), dataset, key))
+            conn.commit()
+            return str(row[0])
+        finally:
+            conn.close()
+
+    def set(self, dataset, key, value):
+        conn = self._connect()
+        try:
+            conn.execute("INSERT OR REPLACE INTO aggregate_cache VALUES "
+                         "(?, ?, ?, ?)", (dataset, key, buffer(value),
+                                          time.time()))
+            conn.execute("DELETE FROM aggregate_cache WHERE rowid IN "
+                         "(SELECT rowid FROM aggregate_cache ORDER BY used "
+                         "DESC LIMIT -1 OFFSET ?)", (self.size,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def clear(self, dataset):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM aggregate_cache WHERE dataset=?",
+                         (dataset,))
+            conn.commit()
+        finally:
+            conn.close()
@@ -0,0 +1,237 @@
+""" Timing and statement counters for dataset operations. Operations are
+marked with ``instrumented``; SQL statements run on the same thread while
+an operation is active are counted against it (and against any operations
+it was called from). Hot operations are only timed for a sample of calls,
+set by ``STATS_SAMPLE_RATE``, though all calls are counted. With
+``STATS_PERSIST``, the counters are added to the ``operation_stats``
+table every ``STATS_FLUSH_INTERVAL`` seconds and when the process ends. """
+from collections import defaultdict
+from datetime import datetime
+from functools import wraps
+import atexit
+import random
+import threading
+import time
+import types
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+
+from spendb.core import app, db
+
+FIELDS = ('calls', 'timed_calls', 'seconds', 'statements',
+          'statement_seconds', 'rows')
+
+class OperationStats(db.Model):
+    """ The accumulated counters of an operation on a dataset. """
+    __tablename__ = 'operation_stats'
+    __table_args__ = (db.UniqueConstraint('dataset', 'operation'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    dataset = db.Column(db.Unicode(255))
+    operation = db.Column(db.Unicode(255))
+    calls = db.Column(db.Integer, default=0)
+    timed_calls = db.Column(db.Integer, default=0)
+    seconds = db.Column(db.Float, default=0.0)
+    statements = db.Column(db.Integer, default=0)
+    statement_seconds = db.Column(db.Float, default=0.0)
+    rows = db.Column(db.Integer, default=0)
+    updated_at = db.Column(db.DateTime)
+
+class _Frame(object):
+
+    def __init__(self):
+        self.statements = 0
+        self.statement_seconds = 0.0
+        self.seconds = 0.0
+        self.active = False
+
+class Stats(object):
+    """ Collect the counters of all operations in this process. """
+
+    def __init__(self):
+        self.counters = defaultdict(lambda: defaultdict(float))
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.last_flush = time.time()
+
+    def _stack(self):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def _before(self, conn, cursor, statement, params, context, many):
+        self.local.statement_start = time.time()
+
+    def _after(self, conn, cursor, statement, params, context, many):
+        stack = self._stack()
+        if not stack:
+            return
+        duration = time.time() - self.local.statement_start
+        for frame in stack:
+            frame.statements += 1
+            frame.statement_seconds += duration
+
+    def count(self, dataset, operation, rows=0):
+        """ Count a call which was not timed. """
+        with self.lock:
+            counter = self.counters[(dataset, operation)]
+            counter['calls'] += 1
+            counter['rows'] += rows
+
+    def begin(self):
+        frame = _Frame()
+        self.resume(frame)
+        return frame
+
+    def resume(self, frame):
+        """ Count time and statements against ``frame`` again. """
+        frame.start = time.time()
+        frame.active = True
+        self._stack().append(frame)
+
+    def pause(self, frame):
+        """ Stop counting against ``frame`` until it is resumed. """
+        self._stack().remove(frame)
+        frame.active = False
+        frame.seconds += time.time() - frame.start
+
+    def end(self, frame, dataset, operation, rows=0, calls=1):
+        """ Record the time and statements of a timed call. """
+        if frame.active:
+            self.pause(frame)
+        stack = self._stack()
+        with self.lock:
+            counter = self.counters[(dataset, operation)]
+            counter['calls'] += calls
+            counter['timed_calls'] += calls
+            counter['seconds'] += frame.seconds
+            counter['statements'] += frame.statements
+            counter['statement_seconds'] += frame.statement_seconds
+            counter['rows'] += rows
+        if not stack and app.config.get('STATS_PERSIST') and \
+            time.time() - self.last_flush >= app.config.get(
+                'STATS_FLUSH_INTERVAL', 60):
+            self.flush()
+
+    def report(self, dataset=None):
+        """ Get the counters of each operation (of ``dataset``), with the
+        average time per timed call in milliseconds. """
+        report = []
+        with self.lock:
+            items = sorted(self.counters.items())
+        for (name, operation), counter in items:
+            if dataset is not None and name != dataset:
+                continue
+            data = dict([(f, counter[f]) for f in FIELDS])
+            data.update({'dataset': name, 'operation': operation})
+            report.append(_summarize(data))
+        return report
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+
+    def flush(self, bind=None):
+        """ Add the counters to the ``operation_stats`` table and reset
+        them. """
+        bind = bind or db.engine
+        with self.lock:
+            counters, self.counters = self.counters, \
+                defaultdict(lambda: defaultdict(float))
+            self.last_flush = time.time()
+        table = OperationStats.__table__
+        now = datetime.utcnow()
+        for (dataset, operation), counter in counters.items():
+            match = db.and_(table.c.dataset==dataset,
+                            table.c.operation==operation)
+            added = dict([(f, table.c[f] + counter[f]) for f in FIELDS])
+            added['updated_at'] = now
+            if bind.execute(table.update(match, added)).rowcount > 0:
+                continue
+            values = dict([(f, counter[f]) for f in FIELDS])
+            values.update({'dataset': dataset, 'operation': operation,
+                           'updated_at': now})
+            try:
+                bind.execute(table.insert(values))
+            except IntegrityError:
+                # another process created the row in the meantime:
+                bind.execute(table.update(match, added))
+
+def _summarize(data):
+    data['avg_ms'] = 1000 * data['seconds'] / data['timed_calls'] \
+        if data['timed_calls'] else None
+    for field in ('calls', 'timed_calls', 'statements', 'rows'):
+        data[field] = int(data[field] or 0)
+    return data
+
+def stored_stats(dataset=None, bind=None):
+    """ Read the counters saved to the ``operation_stats`` table. """
+    bind = bind or db.engine
+    table = OperationStats.__table__
+    q = table.select(order_by=[table.c.dataset, table.c.operation])
+    if dataset is not None:
+        q = q.where(table.c.dataset==dataset)
+    return [_summarize(dict([(f, row[f]) for f in FIELDS + \
+            ('dataset', 'operation')])) for row in bind.execute(q)]
+
+_stats = Stats()
+
+# count the statements of all engines against the active operations:
+event.listen(Engine, 'before_cursor_execute', _stats._before)
+event.listen(Engine, 'after_cursor_execute', _stats._after)
+
+def get_stats():
+    return _stats
+
+@atexit.register
+def _flush_stats():
+    if app.config.get('STATS_PERSIST') and _stats.counters:
+        try:
+            _stats.flush()
+        except Exception:
+            pass
+
+def _iterate(stats, it, dataset, operation):
+    # one frame from the first item to the last, which is paused while
+    # the consumer has an item so that only the production is counted:
+    frame = stats.begin()
+    rows = 0
+    try:
+        for item in it:
+            stats.pause(frame)
+            rows += 1
+            yield item
+            stats.resume(frame)
+    finally:
+        stats.end(frame, dataset, operation, rows=rows, calls=0)
+
+def instrumented(operation, hot=False, rows=None):
+    """ Record the calls of a method of a dataset or of one of its parts
+    as ``operation``. ``hot`` methods are only timed for a sample of
+    calls. ``rows`` computes the number of rows handled from the
+    arguments. Generators are timed while they produce items. """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not app.config.get('STATS_ENABLED', True):
+                return func(self, *args, **kwargs)
+            stats = _stats
+            dataset = getattr(self, 'dataset', self).name
+            count = rows(*args, **kwargs) if rows is not None else 0
+            if hot and random.random() >= app.config.get('STATS_SAMPLE_RATE',
+                                                         1.0):
+                stats.count(dataset, operation, count)
+                return func(self, *args, **kwargs)
+            frame = stats.begin()
+            try:
+                result = func(self, *args, **kwargs)
+            finally:
+                stats.end(frame, dataset, operation, rows=count)
+            if isinstance(result, types.GeneratorType):
+                return _iterate(stats, result, dataset, operation)
+            return result
+        return wrapper
+    return decorator
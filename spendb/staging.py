@@ -0,0 +1,108 @@
+""" Put source files into the staging directory and read them back. Plain
+files are hard-linked or reflinked rather than copied where possible, and
+files can be stored compressed, which the reader undoes while streaming.
+A hard-linked source shares its data with the original file: changing
+that in place also changes the staged source. """
+import bz2
+import errno
+import fcntl
+import gzip
+import os
+import shutil
+import tempfile
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# from linux/fs.h, clones the extents of a file on btrfs, xfs etc.:
+FICLONE = 0x40049409
+
+COMPRESSION = {'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz'}
+BLOCK_SIZE = 1024 * 1024
+
+def _reflink(source, target):
+    src = open(source, 'rb')
+    try:
+        dst = open(target, 'wb')
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except:
+            dst.close()
+            os.remove(target)
+            raise
+        dst.close()
+    finally:
+        src.close()
+
+def _open_compressed(path, compression, mode):
+    if compression == 'gzip':
+        # no timestamp in the header, so that equal data gives equal files:
+        return gzip.GzipFile(path, mode, mtime=0)
+    if compression == 'bz2':
+        return bz2.BZ2File(path, mode)
+    if compression == 'xz':
+        if lzma is None:
+            raise ValueError("xz compression needs the lzma module.")
+        return lzma.LZMAFile(path, mode)
+    raise ValueError("Unknown compression: %s" % compression)
+
+def compression_for(path):
+    """ Guess the compression of a staged file from its extension. """
+    for compression, suffix in COMPRESSION.items():
+        if path.endswith(suffix):
+            return compression
+    return None
+
+def stage(source, target, compression=None):
+    """ Stage the file at ``source`` as ``target``, compressed if
+    ``compression`` is one of ``COMPRESSION``. Uncompressed files are
+    hard-linked, else reflinked, and only copied if neither works. The
+    file is written next to ``target`` and renamed over it when done, so
+    a failed restage keeps the previous file. Returns the method used. """
+    # a directory of its own keeps the name, which gzip stores:
+    tmpdir = tempfile.mkdtemp(dir=os.path.dirname(target) or '.',
+                              prefix='.staging-')
+    try:
+        tmp = os.path.join(tmpdir, os.path.basename(target))
+        method = _stage(source, tmp, compression)
+        os.rename(tmp, target)
+        return method
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+def _stage(source, target, compression):
+    if compression is not None:
+        src = open(source, 'rb')
+        dst = _open_compressed(target, compression, 'wb')
+        try:
+            shutil.copyfileobj(src, dst, BLOCK_SIZE)
+        finally:
+            dst.close()
+            src.close()
+        return compression
+    try:
+        os.link(source, target)
+        return 'link'
+    except OSError, e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK,
+                           errno.ENOTSUP):
+            raise
+    try:
+        _reflink(source, target)
+        return 'reflink'
+    except (IOError, OSError):
+        pass
+    shutil.copyfile(source, target)
+    return 'copy'
+
+def open_staged(path):
+    """ Open a staged file for reading, decompressing it on the fly. """
+    compression = compression_for(path)
+    if compression is None:
+        return open(path, 'rb')
+    return _open_compressed(path, compression, 'rb')
@@ -0,0 +1,55 @@
+""" Background jobs, run by the celery workers started with
+``spendb celeryd``. A source load is split into one job per byte range
+of the staged file, so that several workers can share a large load;
+their progress is recorded on the ``Source``. """
+from spendb.core import app, db
+from spendb import loader
+from spendb.loader import MIN_PARTITION_SIZE
+from spendb.model import Dataset, Source
+
+from flaskext.celery import Celery
+
+celery = Celery(app)
+
+def _get_ds(name):
+    ds = Dataset.query.filter_by(name=name).first()
+    if ds is None:
+        raise ValueError("Dataset does not exist: %s" % name)
+    ds.generate()
+    return ds
+
+@celery.task
+def generate(dataset):
+    """ Create or update the tables of a dataset. """
+    _get_ds(dataset)
+
+@celery.task
+def refresh_rollups(dataset):
+    """ Re-compute the rollups of a dataset. """
+    _get_ds(dataset).refresh_rollups()
+
+@celery.task
+def load_source(source_id, parts=4, chunk_size=1000,
+                min_size=MIN_PARTITION_SIZE):
+    """ Split the staged file of a source into up to ``parts`` ranges
+    and queue a job to load each of them. """
+    with app.test_request_context():
+        src = Source.query.get(source_id)
+        ranges = loader.queue_source(src, parts, min_size=min_size)
+        fingerprint = src.fingerprint()
+        db.session.commit()
+    for start, end in ranges:
+        load_source_range.delay(source_id, start, end, chunk_size,
+                                fingerprint)
+    return len(ranges)
+
+@celery.task
+def load_source_range(source_id, start, end, chunk_size=1000,
+                      fingerprint=None):
+    """ Load a byte range of the staged file of a source, counting the
+    rows of each chunk within its transaction. """
+    with app.test_request_context():
+        src = Source.query.get(source_id)
+        src.dataset.generate()
+        return loader.load_source_range(src, start, end, chunk_size,
+                                        fingerprint=fingerprint)
@@ -1 +1,138 @@
+from decimal import InvalidOperation
+from itertools import islice
+import json
+
+from flask import Response, request, abort
+
 from spendb.core import app
+from spendb.export import json_default
+from spendb.model import Dataset
+from spendb.model.attribute import coercer
+
+def _dumps(obj):
+    return json.dumps(obj, default=json_default)
+
+def _get_ds(name):
+    dataset = Dataset.query.filter_by(name=name).first()
+    if dataset is None:
+        abort(404)
+    return dataset
+
+def _list(name):
+    """ Read a list of values separated by ``|`` from the query string. """
+    value = request.args.get(name)
+    return value.split('|') if value else []
+
+def _pairs(name):
+    """ Read a list of ``key:value`` pairs from the query string. """
+    pairs = [tuple(p.split(':', 1)) for p in _list(name)]
+    if any([len(p) != 2 for p in pairs]):
+        abort(400)
+    return pairs
+
+def _cuts(dataset):
+    """ Read the cuts and check that each key exists and each value
+    can be converted to the type of its column, before any of the
+    response is sent. """
+    cuts = _pairs('cut')
+    try:
+        for key, value in cuts:
+            coercer(dataset.key(key).type)(value)
+    except (KeyError, ValueError, InvalidOperation):
+        abort(400)
+    return cuts
+
+def _int(name, default, minimum=None):
+    try:
+        value = int(request.args.get(name, default))
+    except ValueError:
+        abort(400)
+    if minimum is not None and value < minimum:
+        abort(400)
+    return value
+
+def _not_modified(dataset):
+    """ Check if the client already has the current state of the data.
+    This is done before the dataset is generated or queried. """
+    return request.if_none_match.contains(dataset.etag)
+
+def _respond(dataset, body, status=200):
+    """ Stream ``body``, an iterable of strings, with the ETag of the
+    dataset so that clients can revalidate. """
+    response = Response(body, status=status, mimetype='application/json')
+    response.set_etag(dataset.etag)
+    response.cache_control.must_revalidate = True
+    return response
+
+def _stream_list(items):
+    yield '['
+    for i, item in enumerate(items):
+        yield (',' if i else '') + _dumps(item)
+    yield ']'
+
+@app.route('/api/<dataset>/aggregate')
+def aggregate(dataset):
+    """ Aggregate a dataset. Drilldowns are given as ``drilldown=to|time``,
+    cuts as ``cut=time:2010|field:foo`` and the order as
+    ``order=amount:desc``. The metric must be one of the measures of the
+    dataset, and the results can only be ordered by the metric or one of
+    the drilldowns. """
+    dataset = _get_ds(dataset)
+    if _not_modified(dataset):
+        return _respond(dataset, [], status=304)
+    dataset.generate()
+    metric = request.args.get('metric', 'amount')
+    if not metric in [m.name for m in dataset.metrics]:
+        abort(400)
+    drilldowns = _list('drilldown')
+    order = [(k, d == 'desc') for k, d in _pairs('order')]
+    if any([k != metric and not k in drilldowns for k, d in order]):
+        abort(400)
+    try:
+        result = dataset.aggregate(metric=metric,
+            drilldowns=drilldowns, cuts=_cuts(dataset),
+            page=_int('page', 1, minimum=1),
+            pagesize=_int('pagesize', 10000, minimum=1), order=order)
+    except KeyError:
+        abort(400)
+    def body():
+        yield '{"summary": %s, "drilldown": ' % _dumps(result['summary'])
+        for part in _stream_list(result['drilldown']):
+            yield part
+        yield '}'
+    return _respond(dataset, body())
+
+@app.route('/api/<dataset>/entries')
+def entries(dataset):
+    """ List the entries of a dataset, optionally reduced to some
+    ``keys``, filtered by ``cut`` and capped at ``limit``. The entries
+    are streamed as they are read from the database. """
+    dataset = _get_ds(dataset)
+    if _not_modified(dataset):
+        return _respond(dataset, [], status=304)
+    dataset.generate()
+    keys = _list('keys') or None
+    cuts = _cuts(dataset)
+    limit = _int('limit', 0) or None
+    try:
+        for key in keys or []:
+            dataset.key(key)
+    except KeyError:
+        abort(400)
+    records = dataset.materialize(keys=keys, cuts=cuts)
+    return _respond(dataset, _stream_list(islice(records, limit)))
+
+@app.route('/api/<dataset>/<dimension>/members')
+def members(dataset, dimension):
+    """ List the members of a dimension of a dataset. """
+    dataset = _get_ds(dataset)
+    if _not_modified(dataset):
+        return _respond(dataset, [], status=304)
+    dataset.generate()
+    try:
+        dimension = dataset[dimension]
+    except KeyError:
+        abort(404)
+    if not hasattr(dimension, 'members'):
+        abort(404)
+    return _respond(dataset, _stream_list(dimension.members(dataset.bind)))
@@ -0,0 +1,84 @@
+from StringIO import StringIO
+from copy import deepcopy
+import csv
+import unittest
+
+from common import SIMPLE_MODEL, TEST_DATA, make_test_app, tear_down_test_app
+
+from spendb import core
+from spendb.model import Dataset, get_advisor
+from spendb.model.advisor import _flush_advisors
+
+class IndexAdvisorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        make_test_app()
+        model = deepcopy(SIMPLE_MODEL)
+        model['dataset']['name'] = 'advised'
+        model['mapping']['field']['facet'] = True
+        self.ds = Dataset(model)
+        self.ds.generate()
+        self.ds.load_all(csv.DictReader(StringIO(TEST_DATA)))
+        self.advisor = get_advisor(self.ds)
+        self.advisor.counts.clear()
+
+    def tearDown(self):
+        tear_down_test_app()
+        # forget the indexes created by the tests:
+        core.db.metadata.remove(self.ds.table)
+        core.db.metadata.remove(self.ds['to'].table)
+
+    def _recommended(self):
+        return [(c.table.name, c.name) for c, n in self.advisor.recommend()]
+
+    def test_facet_index(self):
+        names = [i.name for i in self.ds.table.indexes]
+        assert 'advised_entry_field_index' in names, names
+        assert 'advised_entry_time_index' not in names, names
+
+    def test_name_index(self):
+        names = [i.name for i in self.ds['to'].table.indexes]
+        assert 'advised_entity_name_index' in names, names
+
+    def test_recommend(self):
+        self.ds.aggregate(drilldowns=['to.label'],
+                          cuts=[('field', u'foo'), ('time', u'2010')],
+                          order=[('time', True)])
+        self.ds.aggregate(drilldowns=['to.name', 'function'],
+                          cuts=[('time', u'2010')])
+        rec = self._recommended()
+        assert rec==[('advised_entry', 'time'), ('advised_entity', 'label')], rec
+        assert self.advisor.usage()['time']==2, self.advisor.usage()
+
+    def test_create(self):
+        self.ds.aggregate(cuts=[('time', u'2010')])
+        created = self.advisor.create()
+        assert len(created)==1, created
+        assert self._recommended()==[], self._recommended()
+        res = self.ds.aggregate(cuts=[('time', u'2009')])
+        assert res['summary']['num_entries']==3, res
+
+    def test_flush(self):
+        core.db.session.add(self.ds)
+        core.db.session.commit()
+        self.ds.aggregate(cuts=[('time', u'2010')])
+        self.advisor.flush()
+        assert len(self.advisor.counts)==0, self.advisor.counts
+        self.ds.aggregate(cuts=[('time', u'2009')])
+        assert self.advisor.usage()['time']==2, self.advisor.usage()
+
+    def test_cached_aggregations_counted(self):
+        self.ds.aggregate(cuts=[('time', u'2010')])
+        self.ds.aggregate(cuts=[('time', u'2010')])
+        assert self.advisor.usage()['time']==2, self.advisor.usage()
+
+    def test_flush_at_exit(self):
+        core.db.session.add(self.ds)
+        core.db.session.commit()
+        self.ds.aggregate(cuts=[('time', u'2010')])
+        _flush_advisors()
+        assert len(self.advisor.counts)==0, self.advisor.counts
+        assert self.advisor.usage()['time']==1, self.advisor.usage()
+
+if __name__ == '__main__':
+    unittest.main()
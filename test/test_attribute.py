@@ -0,0 +1,45 @@
+from datetime import date
+from decimal import Decimal
+import unittest
+
+from sqlalchemy import Integer, UnicodeText, Float, Numeric, Date
+
+from spendb.model.attribute import coercer, batch_coercer, \
+    parse_date
+
+class CoercionTestCase(unittest.TestCase):
+
+    def test_parse_date(self):
+        assert parse_date('2010')==date(2010, 1, 1)
+        assert parse_date('2010-05')==date(2010, 5, 1)
+        assert parse_date(' 2010-05-17 ')==date(2010, 5, 17)
+        self.assertRaises(ValueError, parse_date, 'May 2010')
+
+    def test_coercers(self):
+        assert coercer(Float())('1.5')==1.5
+        assert coercer(Integer())('15')==15
+        assert coercer(Numeric())('1.10')==Decimal('1.10')
+        assert coercer(Date())('2009')==date(2009, 1, 1)
+        value = coercer(UnicodeText())('G\xc3\xbcnther')
+        assert value==u'G\xfcnther', value
+        self.assertRaises(ValueError, coercer(Float()), 'foo')
+
+    def test_coerce_empty_and_converted(self):
+        for type_ in (Float(), Integer(), Date(), UnicodeText()):
+            assert coercer(type_)('') is None
+            assert coercer(type_)(None) is None
+        assert coercer(Float())(2)==2
+        assert coercer(Date())(date(2010, 1, 1))==date(2010, 1, 1)
+
+    def test_batch_coercer(self):
+        coerce = batch_coercer(Date())
+        values = coerce(['2010', '2010-05-17', '2010-05-18', '', '2010'])
+        assert values==[date(2010, 1, 1), date(2010, 5, 17),
+                        date(2010, 5, 18), None, date(2010, 1, 1)], values
+        assert coerce(['2011'])==[date(2011, 1, 1)]
+        self.assertRaises(ValueError, coerce, ['May 2010'])
+        values = batch_coercer(Float())(['1.5', '1.5', 2, None])
+        assert values==[1.5, 1.5, 2, None], values
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import time
+import unittest
+
+from common import make_test_app, tear_down_test_app
+
+from bench.synthetic import BUND_MODEL, MODEL, cardinalities, generate
+from bench.suite import run, MemoryWatch
+
+class SyntheticTestCase(unittest.TestCase):
+
+    def test_cardinality(self):
+        rows = list(generate(MODEL, 500, {'to': 7, 'time': 3}))
+        assert len(rows)==500, len(rows)
+        assert len(set([r['to_name'] for r in rows]))==7
+        assert len(set([r['year'] for r in rows]))==3
+        assert len(set([r['to_label'] for r in rows]))==7
+
+    def test_bund_shape(self):
+        cards = cardinalities(BUND_MODEL, {'titel': 5000})
+        assert cards['titel']==5000, cards
+        assert 'amount' not in cards, cards
+        row = generate(BUND_MODEL, 1).next()
+        assert 'kp_id' in row, row
+        assert 'hauptfunktion_label' in row, row
+
+    def test_deterministic(self):
+        assert list(generate(MODEL, 10))==list(generate(MODEL, 10))
+
+class SuiteTestCase(unittest.TestCase):
+
+    def setUp(self):
+        make_test_app()
+
+    def tearDown(self):
+        tear_down_test_app()
+
+    def test_run(self):
+        results = run('bund', rows=50, cardinality={'to': 5}, repeats=1)
+        assert results['load']['rows_per_sec'] > 0, results['load']
+        assert results['materialize']['rows']==50, results['materialize']
+        assert len(results['aggregate'])==5, results['aggregate']
+        assert results['cardinality']['to']==5, results['cardinality']
+        assert results['materialize']['memory_increase_kb'] >= 0, \
+            results['materialize']
+
+    def test_memory_watch(self):
+        with MemoryWatch() as memory:
+            data = ' ' * (20 * 1024 * 1024)
+            time.sleep(0.05)
+        del data
+        assert memory.increase >= 15 * 1024, memory.increase
+        with MemoryWatch() as memory:
+            time.sleep(0.05)
+        assert memory.increase < 15 * 1024, memory.increase
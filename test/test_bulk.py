@@ -0,0 +1,104 @@
+from datetime import date
+import unittest
+
+from sqlalchemy.dialects.postgresql.psycopg2 import dialect as pg_dialect
+
+from common import make_test_app, tear_down_test_app
+
+from spendb import core
+from spendb.model.bulk import bulk_method, bulk_insert, csv_value
+from spendb.model.bulk import insert_copy
+
+ROWS = [
+    {'name': u'caf\xe9 "one"', 'amount': 1.5, 'day': date(2010, 1, 2)},
+    {'name': u'', 'amount': None, 'day': None},
+    {'name': None, 'amount': 3.0, 'day': date(2011, 5, 6)},
+    ]
+
+class BulkInsertTestCase(unittest.TestCase):
+
+    def setUp(self):
+        make_test_app()
+        meta = core.db.MetaData()
+        self.table = core.db.Table('bulk_test', meta,
+            core.db.Column('id', core.db.Integer, primary_key=True),
+            core.db.Column('name', core.db.UnicodeText),
+            core.db.Column('amount', core.db.Float),
+            core.db.Column('day', core.db.Date),
+            core.db.Column('status', core.db.UnicodeText, default=u'new'),
+            core.db.Column('flag', core.db.Integer, server_default='1'))
+        self.table.create(core.db.engine)
+
+    def tearDown(self):
+        self.table.drop(core.db.engine)
+        core.app.config['BULK_INSERT_METHOD'] = None
+        tear_down_test_app()
+
+    def _rows(self):
+        q = self.table.select(order_by=[self.table.c.id])
+        return [(r.name, r.amount, r.day) for r in \
+                core.db.engine.execute(q)]
+
+    def test_sqlite_method(self):
+        assert bulk_method(core.db.engine)=='executemany'
+
+    def test_methods_agree(self):
+        expected = [(r['name'], r['amount'], r['day']) for r in ROWS]
+        for method in ('executemany', 'values'):
+            core.app.config['BULK_INSERT_METHOD'] = method
+            core.db.engine.execute(self.table.delete())
+            bulk_insert(core.db.engine, self.table, ROWS)
+            assert self._rows()==expected, (method, self._rows())
+
+    def test_values_batches(self):
+        core.app.config['BULK_INSERT_METHOD'] = 'values'
+        rows = [{'name': u'n%d' % i, 'amount': float(i)} for i in range(700)]
+        bulk_insert(core.db.engine, self.table, rows)
+        assert len(self._rows())==700, len(self._rows())
+
+    def test_defaults_kept(self):
+        rows = [{'name': u'a'}, {'name': u'b', 'amount': 2.0, 'flag': 0}]
+        for method in ('executemany', 'values'):
+            core.app.config['BULK_INSERT_METHOD'] = method
+            core.db.engine.execute(self.table.delete())
+            bulk_insert(core.db.engine, self.table, rows)
+            q = self.table.select(order_by=[self.table.c.id])
+            res = [(r.name, r.amount, r.status, r.flag) for r in \
+                   core.db.engine.execute(q)]
+            assert res==[(u'a', None, u'new', 1),
+                         (u'b', 2.0, u'new', 0)], (method, res)
+
+    def test_copy(self):
+        calls = []
+        class Cursor(object):
+            def copy_expert(self, sql, fh):
+                calls.append((sql, fh.read()))
+            def close(self):
+                pass
+        class Connection(object):
+            def cursor(self):
+                return Cursor()
+        class Bind(object):
+            dialect = pg_dialect()
+            connection = Connection()
+        insert_copy(Bind(), self.table, ROWS + [{'name': u'x', 'flag': 0}])
+        assert len(calls)==2, calls
+        sql, data = calls[0]
+        assert sql=='COPY bulk_test ("amount", "day", "name", "status") ' \
+                    'FROM STDIN WITH CSV', sql
+        assert data=='1.5,2010-01-02,"caf\xc3\xa9 ""one""","new"\n' \
+                     ',,"","new"\n' \
+                     '3.0,2011-05-06,,"new"\n', data
+        sql, data = calls[1]
+        assert sql=='COPY bulk_test ("flag", "name", "status") ' \
+                    'FROM STDIN WITH CSV', sql
+        assert data=='0,"x","new"\n', data
+
+    def test_csv_value(self):
+        assert csv_value(None)=='', csv_value(None)
+        assert csv_value(u'')=='""', csv_value(u'')
+        assert csv_value(u'a "b"')=='"a ""b"""', csv_value(u'a "b"')
+        assert csv_value(u'\xe9')=='"\xc3\xa9"', csv_value(u'\xe9')
+        assert csv_value(1.5)=='1.5', csv_value(1.5)
+        assert csv_value(True)=='t', csv_value(True)
+        assert csv_value(date(2010, 1, 2))=='2010-01-02'
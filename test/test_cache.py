@@ -0,0 +1,105 @@
+from StringIO import StringIO
+import csv
+import os
+import tempfile
+import unittest
+
+from common import SIMPLE_MODEL, TEST_DATA, make_test_app, tear_down_test_app
+
+from spendb import core
+from spendb.model import Dataset
+from spendb.model.cache import AggregateCache, MemoryStore
+from spendb.model.sqlitestore import SQLiteStore
+from spendb.model.cache import get_cache
+
+class StoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def _test_store(self, store):
+        store.set('a', 'k1', 'v1')
+        store.set('a', 'k2', 'v2')
+        store.set('b', 'k1', 'v3')
+        assert store.get('a', 'k1')=='v1'
+        assert store.get('b', 'k1')=='v3'
+        store.set('b', 'k2', 'v4')
+        assert store.get('a', 'k2') is None, 'not evicted'
+        store.clear('a')
+        assert store.get('a', 'k1') is None
+        assert store.get('b', 'k2')=='v4'
+
+    def test_memory_store(self):
+        self._test_store(MemoryStore(3))
+
+    def test_sqlite_store(self):
+        self._test_store(SQLiteStore(self.path, 3))
+
+    def test_ttl(self):
+        cache = AggregateCache(MemoryStore(10), ttl=-1)
+        cache.set('a', 'k', {'x': 1})
+        assert cache.get('a', 'k') is None
+        assert cache.stats=={'hits': 0, 'misses': 1}, cache.stats
+
+    def test_key_normalised(self):
+        cache = AggregateCache(MemoryStore(10))
+        k1 = cache.key(page=1, cuts=[('a', 'b')])
+        k2 = cache.key(cuts=[['a', 'b']], page=1)
+        assert k1==k2, (k1, k2)
+
+class DatasetCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        make_test_app()
+        self.ds = Dataset(SIMPLE_MODEL)
+        self.ds.generate()
+        self.ds.load_all(csv.DictReader(StringIO(TEST_DATA)))
+        self.cache = get_cache()
+
+    def tearDown(self):
+        tear_down_test_app()
+
+    def test_aggregate_cached(self):
+        hits = self.cache.hits
+        res = self.ds.aggregate(cuts=[('field', u'foo'), ('field', u'bar')])
+        assert self.cache.hits==hits, self.cache.stats
+        res2 = self.ds.aggregate(cuts=[('field', u'bar'), ('field', u'foo')])
+        assert self.cache.hits==hits+1, self.cache.stats
+        assert res==res2, (res, res2)
+        res2['summary']['amount'] = 0
+        res3 = self.ds.aggregate(cuts=[('field', u'foo'), ('field', u'bar')])
+        assert res3==res, res3
+
+    def test_load_invalidates(self):
+        res = self.ds.aggregate()
+        assert res['summary']['num_entries']==6, res
+        self.ds.load_all(csv.DictReader(StringIO(TEST_DATA)))
+        res = self.ds.aggregate()
+        assert res['summary']['num_entries']==12, res
+
+    def test_flush_invalidates(self):
+        self.ds.aggregate()
+        self.ds.flush()
+        res = self.ds.aggregate()
+        assert res['summary']['num_entries']==0, res
+
+    def test_version_from_other_process(self):
+        core.db.session.add(self.ds)
+        core.db.session.commit()
+        res = self.ds.aggregate()
+        assert res['summary']['num_entries']==6, res
+        # as a loader in another process would, without touching the cache:
+        core.db.engine.execute(self.ds.table.insert({'amount': 1.0}))
+        table = Dataset.__table__
+        core.db.engine.execute(table.update(table.c.name==self.ds.name,
+                               {'version': table.c.version + 1}))
+        core.db.session.expire(self.ds)
+        res = self.ds.aggregate()
+        assert res['summary']['num_entries']==7, res
+
+if __name__ == '__main__':
+    unittest.main()
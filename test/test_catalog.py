@@ -0,0 +1,78 @@
+from StringIO import StringIO
+from copy import deepcopy
+import csv
+import unittest
+
+from sqlalchemy import event
+
+from common import SIMPLE_MODEL, TEST_DATA, make_test_app, tear_down_test_app
+
+from spendb import core
+from spendb.model import Dataset, SchemaCatalog
+from spendb.model.catalog import model_rev
+
+STATEMENTS = []
+LISTENING = []
+
+def _log(conn, cursor, statement, params, context, many):
+    STATEMENTS.append(statement)
+
+class SchemaCatalogTestCase(unittest.TestCase):
+
+    def setUp(self):
+        make_test_app()
+        self.model = deepcopy(SIMPLE_MODEL)
+        self.model['dataset']['name'] = 'cataloged'
+        self.model['dataset']['rollups'] = [['field']]
+        self.ds = Dataset(self.model)
+        self.ds.generate()
+        self.ds.load_all(csv.DictReader(StringIO(TEST_DATA)))
+        if not LISTENING:
+            event.listen(core.db.engine, 'before_cursor_execute', _log)
+            LISTENING.append(True)
+        self.statements = STATEMENTS
+        del self.statements[:]
+
+    def tearDown(self):
+        tear_down_test_app()
+
+    def test_recorded(self):
+        tables = SchemaCatalog.lookup(core.db.engine, 'cataloged',
+                                      model_rev(self.model))
+        assert 'cataloged_entry' in tables, tables.keys()
+        assert 'cataloged_entity' in tables, tables.keys()
+        assert 'cataloged_rollup_field' in tables, tables.keys()
+        columns = dict([(c[0], c[1]) for c in \
+                        tables['cataloged_entry']['columns']])
+        assert columns['amount']=='float', columns
+        assert columns['time']=='date', columns
+
+    def test_generate_without_reflection(self):
+        ds = Dataset(self.model)
+        ds.generate()
+        assert len(self.statements)==1, self.statements
+        assert 'schema_catalog' in self.statements[0], self.statements
+        assert 'cataloged_entity_name_index' in \
+            [i.name for i in ds['to'].table.indexes]
+        res = ds.aggregate(drilldowns=['field'])
+        assert res['summary']['num_entries']==6, res['summary']
+        assert res['summary']['amount']==2690.0, res['summary']
+
+    def test_model_change_reflects(self):
+        model = deepcopy(self.model)
+        model['mapping']['extra'] = {'type': 'value', 'column': 'extra',
+                                     'datatype': 'integer'}
+        ds = Dataset(model)
+        ds.generate()
+        assert len(self.statements) > 1, self.statements
+        assert 'extra' in ds.table.c
+        tables = SchemaCatalog.lookup(core.db.engine, 'cataloged',
+                                      model_rev(model))
+        assert tables is not None
+        assert SchemaCatalog.lookup(core.db.engine, 'cataloged',
+                                    model_rev(self.model)) is None
+
+    def test_drop_forgets(self):
+        self.ds.drop()
+        assert SchemaCatalog.lookup(core.db.engine, 'cataloged',
+                                    model_rev(self.model)) is None
@@ -0,0 +1,114 @@
+from StringIO import StringIO
+from datetime import date
+import csv
+import unittest
+
+from common import SIMPLE_MODEL, TEST_DATA, make_test_app, tear_down_test_app
+
+from spendb import core
+from spendb.model import Dataset
+from spendb.model.cube import Cube, get_cube
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+QUERIES = [
+    {},
+    {'cuts': [('field', u'foo')]},
+    {'cuts': [('field', u'foo'), ('field', u'bar')]},
+    {'cuts': [('field', u'nope')]},
+    {'cuts': [('time', u'2009'), ('to.name', u'acorp')]},
+    {'drilldowns': ['function']},
+    {'drilldowns': ['function', 'field']},
+    {'drilldowns': ['to.name', 'time'], 'cuts': [('function.name', u'food')]},
+    {'drilldowns': ['to.name', 'to.label']},
+    {'drilldowns': ['field'], 'pagesize': 2, 'page': 2},
+    {'drilldowns': ['time', 'field'], 'order': [('time', True)]},
+    {'drilldowns': ['time', 'to.name'], 'order': [('time', False),
+                                                  ('to.name', True)]},
+    ]
+
+ORDERED_QUERIES = [
+    {'drilldowns': ['to.name'], 'order': [('amount', True)]},
+    {'drilldowns': ['to.name'], 'order': [('amount', False)]},
+    {'drilldowns': ['time', 'field'], 'order': [('amount', False)],
+     'pagesize': 2, 'page': 2},
+    {'drilldowns': ['time', 'field'], 'order': [('time', True),
+                                                ('amount', True)]},
+    {'drilldowns': ['function', 'to.name'], 'pagesize': 1, 'page': 3},
+    {'metric': 'total', 'drilldowns': ['field'],
+     'order': [('total', False)], 'pagesize': 1, 'page': 2},
+    ]
+
+@unittest.skipIf(numpy is None, "NumPy is not installed")
+class CubeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        make_test_app()
+        self.ds = Dataset(SIMPLE_MODEL)
+        self.ds.generate()
+        self.ds.load_all(csv.DictReader(StringIO(TEST_DATA)))
+        self.cube = Cube(self.ds)
+
+    def tearDown(self):
+        core.app.config['AGGREGATE_ENGINE'] = 'sql'
+        tear_down_test_app()
+
+    def test_refresh(self):
+        self.cube.refresh()
+        assert self.cube.size==6, self.cube.size
+        assert len(self.cube.labels['to'])==3, self.cube.labels
+        assert self.cube.labels['time'][0]==date(2010, 1, 1)
+        assert self.cube.amount.sum()==2690
+
+    def test_same_results_as_sql(self):
+        self._assert_same_results(QUERIES)
+
+    def test_same_order_and_pages_as_sql(self):
+        self._assert_same_results(ORDERED_QUERIES)
+
+    def _assert_same_results(self, queries):
+        for query in queries:
+            sql = self.ds._aggregate(query.get('metric', 'amount'),
+                    query.get('drilldowns'), query.get('cuts'),
+                    query.get('page', 1), query.get('pagesize', 10000),
+                    query.get('order'))
+            cube = self.cube.aggregate(**query)
+            assert sql==cube, (query, sql, cube)
+
+    def test_order_by_unknown_key(self):
+        self.assertRaises(ValueError, self.cube.aggregate,
+                          drilldowns=['field'], order=[('time', True)])
+
+    def test_dataset_engine(self):
+        core.app.config['AGGREGATE_ENGINE'] = 'cube'
+        res = self.ds.aggregate(drilldowns=['function'],
+                                cuts=[('time', u'2010')])
+        assert get_cube(self.ds).loaded_at is not None
+        assert res['summary']['amount']==1000, res
+
+    def test_load_refreshes(self):
+        core.app.config['AGGREGATE_ENGINE'] = 'cube'
+        res = self.ds.aggregate()
+        assert res['summary']['num_entries']==6, res
+        self.ds.load_all(csv.DictReader(StringIO(TEST_DATA)))
+        assert get_cube(self.ds).stale
+        res = self.ds.aggregate()
+        assert res['summary']['num_entries']==12, res
+
+    def test_version_from_other_process(self):
+        core.app.config['AGGREGATE_ENGINE'] = 'cube'
+        core.db.session.add(self.ds)
+        core.db.session.commit()
+        self.ds.aggregate()
+        assert not get_cube(self.ds).stale
+        table = Dataset.__table__
+        core.db.engine.execute(table.update(table.c.name==self.ds.name,
+                               {'version': table.c.version + 1}))
+        core.db.session.expire(self.ds)
+        assert get_cube(self.ds).stale
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,12 @@
 
 
 from StringIO import StringIO
+from copy import deepcopy
+from datetime import date
 import csv
 import unittest
 
-from sqlalchemy import Integer, UnicodeText, Float
+from sqlalchemy import Integer, UnicodeText, Float, Date
 
 from common import SIMPLE_MODEL, TEST_DATA, make_test_app, tear_down_test_app
 
@@ -56,9 +58,8 @@ class DatasetTestCase(unittest.TestCase):
         cols = self.ds.table.c
         assert 'id' in cols
         assert isinstance(cols['id'].type, Integer)
-        # TODO: 
         assert 'time' in cols
-        assert isinstance(cols['time'].type, UnicodeText)
+        assert isinstance(cols['time'].type, Date)
         assert 'amount' in cols
         assert isinstance(cols['amount'].type, Float)
         assert 'field' in cols
@@ -68,6 +69,7 @@ class DatasetTestCase(unittest.TestCase):
         assert 'function_id' in cols
         assert isinstance(cols['function_id'].type, Integer)
         self.assertRaises(KeyError, cols.__getitem__, 'foo')
+        self.assertRaises(KeyError, self.ds.__getitem__, 'foo')
 
 
 class DatasetLoadTestCase(unittest.TestCase):
@@ -87,10 +89,30 @@ class DatasetLoadTestCase(unittest.TestCase):
         resn = self.engine.execute(self.ds.table.select()).fetchall()
         assert len(resn)==6,resn
         row0 = resn[0]
-        assert row0['time']=='2010', row0.items()
+        assert row0['time']==date(2010, 1, 1), row0.items()
         assert row0['amount']==200, row0.items()
         assert row0['field']=='foo', row0.items()
     
+    def test_version_counted_in_load_transaction(self):
+        binds = []
+        self.ds.invalidate = lambda bind=None: binds.append(
+            bind is not None and bind.in_transaction())
+        self.ds.load_all(self.reader, chunk_size=4)
+        assert binds==[True, True], binds
+
+    def test_load_all_chunked(self):
+        self.ds.load_all(self.reader, chunk_size=4)
+        resn = self.engine.execute(self.ds.table.select()).fetchall()
+        assert len(resn)==6,resn
+        assert resn[5]['amount']==600, resn[5].items()
+        ents = self.engine.execute(self.ds['to'].table.select()).fetchall()
+        assert len(ents)==3, ents
+
+    def test_load_all_rowwise(self):
+        self.ds.load_all(self.reader, chunk_size=None)
+        resn = self.engine.execute(self.ds.table.select()).fetchall()
+        assert len(resn)==6,resn
+
     def test_flush(self):
         self.ds.load_all(self.reader)
         resn = self.engine.execute(self.ds.table.select()).fetchall()
@@ -145,6 +167,63 @@ class DatasetLoadTestCase(unittest.TestCase):
         assert res['summary']['amount']==2690, res
         assert len(res['drilldown'])==5, res['drilldown']
 
+    def test_aggregate_typed_cut(self):
+        self.ds.load_all(self.reader)
+        res = self.ds.aggregate(cuts=[('time', u'2009')])
+        assert res['summary']['num_entries']==3, res
+        assert res['summary']['amount']==1690, res
+        res = self.ds.aggregate(cuts=[('time', date(2010, 1, 1))])
+        assert res['summary']['num_entries']==3, res
+
+    def test_aggregate_pagination(self):
+        self.ds.load_all(self.reader)
+        res = self.ds.aggregate(drilldowns=['field'], pagesize=2)
+        assert res['summary']['num_entries']==6, res
+        assert res['summary']['amount']==2690, res
+        assert len(res['drilldown'])==2, res['drilldown']
+        assert res['drilldown'][0]['amount']==1500, res['drilldown']
+        res2 = self.ds.aggregate(drilldowns=['field'], pagesize=2, page=2)
+        assert res2['summary']==res['summary'], res2
+        assert len(res2['drilldown'])==1, res2['drilldown']
+        assert res2['drilldown'][0]['field']=='bar', res2['drilldown']
+
+    def test_aggregate_empty_cut(self):
+        self.ds.load_all(self.reader)
+        res = self.ds.aggregate(cuts=[('field', u'nope')])
+        assert res['summary']['num_entries']==0, res
+        assert res['summary']['amount']==0.0, res
+
+    def test_aggregate_reuses_plan(self):
+        self.ds.load_all(self.reader)
+        res = self.ds.aggregate(drilldowns=['to.name'], cuts=[('field', u'foo')])
+        assert len(self.ds._plans)==1, self.ds._plans
+        assert res['summary']['amount']==1000, res
+        res = self.ds.aggregate(drilldowns=['to.name'], cuts=[('field', u'qux')])
+        assert len(self.ds._plans)==1, self.ds._plans
+        assert res['summary']['amount']==1500, res
+        assert len(res['drilldown'])==2, res['drilldown']
+        res = self.ds.aggregate(drilldowns=['to.name'], 
+                                cuts=[('field', u'qux'), ('field', u'bar')])
+        assert len(self.ds._plans)==2, self.ds._plans
+        assert res['summary']['amount']==1690, res
+
+    def test_aggregate_pages_share_plan(self):
+        self.ds.load_all(self.reader)
+        pages = [self.ds.aggregate(drilldowns=['to.name'], page=p,
+                                   pagesize=2)['drilldown'] for p in (1, 2, 3)]
+        assert len(self.ds._plans)==1, self.ds._plans
+        assert [len(p) for p in pages]==[2, 1, 0], pages
+        names = [r['to']['name'] for p in pages for r in p]
+        assert sorted(names)==['acorp', 'bcorp', 'ccorp'], names
+        full = self.ds.aggregate(drilldowns=['to.name'])['drilldown']
+        assert len(self.ds._plans)==1, self.ds._plans
+        assert [r['to']['name'] for r in full]==names, (full, names)
+
+    def test_aggregate_same_dimension_twice(self):
+        self.ds.load_all(self.reader)
+        res = self.ds.aggregate(drilldowns=['to.name', 'to.label'])
+        assert len(res['drilldown'])==3, res['drilldown']
+
     def test_materialize_table(self):
         self.ds.load_all(self.reader)
         itr = self.ds.materialize()
@@ -155,6 +234,133 @@ class DatasetLoadTestCase(unittest.TestCase):
         assert isinstance(row['function'], dict), row
         assert isinstance(row['to'], dict), row
 
+class DatasetUnderscoreNamesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        make_test_app()
+        model = deepcopy(SIMPLE_MODEL)
+        model['dataset']['name'] = 'under'
+        model['mapping']['to_entity'] = model['mapping'].pop('to')
+        model['mapping']['field_one'] = model['mapping'].pop('field')
+        self.ds = Dataset(model)
+        self.ds.generate()
+        self.ds.load_all(csv.DictReader(StringIO(TEST_DATA)))
+
+    def tearDown(self):
+        tear_down_test_app()
+
+    def test_materialize(self):
+        tbl = list(self.ds.materialize(batch_size=4))
+        assert len(tbl)==6, tbl
+        row = tbl[0]
+        assert row['field_one']=='foo', row
+        assert row['to_entity']['name']=='bcorp', row
+        assert row['to_entity']['label']=='Big Corp', row
+
+    def test_aggregate(self):
+        res = self.ds.aggregate(drilldowns=['to_entity.name', 'field_one'])
+        assert len(res['drilldown'])==6, res
+        row = res['drilldown'][0]
+        assert row['to_entity']['name']=='acorp', row
+        assert row['field_one']=='qux', row
+        assert row['num_entries']==1, row
+        assert row['amount']==900, row
+
+class DatasetUniqueKeysTestCase(unittest.TestCase):
+
+    def setUp(self):
+        make_test_app()
+        model = deepcopy(SIMPLE_MODEL)
+        model['dataset']['name'] = 'keyed'
+        model['dataset']['unique_keys'] = ['to.name', 'time']
+        self.ds = Dataset(model)
+        self.engine = core.db.engine
+        self.ds.generate()
+
+    def tearDown(self):
+        tear_down_test_app()
+
+    def _rows(self, data=TEST_DATA):
+        return csv.DictReader(StringIO(data))
+
+    def test_unique_columns(self):
+        cols = [c.name for c in self.ds.unique_columns]
+        assert cols==['to_id', 'time'], cols
+        idx = [i for i in self.ds.table.indexes if i.unique]
+        assert len(idx)==1, idx
+        assert [c.name for c in idx[0].columns]==cols, idx[0]
+
+    def test_reload_is_idempotent(self):
+        self.ds.load_all(self._rows())
+        self.ds.load_all(self._rows())
+        resn = self.engine.execute(self.ds.table.select()).fetchall()
+        assert len(resn)==6, resn
+
+    def test_reload_updates_in_place(self):
+        self.ds.load_all(self._rows())
+        ids = [r['id'] for r in
+               self.engine.execute(self.ds.table.select()).fetchall()]
+        self.ds.load_all(self._rows(TEST_DATA.replace('2010,200,', 
+                                                      '2010,250,')))
+        resn = self.engine.execute(self.ds.table.select()).fetchall()
+        assert [r['id'] for r in resn]==ids, resn
+        assert resn[0]['amount']==250, resn[0].items()
+        res = self.ds.aggregate()
+        assert res['summary']['amount']==2740, res
+
+    def test_duplicates_within_chunk(self):
+        data = TEST_DATA + '2010,700,foo,"bcorp","Big Corp",food,Food\n'
+        self.ds.load_all(self._rows(data))
+        resn = self.engine.execute(self.ds.table.select()).fetchall()
+        assert len(resn)==6, resn
+        assert resn[0]['amount']==700, resn[0].items()
+
+    def test_single_row_load_upserts(self):
+        self.ds.load_all(self._rows())
+        row = list(self._rows())[0]
+        row['amount'] = '10'
+        self.ds.load(row)
+        resn = self.engine.execute(self.ds.table.select()).fetchall()
+        assert len(resn)==6, resn
+        assert resn[0]['amount']==10, resn[0].items()
+
+class DatasetDataTrackingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        make_test_app()
+        core.db.session.add(Dataset(deepcopy(SIMPLE_MODEL)))
+        core.db.session.commit()
+        core.db.session.expunge_all()
+        self.ds = Dataset.query.filter_by(name='test').first()
+
+    def tearDown(self):
+        tear_down_test_app()
+
+    def test_unchanged_data_is_clean(self):
+        core.db.session.flush()
+        assert not core.db.session.dirty, core.db.session.dirty
+        assert not core.db.session.is_modified(self.ds)
+
+    def test_changed_data_is_saved(self):
+        self.ds.data['extra'] = True
+        assert core.db.session.is_modified(self.ds)
+        core.db.session.commit()
+        core.db.session.expunge_all()
+        ds = Dataset.query.filter_by(name='test').first()
+        assert ds.data['extra']==True, ds.data
+
+    def test_nested_change_is_saved(self):
+        self.ds.data['dataset']['label'] = 'changed'
+        assert core.db.session.is_modified(self.ds)
+        core.db.session.commit()
+        core.db.session.expunge_all()
+        ds = Dataset.query.filter_by(name='test').first()
+        assert ds.data['dataset']['label']=='changed', ds.data
+        ds.data['dataset'].setdefault('unique_keys', []).append('time')
+        core.db.session.commit()
+        core.db.session.expunge_all()
+        ds = Dataset.query.filter_by(name='test').first()
+        assert ds.data['dataset']['unique_keys']==['time'], ds.data
+
 if __name__ == '__main__':
     unittest.main()
-
@@ -1,4 +1,5 @@
 from StringIO import StringIO
+from copy import deepcopy
 import csv
 import unittest
 
@@ -53,6 +54,62 @@ class ComplexDimensionTestCase(unittest.TestCase):
         assert 'name' in self.entity.table.c, self.entity.table.c
         assert 'label' in self.entity.table.c, self.entity.table.c
 
+    def test_member_cache_filled_on_load(self):
+        self.ds.generate()
+        self.ds.load_all(self.reader)
+        assert len(self.entity.cache)==3, self.entity.cache
+        pk = self.entity.cache.get('bcorp')
+        row = self.engine.execute(self.entity.table.select(
+            self.entity.table.c.name=='bcorp')).fetchone()
+        assert row['id']==pk, (row, pk)
+
+    def test_member_cache_hit_skips_database(self):
+        self.ds.generate()
+        self.ds.load_all(self.reader)
+        self.engine.execute(self.entity.table.delete())
+        res = self.entity.load(self.engine, {'to_name': 'bcorp'})
+        assert res['to_id']==self.entity.cache.get('bcorp'), res
+        rows = self.engine.execute(self.entity.table.select()).fetchall()
+        assert len(rows)==0, rows
+
+    def test_member_cache_warmed_from_table(self):
+        self.ds.generate()
+        self.ds.load_all(self.reader)
+        self.entity.clear_cache()
+        assert self.entity.cache is None
+        self.entity.load(self.engine, {'to_name': 'acorp'})
+        assert len(self.entity.cache)==3, self.entity.cache
+
+    def test_member_cache_is_bounded(self):
+        self.entity.cache_size = 2
+        self.ds.generate()
+        self.ds.load_all(self.reader)
+        assert len(self.entity.cache)==2, self.entity.cache
+        assert 'bcorp' not in self.entity.cache
+        assert 'ccorp' in self.entity.cache
+
+    def test_generate_without_name_attribute(self):
+        model = deepcopy(SIMPLE_MODEL)
+        model['dataset']['name'] = 'nameless'
+        model['mapping']['to']['fields'] = [f for f in \
+            model['mapping']['to']['fields'] if f['name'] != 'name']
+        ds = Dataset(model)
+        ds.generate()
+        table = ds['to'].table
+        assert ds['to'].key_columns==['label', 'const'], ds['to'].key_columns
+        indexes = dict([(i.name, i) for i in table.indexes])
+        index = indexes[table.name + '_key_index']
+        assert index.unique, index
+        assert [c.name for c in index.columns]==['label', 'const'], index
+        ds.load_all(csv.DictReader(StringIO(TEST_DATA)))
+        rows = self.engine.execute(table.select()).fetchall()
+        assert sorted([r['label'] for r in rows])==['Another Corp',
+            'Big Corp', 'Central Corp'], rows
+        ds['to'].clear_cache()
+        ds.load_all(csv.DictReader(StringIO(TEST_DATA)))
+        rows = self.engine.execute(table.select()).fetchall()
+        assert len(rows)==3, rows
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,104 @@
+from StringIO import StringIO
+from array import array
+from datetime import date
+import csv
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from common import SIMPLE_MODEL, TEST_DATA, make_test_app, tear_down_test_app
+
+from spendb.model import Dataset
+from spendb.export import export_csv, export_json, export_columns
+from spendb.export import default_keys, _text
+
+class ExportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        make_test_app()
+        self.ds = Dataset(SIMPLE_MODEL)
+        self.ds.generate()
+        self.ds.load_all(csv.DictReader(StringIO(TEST_DATA)))
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        tear_down_test_app()
+
+    def test_materialize_keys_and_cuts(self):
+        rows = list(self.ds.materialize(keys=['to.name', 'amount'],
+                    cuts=[('field', 'foo'), ('time', '2010')]))
+        assert len(rows)==3, rows
+        assert set(rows[0].keys())==set(['to', 'amount']), rows[0]
+        assert rows[0]['to'].keys()==['name'], rows[0]
+        rows = list(self.ds.materialize(keys=['amount'],
+                    cuts=[('field', 'foo'), ('field', 'bar')]))
+        assert len(rows)==4, rows
+
+    def test_materialize_streams_results(self):
+        queries = []
+        engine = self.ds.bind
+        class Bind(object):
+            def execute(self, q):
+                queries.append(q)
+                return engine.execute(q)
+        self.ds.bind = Bind()
+        rows = list(self.ds.materialize())
+        assert len(rows)==6, rows
+        options = queries[0]._execution_options
+        assert options.get('stream_results'), options
+
+    def test_text_keeps_float_precision(self):
+        assert _text(123456789012.34)=='123456789012.34', \
+            _text(123456789012.34)
+        assert _text(0.1)=='0.1', _text(0.1)
+        assert _text(None)=='', _text(None)
+
+    def test_default_keys(self):
+        keys = default_keys(self.ds)
+        assert 'to.name' in keys, keys
+        assert 'function.label' in keys, keys
+        assert 'amount' in keys, keys
+
+    def test_export_csv(self):
+        fh = StringIO()
+        count = export_csv(self.ds, fh, keys=['to.name', 'time', 'amount'],
+                           cuts=[('to.name', 'acorp')])
+        assert count==2, count
+        rows = list(csv.DictReader(StringIO(fh.getvalue())))
+        assert len(rows)==2, rows
+        assert rows[0]['to.name']=='acorp', rows[0]
+        assert rows[0]['time'] in ('2010-01-01', '2009-01-01'), rows[0]
+
+    def test_export_json(self):
+        fh = StringIO()
+        count = export_json(self.ds, fh, batch_size=2)
+        assert count==6, count
+        lines = fh.getvalue().strip().split('\n')
+        assert len(lines)==6, lines
+        record = json.loads(lines[0])
+        assert record['to.label'] in ('Big Corp', 'Another Corp', 
+                'Central Corp'), record
+
+    def test_export_columns(self):
+        path = os.path.join(self.dir, 'out')
+        count = export_columns(self.ds, path, keys=['amount', 'time',
+                               'to.name'], batch_size=4)
+        assert count==6, count
+        meta = json.load(open(os.path.join(path, 'columns.json')))
+        assert meta['rows']==6, meta
+        types = [c['type'] for c in meta['columns']]
+        assert types==['float64', 'date32', 'utf8'], types
+        amounts = array('d')
+        amounts.fromfile(open(os.path.join(path, 'amount.values'), 'rb'), 6)
+        assert sum(amounts)==2690.0, amounts
+        days = array('i')
+        days.fromfile(open(os.path.join(path, 'time.values'), 'rb'), 6)
+        epoch = date(1970, 1, 1).toordinal()
+        assert date.fromordinal(days[0] + epoch).year in (2009, 2010), days
+        offsets = array('l')
+        offsets.fromfile(open(os.path.join(path, 'to.name.values'), 'rb'), 6)
+        data = open(os.path.join(path, 'to.name.data'), 'rb').read()
+        assert offsets[-1]==len(data)==30, (offsets, data)
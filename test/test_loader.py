@@ -0,0 +1,275 @@
+from multiprocessing import Process
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from common import SIMPLE_MODEL, TEST_DATA, make_test_app, tear_down_test_app
+
+from spendb import core
+from spendb.model import Dataset, Source
+from spendb.loader import partition_file, read_partition, parallel_load
+from spendb.loader import load_range, queue_source, load_source_range
+from spendb.loader import load_sources, sqlite_lock
+
+class PartitionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.csv')
+        os.write(fd, TEST_DATA)
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_partition_file(self):
+        ranges = partition_file(self.path, 3, min_size=1)
+        assert len(ranges)==3, ranges
+        assert ranges[0][0]==TEST_DATA.index('\n')+1, ranges
+        assert ranges[-1][1]==len(TEST_DATA), ranges
+        for (s, e), (s2, e2) in zip(ranges, ranges[1:]):
+            assert e==s2, ranges
+            assert TEST_DATA[e-1]=='\n', ranges
+
+    def test_partition_small_file(self):
+        ranges = partition_file(self.path, 3)
+        assert len(ranges)==1, ranges
+
+    def test_read_partitions(self):
+        rows = []
+        for start, end in partition_file(self.path, 4, min_size=1):
+            rows.extend(read_partition(self.path, start, end))
+        assert len(rows)==6, rows
+        assert rows[0]['to_name']=='bcorp', rows[0]
+        assert rows[5]['amount']=='600', rows[5]
+
+class ParallelLoadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        make_test_app()
+        self.ds = Dataset(SIMPLE_MODEL)
+        self.ds.generate()
+
+    def tearDown(self):
+        tear_down_test_app()
+
+    def test_memory_database_rejected(self):
+        self.assertRaises(ValueError, parallel_load, self.ds, [])
+
+    def test_load_range(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        os.write(fd, TEST_DATA)
+        os.close(fd)
+        sizes = []
+        try:
+            start, end = partition_file(path, 1)[0]
+            count = load_range(self.ds, path, start, end, chunk_size=4,
+                    callback=lambda conn, n: sizes.append(n))
+        finally:
+            os.remove(path)
+        assert count==6, count
+        assert sizes==[4, 2], sizes
+        res = self.ds.aggregate()
+        assert res['summary']['num_entries']==6, res['summary']
+
+class FileParallelLoadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        make_test_app()
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        core.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            self.db_path
+        core.db.session.remove()
+        core.db.create_all()
+        self.ds = Dataset(SIMPLE_MODEL)
+        self.ds.generate()
+        fd, self.path = tempfile.mkstemp(suffix='.csv')
+        os.write(fd, TEST_DATA)
+        os.close(fd)
+
+    def tearDown(self):
+        core.db.session.rollback()
+        core.db.drop_all()
+        core.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        # the session is bound to the engine it was created with:
+        core.db.session.remove()
+        tear_down_test_app()
+        os.remove(self.path)
+        os.remove(self.db_path)
+
+    def test_parallel_load(self):
+        ranges = []
+        total, duration = parallel_load(self.ds, [self.path], processes=2,
+            progress=lambda path, start, count, secs: ranges.append(count))
+        assert total==6, total
+        assert sum(ranges)==6, ranges
+        res = self.ds.aggregate()
+        assert res['summary']['num_entries']==6, res['summary']
+        assert res['summary']['amount']==2690, res['summary']
+
+    def test_load_sources_fingerprinted(self):
+        staging = tempfile.mkdtemp()
+        core.app.config['STAGING_DATA_PATH'] = staging
+        ctx = core.app.test_request_context()
+        ctx.push()
+        try:
+            src = Source(self.ds, 'file', 'test.csv')
+            core.db.session.add(self.ds)
+            core.db.session.add(src)
+            core.db.session.commit()
+            shutil.copy(self.path, src.staging_path)
+            total, duration = load_sources(self.ds, [src], processes=2)
+            core.db.session.commit()
+            assert total==6, total
+            assert src.file_hash is not None
+            assert not src.changed()
+            assert src.reload() is None
+        finally:
+            ctx.pop()
+            shutil.rmtree(staging)
+
+class SourceJobsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        make_test_app()
+        self.ctx = core.app.test_request_context()
+        self.ctx.push()
+        self.staging = tempfile.mkdtemp()
+        core.app.config['STAGING_DATA_PATH'] = self.staging
+        self.ds = Dataset(SIMPLE_MODEL)
+        self.src = Source(self.ds, 'file', 'test.csv')
+        core.db.session.add(self.ds)
+        core.db.session.add(self.src)
+        core.db.session.commit()
+        self.ds.generate()
+        fh = open(self.src.staging_path, 'wb')
+        fh.write(TEST_DATA)
+        fh.close()
+        self.ranges = queue_source(self.src, parts=3, min_size=1)
+        core.db.session.commit()
+
+    def tearDown(self):
+        tear_down_test_app()
+        self.ctx.pop()
+        shutil.rmtree(self.staging)
+
+    def test_partial_load_cannot_resume(self):
+        self.src.loaded_rows = 4
+        self.src.queue_load(len(self.ranges))
+        core.db.session.commit()
+        start, end = self.ranges[-1]
+        count = load_source_range(self.src, start, end,
+                                  fingerprint=self.src.fingerprint())
+        core.db.session.expire(self.src)
+        assert self.src.file_hash is None, self.src.file_hash
+        assert self.src.background_rows==count, self.src.background_rows
+        assert self.src.loaded_rows==0, self.src.loaded_rows
+        assert self.src.status=='loading', self.src.status
+
+    def test_complete_load(self):
+        fingerprint = self.src.fingerprint()
+        for start, end in reversed(self.ranges):
+            load_source_range(self.src, start, end, chunk_size=1,
+                              fingerprint=fingerprint)
+        core.db.session.expire(self.src)
+        assert self.src.file_hash==fingerprint[0], self.src.file_hash
+        assert not self.src.changed()
+        assert self.src.status=='loaded', self.src.status
+        assert self.src.background_rows==6, self.src.background_rows
+        assert self.src.loaded_rows==6, self.src.loaded_rows
+        assert self.src.load(resume=True)==6
+        res = self.ds.aggregate()
+        assert res['summary']['num_entries']==6, res['summary']
+
+    def test_failed_range(self):
+        fh = open(self.src.staging_path, 'wb')
+        fh.write(TEST_DATA.replace('600', 'x'))
+        fh.close()
+        start, end = queue_source(self.src, parts=1)[0]
+        core.db.session.commit()
+        self.assertRaises(ValueError, load_source_range, self.src, start, end)
+        core.db.session.expire(self.src)
+        assert self.src.status=='failed', self.src.status
+        assert self.src.error, self.src.error
+
+def _run_job(source, start, end):
+    # don't share the parent's connections across processes:
+    core.db.engine.dispose()
+    load_source_range(source, start, end, chunk_size=1)
+
+class FileSourceJobsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        make_test_app()
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        core.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            self.db_path
+        core.db.session.remove()
+        core.db.create_all()
+        self.ctx = core.app.test_request_context()
+        self.ctx.push()
+        self.staging = tempfile.mkdtemp()
+        core.app.config['STAGING_DATA_PATH'] = self.staging
+        self.ds = Dataset(SIMPLE_MODEL)
+        self.src = Source(self.ds, 'file', 'test.csv')
+        core.db.session.add(self.ds)
+        core.db.session.add(self.src)
+        core.db.session.commit()
+        self.ds.generate()
+        header, rows = TEST_DATA.split('\n', 1)
+        fh = open(self.src.staging_path, 'wb')
+        fh.write(header + '\n')
+        for i in range(100):
+            fh.write(rows.replace('corp"', 'corp%d"' % i))
+        fh.close()
+
+    def tearDown(self):
+        core.db.session.rollback()
+        core.db.drop_all()
+        core.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        core.db.session.remove()
+        tear_down_test_app()
+        self.ctx.pop()
+        shutil.rmtree(self.staging)
+        os.remove(self.db_path)
+        if os.path.exists(self.db_path + '.lock'):
+            os.remove(self.db_path + '.lock')
+
+    def test_sqlite_lock(self):
+        assert sqlite_lock(core.db.engine).path==self.db_path + '.lock'
+
+    def test_concurrent_ranges(self):
+        ranges = queue_source(self.src, parts=4, min_size=1)
+        core.db.session.commit()
+        assert len(ranges)==4, ranges
+        # load the attributes the jobs use before forking:
+        self.src.dataset, self.src.staging_path
+        jobs = [Process(target=_run_job, args=(self.src, start, end)) \
+                for start, end in ranges]
+        # the jobs wait for whoever holds the lock on the database:
+        lock = sqlite_lock(core.db.engine)
+        lock.acquire()
+        try:
+            for job in jobs:
+                job.start()
+            time.sleep(0.5)
+            assert all([j.is_alive() for j in jobs]), jobs
+            core.db.session.expire(self.src)
+            assert self.src.background_rows==0, self.src.background_rows
+        finally:
+            lock.release()
+        for job in jobs:
+            job.join()
+        assert [j.exitcode for j in jobs]==[0] * 4, jobs
+        core.db.session.expire(self.src)
+        assert self.src.status=='loaded', (self.src.status, self.src.error)
+        assert self.src.background_rows==600, self.src.background_rows
+        res = self.ds.aggregate()
+        assert res['summary']['num_entries']==600, res['summary']
+        assert res['summary']['amount']==100 * 2690, res['summary']
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+from copy import deepcopy
+import time
+import unittest
+
+from common import SIMPLE_MODEL, make_test_app, tear_down_test_app
+
+from spendb import core
+from spendb.model import Dataset, DatasetLogger, DatasetLogRecord
+
+class DatasetLoggerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        make_test_app()
+        self.ds = Dataset(deepcopy(SIMPLE_MODEL))
+        core.db.session.add(self.ds)
+        core.db.session.commit()
+
+    def tearDown(self):
+        tear_down_test_app()
+
+    def _count(self):
+        return DatasetLogRecord.query.count()
+
+    def test_buffered_until_full(self):
+        log = DatasetLogger(self.ds, buffer_size=3, flush_interval=60)
+        log.info("one")
+        log.warn("two")
+        assert self._count()==0, self._count()
+        log.error("three %s", 3)
+        assert self._count()==3, self._count()
+        record = self.ds.log_events.filter_by(level='ERROR').first()
+        assert record.message=='three 3', record.message
+        assert record.logger=='test', record.logger
+        log.close()
+
+    def test_flush_interval(self):
+        log = DatasetLogger(self.ds, buffer_size=100, flush_interval=0)
+        log.info("one")
+        assert self._count()==1, self._count()
+        log.close()
+
+    def test_flush_on_error(self):
+        try:
+            with DatasetLogger(self.ds) as log:
+                log.info("before the error")
+                raise ValueError()
+        except ValueError:
+            pass
+        assert self._count()==1, self._count()
+
+    def test_write_errors_not_raised(self):
+        def fail(records):
+            raise IOError("database is gone")
+        log = DatasetLogger(self.ds, buffer_size=1, flush_interval=60)
+        log._write = fail
+        errors = []
+        log.handleError = errors.append
+        log.info("one")
+        log.info("two %s")
+        log.flush()
+        assert len(errors)==3, errors
+        assert len(log.buffer)==2, log.buffer
+        del log._write
+        log.close()
+        assert self._count()==2, self._count()
+
+    def test_format_errors_not_raised(self):
+        log = DatasetLogger(self.ds, buffer_size=1, flush_interval=60)
+        errors = []
+        log.handleError = errors.append
+        log.info("one %s %s", 1)
+        assert len(errors)==1, errors
+        log.close()
+        assert self._count()==0, self._count()
+
+    def test_background(self):
+        written = []
+        log = DatasetLogger(self.ds, buffer_size=2, flush_interval=60,
+                            background=True)
+        log._write = written.extend
+        log.info("one")
+        log.info("two")
+        for i in range(100):
+            if len(written)==2:
+                break
+            time.sleep(0.01)
+        assert len(written)==2, written
+        log.info("three")
+        log.close()
+        assert len(written)==3, written
+        assert not log.thread, log.thread
@@ -0,0 +1,97 @@
+from StringIO import StringIO
+from copy import deepcopy
+import csv
+import unittest
+
+from common import SIMPLE_MODEL, TEST_DATA, make_test_app, tear_down_test_app
+
+from spendb import core
+from spendb.model import Dataset
+
+class RollupTestCase(unittest.TestCase):
+
+    def setUp(self):
+        make_test_app()
+        model = deepcopy(SIMPLE_MODEL)
+        model['dataset']['name'] = 'rolled'
+        model['dataset']['unique_keys'] = ['to.name', 'time']
+        model['dataset']['rollups'] = [['function'], ['to', 'time', 'field']]
+        self.ds = Dataset(model)
+        self.engine = core.db.engine
+        self.ds.generate()
+        self.small, self.large = self.ds.rollups
+
+    def tearDown(self):
+        tear_down_test_app()
+
+    def _load(self, data=TEST_DATA):
+        self.ds.load_all(csv.DictReader(StringIO(data)))
+
+    def _rows(self, rollup):
+        q = rollup.table.select(order_by=rollup.table.c.id)
+        return self.engine.execute(q).fetchall()
+
+    def test_generate(self):
+        assert self.small.table.name=='rolled_rollup_function'
+        assert self.large.table.name=='rolled_rollup_field_time_to'
+        cols = self.large.table.c
+        for col in ('field', 'time', 'to_id', 'amount', 'entries'):
+            assert col in cols, cols
+
+    def test_rollup_for(self):
+        assert self.ds.rollup_for([])==self.small
+        assert self.ds.rollup_for(['function'])==self.small
+        assert self.ds.rollup_for(['to', 'time'])==self.large
+        assert self.ds.rollup_for(['to', 'function']) is None
+
+    def test_load_updates_rollups(self):
+        self._load()
+        rows = self._rows(self.small)
+        assert len(rows)==2, rows
+        assert rows[0]['amount']==1790, rows[0].items()
+        assert rows[0]['entries']==4, rows[0].items()
+        assert len(self._rows(self.large))==6
+
+    def test_reload_replaces_entries(self):
+        self._load()
+        self._load(TEST_DATA.replace('2010,200,foo', '2010,250,qux'))
+        rows = self._rows(self.small)
+        assert rows[0]['amount']==1840, rows[0].items()
+        assert rows[0]['entries']==4, rows[0].items()
+        rows = self._rows(self.large)
+        assert len(rows)==6, rows
+        res = self.ds.aggregate(drilldowns=['field'])
+        assert len(res['drilldown'])==3, res
+
+    def test_aggregate_from_rollup(self):
+        self._load()
+        self.engine.execute(self.ds.table.delete())
+        res = self.ds.aggregate(drilldowns=['function'])
+        assert res['summary']['num_entries']==6, res
+        assert res['summary']['amount']==2690, res
+        assert len(res['drilldown'])==2, res['drilldown']
+        assert res['drilldown'][0]['num_entries']==4, res['drilldown']
+        assert res['drilldown'][0]['function']['name']=='food', res
+        res = self.ds.aggregate(drilldowns=['to.name'],
+                                cuts=[('time', u'2010')])
+        assert res['summary']['num_entries']==3, res
+        assert res['drilldown'][0]['to']['name']=='acorp', res['drilldown']
+        res = self.ds.aggregate(drilldowns=['function'], cuts=[('to', 1)])
+        assert res['summary']['num_entries']==0, res
+
+    def test_refresh(self):
+        self._load()
+        self.engine.execute(self.small.table.delete())
+        self.ds.refresh_rollups()
+        rows = self._rows(self.small)
+        assert len(rows)==2, rows
+        assert sorted([r['amount'] for r in rows])==[900, 1790], rows
+        assert sorted([r['entries'] for r in rows])==[2, 4], rows
+
+    def test_flush(self):
+        self._load()
+        self.ds.flush()
+        assert len(self._rows(self.small))==0
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+from copy import deepcopy
+import os
+import shutil
+import tempfile
+import unittest
+
+from common import SIMPLE_MODEL, TEST_DATA, make_test_app, tear_down_test_app
+
+from spendb import core
+from spendb.model import Dataset, Source
+
+class SourceLoadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        make_test_app()
+        self.ctx = core.app.test_request_context()
+        self.ctx.push()
+        self.staging = tempfile.mkdtemp()
+        core.app.config['STAGING_DATA_PATH'] = self.staging
+        self.engine = core.db.engine
+        self.ds = Dataset(SIMPLE_MODEL)
+        self.src = Source(self.ds, 'file', 'test.csv')
+        core.db.session.add(self.ds)
+        core.db.session.add(self.src)
+        core.db.session.commit()
+        self.ds.generate()
+        fh = open(self.src.staging_path, 'wb')
+        fh.write(TEST_DATA)
+        fh.close()
+
+    def tearDown(self):
+        tear_down_test_app()
+        self.ctx.pop()
+        shutil.rmtree(self.staging)
+
+    def test_rows(self):
+        rows = list(self.src.rows())
+        assert len(rows)==6, rows
+        assert rows[0]['to_name']=='bcorp', rows[0]
+        rows = list(self.src.rows(offset=4))
+        assert len(rows)==2, rows
+        assert rows[0]['to_name']=='ccorp', rows[0]
+
+    def test_load(self):
+        calls = []
+        def progress(count, loaded, duration):
+            calls.append((count, loaded))
+        count = self.src.load(chunk_size=4, progress=progress)
+        assert count==6, count
+        assert calls==[(4, 4), (6, 6)], calls
+        assert self.src.loaded_rows==6, self.src.loaded_rows
+        resn = self.engine.execute(self.ds.table.select()).fetchall()
+        assert len(resn)==6, resn
+
+    def test_load_resume(self):
+        self.src.loaded_rows = 4
+        core.db.session.commit()
+        count = self.src.load(chunk_size=4, resume=True)
+        assert count==6, count
+        resn = self.engine.execute(self.ds.table.select()).fetchall()
+        assert len(resn)==2, resn
+        assert resn[0]['amount']==300, resn[0].items()
+
+    def test_load_keeps_committed_chunks(self):
+        rows = list(self.src.rows())
+        rows[5]['amount'] = 'not a number'
+        self.src.rows = lambda offset=0: iter(rows[offset:])
+        self.assertRaises(ValueError, self.src.load, chunk_size=4)
+        core.db.session.rollback()
+        assert self.src.loaded_rows==4, self.src.loaded_rows
+
+    def test_progress(self):
+        self.src.queue_load(2)
+        core.db.session.commit()
+        assert self.src.progress['status']=='queued', self.src.progress
+        self.src.mark_rows(self.engine, 4)
+        self.src.mark_chunk_done(self.engine)
+        core.db.session.expire(self.src)
+        assert self.src.status=='loading', self.src.status
+        assert self.src.chunks_done==1, self.src.chunks_done
+        self.src.mark_rows(self.engine, 2)
+        self.src.mark_chunk_done(self.engine)
+        core.db.session.expire(self.src)
+        progress = self.src.progress
+        assert progress['status']=='loaded', progress
+        assert progress['loaded_rows']==6, progress
+        assert progress['duration'] >= 0, progress
+
+    def test_progress_failed(self):
+        self.src.queue_load(1)
+        core.db.session.commit()
+        self.src.mark_failed(self.engine, ValueError('broken row'))
+        core.db.session.expire(self.src)
+        assert self.src.status=='failed', self.src.status
+        assert self.src.error=='broken row', self.src.error
+
+class SourceReloadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        make_test_app()
+        self.ctx = core.app.test_request_context()
+        self.ctx.push()
+        self.staging = tempfile.mkdtemp()
+        core.app.config['STAGING_DATA_PATH'] = self.staging
+        self.engine = core.db.engine
+        model = deepcopy(SIMPLE_MODEL)
+        model['dataset']['name'] = 'sourced'
+        model['dataset']['rollups'] = [['field']]
+        self.ds = Dataset(model)
+        lines = TEST_DATA.strip().split('\n')
+        self.sources = []
+        for name, rows in (('a.csv', lines[1:4]), ('b.csv', lines[4:])):
+            src = Source(self.ds, 'file', name)
+            core.db.session.add(src)
+            self.sources.append(src)
+        core.db.session.add(self.ds)
+        core.db.session.commit()
+        self.ds.generate()
+        for src, rows in zip(self.sources, (lines[1:4], lines[4:])):
+            self._write(src, [lines[0]] + rows)
+            src.load()
+        core.db.session.commit()
+
+    def tearDown(self):
+        tear_down_test_app()
+        self.ctx.pop()
+        shutil.rmtree(self.staging)
+
+    def _write(self, src, lines):
+        fh = open(src.staging_path, 'wb')
+        fh.write('\n'.join(lines) + '\n')
+        fh.close()
+
+    def _entries(self):
+        table = self.ds.table
+        q = table.select(order_by=[table.c.id])
+        return self.engine.execute(q).fetchall()
+
+    def test_entries_tagged(self):
+        entries = self._entries()
+        assert len(entries)==6, entries
+        ids = [e['source_id'] for e in entries]
+        assert ids==[self.sources[0].id] * 3 + [self.sources[1].id] * 3, ids
+        assert self.sources[0].file_hash is not None
+        assert self.sources[0].file_size==len(TEST_DATA.split('\n')[0]) \
+            + 1 + sum([len(l) + 1 for l in TEST_DATA.split('\n')[1:4]])
+
+    def test_reload_unchanged(self):
+        before = [e['id'] for e in self._entries()]
+        for src in self.sources:
+            assert not src.changed()
+            assert src.reload() is None
+        after = [e['id'] for e in self._entries()]
+        assert before==after, (before, after)
+
+    def test_reload_changed(self):
+        src = self.sources[1]
+        self._write(src, ['year,amount,field,to_name,to_label,'
+                          'func_name,func_label',
+                          '2011,1000,foo,dcorp,D Corp,food,Food'])
+        assert src.changed()
+        assert not self.sources[0].changed()
+        assert self.sources[0].reload() is None
+        count = src.reload()
+        assert count==1, count
+        entries = self._entries()
+        assert len(entries)==4, entries
+        assert entries[-1]['amount']==1000, entries[-1]
+        res = self.ds.aggregate(drilldowns=['field'])
+        assert res['summary']['amount']==1890.0, res['summary']
+        rollup = self.ds.rollups[0]
+        rows = self.engine.execute(rollup.table.select()).fetchall()
+        totals = dict([(r['field'], (r['amount'], r['entries'])) \
+                       for r in rows])
+        assert totals=={'foo': (1700.0, 3), 'bar': (190.0, 1)}, totals
+
+if __name__ == '__main__':
+    unittest.main()
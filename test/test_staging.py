@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from common import SIMPLE_MODEL, TEST_DATA, make_test_app, tear_down_test_app
+
+from spendb import core
+from spendb.loader import partition_file, read_partition
+from spendb.model import Dataset, Source
+from spendb.staging import stage, open_staged, compression_for
+
+class StagingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'source.csv')
+        fh = open(self.path, 'wb')
+        fh.write(TEST_DATA)
+        fh.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_link(self):
+        target = os.path.join(self.dir, 'staged.csv')
+        method = stage(self.path, target)
+        assert method=='link', method
+        assert os.stat(target).st_ino==os.stat(self.path).st_ino
+        assert open_staged(target).read()==TEST_DATA
+
+    def test_restage(self):
+        target = os.path.join(self.dir, 'staged.csv')
+        stage(self.path, target)
+        stage(self.path, target)
+        assert open_staged(target).read()==TEST_DATA
+
+    def test_compressed(self):
+        for compression, suffix in (('gzip', '.gz'), ('bz2', '.bz2')):
+            target = os.path.join(self.dir, 'staged.csv' + suffix)
+            method = stage(self.path, target, compression)
+            assert method==compression, method
+            assert compression_for(target)==compression, target
+            assert open_staged(target).read()==TEST_DATA
+
+    def test_gzip_deterministic(self):
+        target = os.path.join(self.dir, 'staged.csv.gz')
+        stage(self.path, target, 'gzip')
+        first = open(target, 'rb').read()
+        stage(self.path, target, 'gzip')
+        assert open(target, 'rb').read()==first
+
+    def test_failed_restage_keeps_file(self):
+        target = os.path.join(self.dir, 'staged.csv.gz')
+        stage(self.path, target, 'gzip')
+        missing = os.path.join(self.dir, 'missing.csv')
+        self.assertRaises(IOError, stage, missing, target, 'gzip')
+        self.assertRaises(ValueError, stage, self.path, target, 'zip')
+        assert open_staged(target).read()==TEST_DATA
+        files = sorted(os.listdir(self.dir))
+        assert files==['source.csv', 'staged.csv.gz'], files
+
+    def test_unknown_compression(self):
+        target = os.path.join(self.dir, 'staged.csv')
+        self.assertRaises(ValueError, stage, self.path, target, 'zip')
+
+    def test_compressed_partition(self):
+        target = os.path.join(self.dir, 'staged.csv.gz')
+        stage(self.path, target, 'gzip')
+        ranges = partition_file(target, 4, min_size=1)
+        assert ranges==[(0, None)], ranges
+        rows = list(read_partition(target, *ranges[0]))
+        assert len(rows)==6, rows
+
+class CompressedSourceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        make_test_app()
+        self.ctx = core.app.test_request_context()
+        self.ctx.push()
+        self.staging = tempfile.mkdtemp()
+        core.app.config['STAGING_DATA_PATH'] = self.staging
+        self.path = os.path.join(self.staging, 'upload.csv')
+        fh = open(self.path, 'wb')
+        fh.write(TEST_DATA)
+        fh.close()
+        self.ds = Dataset(SIMPLE_MODEL)
+        self.src = Source(self.ds, 'file', 'test.csv', compression='bz2')
+        core.db.session.add(self.ds)
+        core.db.session.add(self.src)
+        core.db.session.commit()
+        self.ds.generate()
+
+    def tearDown(self):
+        tear_down_test_app()
+        self.ctx.pop()
+        shutil.rmtree(self.staging)
+
+    def test_load(self):
+        assert self.src.staging_path.endswith('test.csv.bz2')
+        self.src.stage(self.path)
+        assert len(list(self.src.rows()))==6
+        count = self.src.load(chunk_size=4)
+        assert count==6, count
+        res = self.ds.aggregate()
+        assert res['summary']['num_entries']==6, res['summary']
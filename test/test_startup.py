@@ -0,0 +1,10 @@
+import unittest
+
+from bench.startup import measure, loaded_lazy
+
+class StartupTestCase(unittest.TestCase):
+
+    def test_manage_imports_lazily(self):
+        duration, modules = measure('spendb.manage')
+        assert 'spendb.manage' in modules, modules
+        assert loaded_lazy(modules)==[], loaded_lazy(modules)
@@ -0,0 +1,113 @@
+from StringIO import StringIO
+import csv
+import unittest
+
+from common import SIMPLE_MODEL, TEST_DATA, make_test_app, tear_down_test_app
+
+from sqlalchemy.exc import IntegrityError
+
+from spendb import core
+from spendb.model import Dataset, OperationStats, get_stats, stored_stats
+
+class StatsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        make_test_app()
+        self.stats = get_stats()
+        self.stats.reset()
+        self.ds = Dataset(SIMPLE_MODEL)
+        self.ds.generate()
+        self.reader = csv.DictReader(StringIO(TEST_DATA))
+
+    def tearDown(self):
+        core.app.config['STATS_ENABLED'] = True
+        core.app.config['STATS_SAMPLE_RATE'] = 0.1
+        self.stats.reset()
+        tear_down_test_app()
+
+    def _ops(self):
+        return dict([(s['operation'], s) for s in self.ds.stats()])
+
+    def test_load(self):
+        self.ds.load_all(self.reader, chunk_size=4)
+        load = self._ops()['load']
+        assert load['calls']==2, load
+        assert load['timed_calls']==2, load
+        assert load['rows']==6, load
+        assert load['statements']>0, load
+        assert load['seconds']>=load['statement_seconds'], load
+        assert load['avg_ms'] is not None, load
+        insert = self._ops()['insert']
+        assert insert['calls']==2, insert
+        assert insert['rows']==6, insert
+        assert 0 < insert['statements'] <= load['statements'], (insert, load)
+
+    def test_hot_sampling(self):
+        core.app.config['STATS_SAMPLE_RATE'] = 0.0
+        self.ds.load_all(self.reader)
+        dim = self._ops()['dimension_load']
+        assert dim['calls']==2, dim
+        assert dim['timed_calls']==0, dim
+        assert dim['rows']==12, dim
+        assert dim['avg_ms'] is None, dim
+
+    def test_full_sampling(self):
+        core.app.config['STATS_SAMPLE_RATE'] = 1.0
+        self.ds.load_all(self.reader)
+        ops = self._ops()
+        assert ops['dimension_load']['timed_calls']==2, ops
+        assert ops['upsert']['calls']==ops['upsert']['timed_calls'], ops
+        assert ops['upsert']['statements']>=ops['upsert']['calls'], ops
+
+    def test_queries(self):
+        self.ds.load_all(self.reader)
+        self.ds.aggregate(drilldowns=['time'])
+        self.ds.aggregate(drilldowns=['time'])
+        records = list(self.ds.materialize())
+        ops = self._ops()
+        assert ops['aggregate']['calls']==2, ops
+        assert ops['materialize']['calls']==1, ops
+        assert ops['materialize']['rows']==len(records), ops
+        assert ops['materialize']['statements']==1, ops
+
+    def test_generator_recorded_once(self):
+        self.ds.load_all(self.reader)
+        self.stats.reset()
+        ended = []
+        end = self.stats.end
+        self.stats.end = lambda frame, *a, **kw: \
+            ended.append(a) or end(frame, *a, **kw)
+        try:
+            records = self.ds.materialize()
+            records.next()
+            # statements run by the consumer are not counted:
+            self.ds.aggregate()
+            records.next()
+            records.close()
+        finally:
+            del self.stats.end
+        materialize = self._ops()['materialize']
+        assert materialize['rows']==2, materialize
+        assert materialize['statements']==1, materialize
+        assert len([a for a in ended if a[1]=='materialize'])==2, ended
+
+    def test_disabled(self):
+        core.app.config['STATS_ENABLED'] = False
+        self.ds.load_all(self.reader)
+        assert self.ds.stats()==[], self.ds.stats()
+
+    def test_flush(self):
+        self.ds.load_all(self.reader)
+        self.stats.flush()
+        assert self.ds.stats()==[], self.ds.stats()
+        self.ds.load_all(csv.DictReader(StringIO(TEST_DATA)))
+        self.stats.flush()
+        stored = dict([(s['operation'], s) for s in stored_stats('test')])
+        assert stored['load']['calls']==2, stored
+        assert stored['load']['rows']==12, stored
+        table = OperationStats.__table__
+        rows = core.db.engine.execute(table.select(
+            table.c.operation=='load')).fetchall()
+        assert len(rows)==1, rows
+        self.assertRaises(IntegrityError, core.db.engine.execute,
+            table.insert({'dataset': 'test', 'operation': 'load'}))
@@ -0,0 +1,64 @@
+from copy import deepcopy
+import shutil
+import tempfile
+import unittest
+
+from common import SIMPLE_MODEL, TEST_DATA, make_test_app, tear_down_test_app
+
+from spendb import core
+from spendb.model import Dataset, Source
+
+try:
+    core.app.config['CELERY_ALWAYS_EAGER'] = True
+    from spendb import tasks
+except ImportError:
+    tasks = None
+
+@unittest.skipIf(tasks is None, "flask-celery is not installed")
+class TasksTestCase(unittest.TestCase):
+
+    def setUp(self):
+        make_test_app()
+        self.staging = tempfile.mkdtemp()
+        core.app.config['STAGING_DATA_PATH'] = self.staging
+        model = deepcopy(SIMPLE_MODEL)
+        model['dataset']['rollups'] = [['field']]
+        self.ds = Dataset(model)
+        self.src = Source(self.ds, 'file', 'test.csv')
+        core.db.session.add(self.ds)
+        core.db.session.add(self.src)
+        core.db.session.commit()
+        self.ds.generate()
+        with core.app.test_request_context():
+            fh = open(self.src.staging_path, 'wb')
+            fh.write(TEST_DATA)
+            fh.close()
+
+    def tearDown(self):
+        tear_down_test_app()
+        shutil.rmtree(self.staging)
+
+    def test_load_source(self):
+        res = tasks.load_source.delay(self.src.id, parts=3, chunk_size=1,
+                                      min_size=1)
+        assert res.get()==3, res.get()
+        src = Source.query.get(self.src.id)
+        core.db.session.refresh(src)
+        assert src.status=='loaded', src.status
+        assert src.background_rows==6, src.background_rows
+        assert src.loaded_rows==6, src.loaded_rows
+        assert src.chunks_done==3, src.chunks_done
+        res = self.ds.aggregate()
+        assert res['summary']['num_entries']==6, res['summary']
+
+    def test_refresh_rollups(self):
+        tasks.load_source.delay(self.src.id).get()
+        table = self.ds.rollups[0].table
+        core.db.engine.execute(table.delete())
+        tasks.refresh_rollups.delay(self.ds.name).get()
+        rows = core.db.engine.execute(table.select()).fetchall()
+        totals = dict([(r['field'], r['amount']) for r in rows])
+        assert totals=={'foo': 1000, 'bar': 190, 'qux': 1500}, totals
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+from StringIO import StringIO
+from copy import deepcopy
+import csv
+import json
+import unittest
+
+from common import SIMPLE_MODEL, TEST_DATA, make_test_app, tear_down_test_app
+
+from spendb import core
+from spendb.model import Dataset
+
+class WebTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = make_test_app()
+        ds = Dataset(deepcopy(SIMPLE_MODEL))
+        core.db.session.add(ds)
+        core.db.session.commit()
+        ds.generate()
+        ds.load_all(csv.DictReader(StringIO(TEST_DATA)))
+        self.ds = ds
+
+    def tearDown(self):
+        tear_down_test_app()
+
+    def test_aggregate(self):
+        res = self.app.get('/api/test/aggregate?drilldown=to.name'
+                           '&cut=time:2010&order=amount:desc')
+        assert res.status_code==200, res.status
+        data = json.loads(res.data)
+        assert data['summary']['num_entries']==3, data['summary']
+        assert len(data['drilldown'])==3, data['drilldown']
+        assert data['drilldown'][0]['to']['name']=='acorp', data['drilldown']
+        res = self.app.get('/api/test/aggregate?drilldown=field'
+                           '&order=field:asc|amount:asc')
+        assert res.status_code==200, res.status
+        data = json.loads(res.data)
+        fields = [d['field'] for d in data['drilldown']]
+        assert fields==['bar', 'foo', 'qux'], fields
+
+    def test_aggregate_bad_request(self):
+        res = self.app.get('/api/test/aggregate?drilldown=nope')
+        assert res.status_code==400, res.status
+        res = self.app.get('/api/test/aggregate?cut=time')
+        assert res.status_code==400, res.status
+        res = self.app.get('/api/test/aggregate?cut=time:foo')
+        assert res.status_code==400, res.status
+        res = self.app.get('/api/test/aggregate?cut=amount:x')
+        assert res.status_code==400, res.status
+        res = self.app.get('/api/test/aggregate?metric=field')
+        assert res.status_code==400, res.status
+        res = self.app.get('/api/test/aggregate?metric=amount)%20desc--')
+        assert res.status_code==400, res.status
+        res = self.app.get('/api/test/aggregate?drilldown=field'
+                           '&order=time:desc')
+        assert res.status_code==400, res.status
+        res = self.app.get('/api/test/aggregate?page=0')
+        assert res.status_code==400, res.status
+        res = self.app.get('/api/test/aggregate?pagesize=-1')
+        assert res.status_code==400, res.status
+        res = self.app.get('/api/test/entries?cut=time:foo')
+        assert res.status_code==400, res.status
+        res = self.app.get('/api/test/entries?cut=nope:foo')
+        assert res.status_code==400, res.status
+        res = self.app.get('/api/nope/aggregate')
+        assert res.status_code==404, res.status
+
+    def test_entries(self):
+        res = self.app.get('/api/test/entries')
+        data = json.loads(res.data)
+        assert len(data)==6, data
+        assert data[0]['to']['label'] in ('Big Corp', 'Another Corp',
+            'Central Corp'), data[0]
+        res = self.app.get('/api/test/entries?keys=amount|to.name'
+                           '&cut=field:foo&limit=2')
+        data = json.loads(res.data)
+        assert len(data)==2, data
+        assert set(data[0].keys())==set(['amount', 'to']), data[0]
+
+    def test_members(self):
+        res = self.app.get('/api/test/to/members')
+        data = json.loads(res.data)
+        assert [m['name'] for m in data]==['acorp', 'bcorp', 'ccorp'], data
+        res = self.app.get('/api/test/field/members')
+        data = json.loads(res.data)
+        assert data==['bar', 'foo', 'qux'], data
+        res = self.app.get('/api/test/amount/members')
+        assert res.status_code==404, res.status
+
+    def test_not_modified(self):
+        res = self.app.get('/api/test/aggregate?drilldown=field')
+        etag = res.headers.get('ETag')
+        assert etag, res.headers
+        res = self.app.get('/api/test/aggregate?drilldown=field',
+                           headers={'If-None-Match': etag})
+        assert res.status_code==304, res.status
+        assert res.data=='', res.data
+        self.ds.load_all(csv.DictReader(StringIO(TEST_DATA)))
+        res = self.app.get('/api/test/aggregate?drilldown=field',
+                           headers={'If-None-Match': etag})
+        assert res.status_code==200, res.status
+        assert res.headers.get('ETag')!=etag, res.headers